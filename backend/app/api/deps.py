@@ -1,21 +1,28 @@
+import uuid
 from collections.abc import Generator
-from typing import Annotated
+from typing import Annotated, Any
 
 import jwt
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordBearer
 from jwt.exceptions import InvalidTokenError
 from pydantic import ValidationError
+from sqlalchemy.orm import make_transient_to_detached
 from sqlmodel import Session
 
 from app.core import security
+from app.core.cache import Cache
 from app.core.config import settings
 from app.core.db import engine
+from app.core.ratelimit import LLMBudget, client_ip, limiter
 from app.models import TokenPayload, User
 
 reusable_oauth2 = OAuth2PasswordBearer(
     tokenUrl=f"{settings.API_V1_STR}/login/access-token"
 )
+optional_oauth2 = OAuth2PasswordBearer(
+    tokenUrl=f"{settings.API_V1_STR}/login/access-token", auto_error=False
+)
 
 
 def get_db() -> Generator[Session, None, None]:
@@ -25,20 +32,74 @@ def get_db() -> Generator[Session, None, None]:
 
 SessionDep = Annotated[Session, Depends(get_db)]
 TokenDep = Annotated[str, Depends(reusable_oauth2)]
+OptionalTokenDep = Annotated[str | None, Depends(optional_oauth2)]
 
 
-def get_current_user(session: SessionDep, token: TokenDep) -> User:
+# Column values of recently loaded users by id, per worker (never shared:
+# they include the password hash), each tagged with the user's generation
+user_cache = Cache(
+    "users", ttl_seconds=settings.AUTH_USER_CACHE_TTL_SECONDS, backend=None
+)
+# Per user, a random token in the shared tier that invalidate_user replaces,
+# so every worker drops its cached copy on the next lookup. Outlives any
+# cached copy tagged with the token it replaced.
+user_generations = Cache(
+    "user_generations",
+    ttl_seconds=2 * settings.AUTH_USER_CACHE_TTL_SECONDS,
+    max_bytes=0,
+)
+
+
+def decode_token(token: str) -> TokenPayload:
     try:
         payload = jwt.decode(
             token, settings.SECRET_KEY, algorithms=[security.ALGORITHM]
         )
-        token_data = TokenPayload(**payload)
+        return TokenPayload(**payload)
     except (InvalidTokenError, ValidationError):
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Could not validate credentials",
         )
-    user = session.get(User, token_data.sub)
+
+
+def load_user(session: Session, user_id: Any) -> User | None:
+    """
+    ``session.get(User, user_id)``, answered from the user cache when
+    possible. A cached user is attached to ``session`` as if it had been
+    loaded, so routes can update or delete it as usual.
+    """
+    key = str(user_id)
+    generation = user_generations.get(key)
+    entry = user_cache.get(key)
+    if entry is not None and entry["generation"] == generation:
+        cached = entry["user"]
+        uid = uuid.UUID(cached["id"])
+        loaded = session.identity_map.get(session.identity_key(User, uid))
+        if loaded is not None:
+            return loaded  # type: ignore[no-any-return]
+        restored = User(**{**cached, "id": uid})
+        make_transient_to_detached(restored)
+        session.add(restored)
+        return restored
+    user = session.get(User, user_id)
+    if user is not None:
+        user_cache.set(
+            key, {"generation": generation, "user": user.model_dump(mode="json")}
+        )
+    return user
+
+
+def invalidate_user(user_id: Any) -> None:
+    """Drop a user from every worker's cache after changing or deleting it."""
+    key = str(user_id)
+    user_cache.delete(key)
+    user_generations.set(key, uuid.uuid4().hex)
+
+
+def get_current_user(session: SessionDep, token: TokenDep) -> User:
+    token_data = decode_token(token)
+    user = load_user(session, token_data.sub)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     if not user.is_active:
@@ -55,3 +116,48 @@ def get_current_active_superuser(current_user: CurrentUser) -> User:
             status_code=403, detail="The user doesn't have enough privileges"
         )
     return current_user
+
+
+def get_optional_user_id(session: SessionDep, token: OptionalTokenDep) -> str | None:
+    """
+    Id of the authenticated caller, None for anonymous callers and invalid
+    tokens. Tokens carrying an ``active`` claim (AUTH_TOKEN_CLAIMS) are
+    trusted without loading the user, so a user deactivated after the token
+    was issued keeps their own LLM budget until it expires; without the
+    claim the user is loaded and must be active.
+    """
+    if not token:
+        return None
+    try:
+        token_data = decode_token(token)
+    except HTTPException:
+        return None
+    if settings.AUTH_TOKEN_CLAIMS and token_data.active is not None:
+        return token_data.sub if token_data.active else None
+    try:
+        user_id = uuid.UUID(token_data.sub)
+    except (TypeError, ValueError):
+        return None
+    user = load_user(session, user_id)
+    return str(user.id) if user and user.is_active else None
+
+
+OptionalUserId = Annotated[str | None, Depends(get_optional_user_id)]
+
+
+def get_llm_budget(request: Request, user_id: OptionalUserId) -> LLMBudget:
+    """
+    Throttle LLM routes: one request from the caller's requests-per-minute
+    bucket now, and a handle to charge LLM tokens against tokens-per-minute.
+    """
+    if user_id:
+        identity = f"user:{user_id}"
+        rpm, tpm = settings.RATE_LIMIT_USER_RPM, settings.RATE_LIMIT_USER_TPM
+    else:
+        identity = f"ip:{client_ip(request)}"
+        rpm, tpm = settings.RATE_LIMIT_IP_RPM, settings.RATE_LIMIT_IP_TPM
+    limiter.check_request(identity, rpm)
+    return LLMBudget(limiter, identity, tpm)
+
+
+LLMBudgetDep = Annotated[LLMBudget, Depends(get_llm_budget)]
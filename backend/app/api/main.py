@@ -1,6 +1,6 @@
 from fastapi import APIRouter
 
-from app.api.routes import items, login, private, users, utils
+from app.api.routes import items, login, private, profile, users, utils
 from app.api.routes.generate import router as generate_router
 from app.api.routes.simulate import router as simulate_router
 from app.api.routes.lint import router as lint_router
@@ -12,6 +12,7 @@ api_router = APIRouter()
 api_router.include_router(login.router)
 api_router.include_router(users.router)
 api_router.include_router(utils.router)
+api_router.include_router(profile.router)
 api_router.include_router(items.router)
 api_router.include_router(generate_router)
 api_router.include_router(simulate_router)
@@ -1,11 +1,22 @@
-from fastapi import APIRouter
+from typing import Callable, Dict, List, Optional
+
+from fastapi import APIRouter, HTTPException
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from typing import List, Optional, Dict, Any
-import os
-from openai import OpenAI
 
+from app.api.deps import LLMBudgetDep
 from app.core.config import settings
+from app.core.conversations import (
+    ConversationNotFound,
+    TextEdit,
+    VersionMismatch,
+    compact_history,
+    conversations,
+)
+from app.core.llm_router import LLMRequest
+from app.core.llm_router import router as llm_router
+from app.core.prompts import chat_messages, editor_context, summary_messages
+from app.core.ratelimit import LLMBudget
 
 router = APIRouter(prefix="/chat", tags=["chat"])
 
@@ -14,102 +25,154 @@ class ChatMessage(BaseModel):
     content: str
 
 class ChatContext(BaseModel):
-    code: str
+    # Full document; optional once the conversation holds it
+    code: Optional[str] = None
     filePath: Optional[str] = None
     language: Optional[str] = "verilog"
     selection: Optional[str] = None
     cursorLine: Optional[int] = None
 
+class DocumentEdit(BaseModel):
+    start: int
+    end: int
+    text: str
+
 class ChatRequest(BaseModel):
+    # Without a conversation_id, messages is the full history and
+    # context.code the full document. With one, the server keeps both:
+    # messages only carries the new turn (the full history when the
+    # conversation is new to the server) and the document is updated from
+    # context.code or from edits made against base_version.
     messages: List[ChatMessage]
     context: Optional[ChatContext] = None
     isAgentic: Optional[bool] = False
+    conversation_id: Optional[str] = None
+    base_version: Optional[int] = None
+    edits: Optional[List[DocumentEdit]] = None
+
+CHAT_MAX_TOKENS = 4096
+CHAT_SUMMARY_MAX_TOKENS = 512
+
+def summarize_history(messages: List[Dict[str, str]]) -> str:
+    llm_req = LLMRequest(
+        request_class="chat",
+        messages=summary_messages(messages),
+        max_tokens=CHAT_SUMMARY_MAX_TOKENS,
+        temperature=0.2,
+    )
+    return "".join(llm_router.stream(llm_req))
 
-def stream_openai(messages: List[Dict[str, str]]):
+def stream_llm(
+    messages: List[Dict[str, str]],
+    budget: LLMBudget,
+    on_reply: Optional[Callable[[str], None]] = None,
+):
     import json
-    
-    if not settings.OPENAI_API_KEY:
-        error_msg = json.dumps({"error": "OPENAI_API_KEY is not set in the backend environment. Please add it to your .env file."})
-        yield f"data: {error_msg}\n\n"
-        yield "data: [DONE]\n\n"
-        return
 
-    client = OpenAI(api_key=settings.OPENAI_API_KEY)
-    
+    prompt = "".join(m["content"] for m in messages)
+    reply = ""
     try:
-        stream = client.chat.completions.create(
-            model="gpt-4o",
-            messages=messages,
-            stream=True,
-        )
-        
-        for chunk in stream:
-            if chunk.choices[0].delta.content is not None:
-                content = chunk.choices[0].delta.content
-                data = json.dumps({"content": content})
-                yield f"data: {data}\n\n"
+        llm_req = LLMRequest(request_class="chat", messages=messages, max_tokens=CHAT_MAX_TOKENS)
+        for content in llm_router.stream(llm_req):
+            reply += content
+            data = json.dumps({"content": content})
+            yield f"data: {data}\n\n"
         
         yield "data: [DONE]\n\n"
+        if on_reply is not None:
+            on_reply(reply)
 
     except Exception as e:
         error_msg = json.dumps({"error": str(e)})
         yield f"data: {error_msg}\n\n"
         yield "data: [DONE]\n\n"
+    finally:
+        budget.settle(prompt, reply)
+
+def context_message(context: Optional[ChatContext], document: Optional[str]) -> Optional[str]:
+    """The editor state for this turn"""
+    if context is None and document is None:
+        return None
+    context = context or ChatContext()
+    return editor_context(
+        file_path=context.filePath,
+        cursor_line=context.cursorLine,
+        document=document,
+        selection=context.selection,
+    )
+
+
+def sync_conversation(
+    conversation_id: str, req: ChatRequest
+) -> tuple[str, List[Dict[str, str]], List[Dict[str, str]], int]:
+    """Update the stored conversation; returns (document, history, new messages, version)"""
+    new_messages = [m.model_dump() for m in req.messages]
+    code = req.context.code if req.context else None
+    conversation = conversations.get(conversation_id)
+    if conversation is None:
+        if code is None:
+            raise HTTPException(
+                status_code=412, detail="Conversation not found, send the full state."
+            )
+        conversation = conversations.create(
+            conversation_id, document=code, messages=new_messages[:-1]
+        )
+        new_messages = new_messages[-1:]
+    else:
+        try:
+            conversation = conversations.sync_document(
+                conversation_id,
+                document=code,
+                edits=[TextEdit(**e.model_dump()) for e in req.edits or []],
+                base_version=req.base_version,
+            )
+        except ConversationNotFound:
+            raise HTTPException(
+                status_code=412, detail="Conversation not found, send the full state."
+            )
+        except VersionMismatch as e:
+            raise HTTPException(
+                status_code=409,
+                detail=str(e),
+                headers={"X-Conversation-Version": str(e.current)},
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    history = conversations.history(conversation_id, settings.CHAT_HISTORY_TOKEN_BUDGET)
+    return conversation.document, history, new_messages, conversation.version
+
 
 @router.post("/stream")
-def chat_stream(req: ChatRequest):
-    # Build the messages list
-    final_messages = []
-    
-    # Add System / Context message
-    if req.isAgentic:
-        # Agentic mode: focus on code changes with formatted description
-        system_content = """You are an expert Verilog code editor assistant. When the user requests code changes, you should:
-
-1. Provide a brief description of what you're changing and why (2-4 sentences)
-2. Then provide the complete modified code in a verilog code block
-
-FORMATTING GUIDELINES:
-- Use markdown formatting for emphasis (bold, italic, bullet points, etc.)
-- Keep the description concise and focused on WHAT changed and WHY
-- Use bullet points (•) to list multiple changes clearly
-- Then provide the full modified code in a ```verilog code block
-
-Example response format:
-"I've added an **active-low reset signal** to your module. The reset will asynchronously clear the output when asserted low.
-
-Key changes:
-• Added `rst_n` input port
-• Modified assign statement with ternary operator
-• Output clears to 0 on reset
-
-```verilog
-[full code here]
-```"
-
-Keep descriptions clear and professional. Use markdown to highlight important terms.
-"""
+def chat_stream(req: ChatRequest, budget: LLMBudgetDep):
+    headers = {}
+    on_reply = None
+    document: Optional[str]
+
+    if req.conversation_id is not None:
+        conversation_id = req.conversation_id
+        document, history, new_messages, version = sync_conversation(conversation_id, req)
+        headers["X-Conversation-Version"] = str(version)
+
+        def on_reply(reply: str) -> None:
+            conversations.append(
+                conversation_id, new_messages + [{"role": "assistant", "content": reply}]
+            )
+            conversations.compact(
+                conversation_id, summarize_history, settings.CHAT_HISTORY_TOKEN_BUDGET
+            )
     else:
-        # Normal chat mode: conversational assistant
-        system_content = "You are an expert Verilog hardware engineering assistant. You help users write, debug, and simulate Verilog code.\n"
-    
-    if req.context:
-        system_content += f"\nContext:\nFile: {req.context.filePath or 'Unknown'}\n"
-        if req.context.cursorLine is not None:
-            system_content += f"Cursor Line: {req.context.cursorLine}\n"
-        
-        system_content += f"\nCurrent Code Content:\n```verilog\n{req.context.code}\n```\n"
-        
-        if req.context.selection:
-            system_content += f"\nSelected Code:\n```verilog\n{req.context.selection}\n```\n"
-    
-    final_messages.append({"role": "system", "content": system_content})
-    
-    for msg in req.messages:
-        final_messages.append(msg.model_dump())
+        document = req.context.code if req.context else None
+        messages = [m.model_dump() for m in req.messages]
+        history = compact_history(messages[:-1], document, settings.CHAT_HISTORY_TOKEN_BUDGET)
+        new_messages = messages[-1:]
 
-    return StreamingResponse(
-        stream_openai(final_messages),
-        media_type="text/event-stream"
+    final_messages = chat_messages(
+        bool(req.isAgentic), history, new_messages, context_message(req.context, document)
     )
 
+    budget.charge("".join(m["content"] for m in final_messages), CHAT_MAX_TOKENS)
+    return StreamingResponse(
+        stream_llm(final_messages, budget, on_reply),
+        media_type="text/event-stream",
+        headers=headers,
+    )
@@ -1,57 +1,62 @@
 # app/api/routes/generate.py
 
-from typing import Any, Dict
+from dataclasses import asdict
+from typing import Callable, Iterable, Iterator
 import json
-import traceback
-import requests
 import re
 
 from fastapi import APIRouter, HTTPException
 from fastapi.responses import StreamingResponse
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
-from google.auth import default
-from google.auth.transport.requests import Request
-from google.auth.exceptions import DefaultCredentialsError
+from app.api.deps import LLMBudgetDep
+from app.core.cache import Cache
 from app.core.config import settings
+from app.core.context import build_completion_context, documents
+from app.core.llm import (
+    CompletionSuperseded,
+    cancellable,
+    completion_sessions,
+    request_key,
+    singleflight,
+)
+from app.core.llm_router import LLMRequest, NoProviderAvailable, router as llm_router
+from app.core.prompts import completion_messages
+from app.core.ratelimit import LLMBudget
+from app.core.syntax import missing_closers, rank_completions
 
 router = APIRouter(prefix="/generate", tags=["generate"])
 
+# Finished completion texts by upstream request, shared by all workers
+completion_cache = Cache("completions", ttl_seconds=settings.CACHE_COMPLETION_TTL_SECONDS)
+
 
 class GenerateRequest(BaseModel):
-    prompt: str
+    prompt: str = ""
     suffix: str = ""
+    # Whole-document mode: send the document and the cursor offset and the
+    # server picks the context. The document is kept per session_id, so it
+    # can be omitted while it has not changed. document_version is the
+    # editor's version of it: a request without the document gets 412 unless
+    # the server holds that exact version.
+    document: str | None = None
+    document_version: int | None = None
+    cursor: int | None = None
     max_tokens: int = 150
     temperature: float = 0.4
+    # Completion session protocol: the editor tags requests with its
+    # session/document id and an increasing sequence number so that older
+    # in-flight requests of the same session can be cancelled.
+    session_id: str | None = None
+    seq: int | None = None
+    # Alternative completions to generate and rank (non-streaming only)
+    n: int = Field(default=1, ge=1, le=5)
 
 
 class GenerateResponse(BaseModel):
     text: str
-
-
-def get_access_token() -> str:
-    """
-    Load ADC and return a fresh OAuth2 token with cloud-platform scope.
-    """
-    try:
-        creds, _ = default(scopes=["https://www.googleapis.com/auth/cloud-platform"])
-    except DefaultCredentialsError as e:
-        raise RuntimeError(
-            "Could not load Application Default Credentials.  Ensure that either:\n"
-            "  • GOOGLE_APPLICATION_CREDENTIALS is set to a service-account JSON file\n"
-            "  • or you ran `gcloud auth application-default login` inside this container.\n"
-            f"Underlying error: {e}"
-        ) from e
-
-    try:
-        creds.refresh(Request())
-    except Exception as e:
-        traceback.print_exc()
-        raise RuntimeError("Failed to refresh ADC; see logs for details.") from e
-
-    if not creds.token:
-        raise RuntimeError("Failed to obtain a valid access token from ADC.")
-    return creds.token
+    # All distinct candidates, best first (text is the first one)
+    candidates: list[str] = []
 
 
 def clean_completion(text: str) -> str:
@@ -85,169 +90,211 @@ def clean_completion(text: str) -> str:
     return text
 
 
-def ensure_proper_closure(text: str, prefix: str) -> str:
-    """Ensure that blocks opened in prefix are properly closed in completion"""
-    combined = prefix + text
-    
-    # Count module/endmodule
-    module_count = len(re.findall(r'\bmodule\s+\w+', combined))
-    endmodule_count = combined.count('endmodule')
-    
-    # If we have unclosed modules, add endmodule
-    if module_count > endmodule_count:
-        # Check if the completion already tried to close but was cut off
-        if not text.strip().endswith('endmodule'):
-            text = text.rstrip() + '\nendmodule'
-    
-    # Count function/endfunction
-    function_count = len(re.findall(r'\bfunction\s+', combined))
-    endfunction_count = combined.count('endfunction')
-    
-    if function_count > endfunction_count:
-        if not text.strip().endswith('endfunction'):
-            text = text.rstrip() + '\nendfunction'
-    
-    # Count task/endtask
-    task_count = len(re.findall(r'\btask\s+', combined))
-    endtask_count = combined.count('endtask')
-    
-    if task_count > endtask_count:
-        if not text.strip().endswith('endtask'):
-            text = text.rstrip() + '\nendtask'
-    
-    # Count begin/end blocks
-    begin_count = combined.count('begin')
-    end_count = len(re.findall(r'\bend\b', combined))
-    
-    if begin_count > end_count:
-        # Add missing 'end' statements
-        for _ in range(begin_count - end_count):
-            text = text.rstrip() + '\n    end'
-    
+def ensure_proper_closure(text: str, prefix: str, suffix: str = "") -> str:
+    """Ensure that blocks left open by the completion are properly closed, in nesting order"""
+    if not text.strip():
+        return text
+    for closer in missing_closers(prefix, text, suffix):
+        text = text.rstrip() + ("\n    end" if closer == "end" else f"\n{closer}")
     return text
 
 
+def completion_request(
+    prompt_text: str, suffix: str, max_tokens: int, temperature: float, stop: list[str]
+) -> LLMRequest:
+    """Completion request in both chat form and fill-in-the-middle form"""
+    return LLMRequest(
+        request_class="completion",
+        messages=completion_messages(prompt_text, suffix),
+        prompt=prompt_text,
+        suffix=suffix,
+        max_tokens=max_tokens,
+        temperature=temperature,
+        stop=stop,
+    )
+
+
+def completion_context(req: GenerateRequest) -> tuple[str, str]:
+    """Prefix and suffix to complete between, from the document or the raw prompt"""
+    document = req.document
+    if document is not None and req.session_id is not None:
+        documents.put(req.session_id, document, req.document_version)
+    elif document is None and req.cursor is not None and req.session_id is not None:
+        document = documents.get(req.session_id, req.document_version)
+        if document is None:
+            raise HTTPException(
+                status_code=412, detail="Document not cached, send it again."
+            )
+
+    if document is None or req.cursor is None:
+        return req.prompt, req.suffix
+    return build_completion_context(
+        document, req.cursor, settings.COMPLETION_CONTEXT_TOKENS
+    )
+
+
+def upstream_chunks(
+    llm_req: LLMRequest, req: GenerateRequest
+) -> Callable[[], Iterable[str]]:
+    """
+    A completion of the same upstream request finished recently (by any
+    worker) is replayed from the cache as a single chunk.
+
+    Session requests can be cancelled by a newer request of the same session
+    and are not coalesced, since cancelling a shared call would cut off the
+    other waiters. Everything else shares identical in-flight calls.
+    """
+    cancel = None
+    if req.session_id is not None and req.seq is not None:
+        # Before the cache lookup: a hit also supersedes older requests
+        cancel = completion_sessions.begin(req.session_id, req.seq)
+    key = request_key(asdict(llm_req))
+    cached = completion_cache.get(key)
+    if cached is not None:
+        return lambda: [cached]
+
+    def chunks() -> Iterator[str]:
+        if cancel is not None:
+            upstream = cancellable(
+                llm_router.stream(llm_req, hedge=settings.LLM_HEDGE_COMPLETIONS),
+                cancel,
+                llm_req.max_tokens,
+            )
+        else:
+            upstream = singleflight.stream(
+                key, lambda: llm_router.stream(llm_req, hedge=settings.LLM_HEDGE_COMPLETIONS)
+            )
+        parts = []
+        for chunk in upstream:
+            parts.append(chunk)
+            yield chunk
+        # Only completions that ran to the end (not cancelled or cut off)
+        if parts:
+            completion_cache.set(key, "".join(parts))
+
+    return chunks
+
+
+def ranked_completions(
+    llm_req: LLMRequest, req: GenerateRequest, budget: LLMBudget
+) -> GenerateResponse:
+    """
+    ``req.n`` candidates, cleaned, closed and ranked by the syntax check so
+    the editor can offer the alternatives. A newer request of the same
+    session stops the upstream calls. Like single completions, the raw
+    candidates are cached per upstream request and ``n``, and calls outside
+    a session are coalesced.
+    """
+    cancel = None
+    if req.session_id is not None and req.seq is not None:
+        cancel = completion_sessions.begin(req.session_id, req.seq)
+    key = request_key({**asdict(llm_req), "n": req.n})
+    candidates: list[str] = []
+    try:
+        cached = completion_cache.get(key)
+        if cached is not None:
+            candidates = cached
+        else:
+            if cancel is not None:
+                candidates = llm_router.complete_n(llm_req, req.n, cancel)
+            else:
+                candidates = singleflight.do(key, lambda: llm_router.complete_n(llm_req, req.n))
+            if candidates:
+                completion_cache.set(key, candidates)
+    finally:
+        budget.settle(llm_req.prompt + llm_req.suffix, "".join(candidates))
+    if cancel is not None and cancel.is_set():
+        raise CompletionSuperseded()
+
+    cleaned = [
+        ensure_proper_closure(clean_completion(c), llm_req.prompt, llm_req.suffix)
+        for c in candidates
+    ]
+    ranked = rank_completions(llm_req.prompt, cleaned, llm_req.suffix)
+    return GenerateResponse(text=ranked[0] if ranked else "", candidates=ranked)
+
+
 @router.post("/", response_model=GenerateResponse)
-def generate(req: GenerateRequest):
-    """Generate code completion (non-streaming) using OpenAI"""
-    from openai import OpenAI
-    
-    prompt_text = req.prompt.strip()
+def generate(req: GenerateRequest, budget: LLMBudgetDep):
+    """Generate code completion (non-streaming) from the fastest healthy provider"""
+    prompt_text, suffix_text = completion_context(req)
+    prompt_text = prompt_text.strip()
 
     if not prompt_text:
         raise HTTPException(status_code=400, detail="Prompt must not be empty.")
 
-    # Check for OpenAI API key
-    if not settings.OPENAI_API_KEY:
-        raise HTTPException(
-            status_code=500,
-            detail="OPENAI_API_KEY is not configured. Please add it to your .env file."
-        )
+    llm_req = completion_request(
+        prompt_text,
+        suffix_text,
+        max_tokens=req.max_tokens * 2,  # Increased to ensure we can fit closing statements
+        temperature=req.temperature,
+        stop=["\n\n\n\n"],  # Only stop on excessive blank lines (4+ newlines)
+    )
+    budget.charge(prompt_text + suffix_text, llm_req.max_tokens * req.n)
 
     try:
-        client = OpenAI(api_key=settings.OPENAI_API_KEY)
-        
-        # Build a completion-focused prompt
-        system_prompt = """You are a Verilog code completion assistant. Complete the code naturally and concisely.
-Only return the completion code, no explanations or markdown.
-Focus on syntactically correct Verilog that fits the context.
-Always close blocks properly (endmodule, endfunction, endtask, end)."""
-
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": f"Complete this Verilog code:\n\n{prompt_text}"}
-            ],
-            max_tokens=req.max_tokens * 2,  # Increased to ensure we can fit closing statements
-            temperature=req.temperature,
-            stop=["\n\n\n\n"],  # Only stop on excessive blank lines (4+ newlines)
-        )
+        if req.n > 1:
+            return ranked_completions(llm_req, req, budget)
+
+        generated_text = ""
+        try:
+            generated_text = "".join(upstream_chunks(llm_req, req)())
+        finally:
+            # Also refunds superseded and failed requests
+            budget.settle(prompt_text + suffix_text, generated_text)
 
-        generated_text = response.choices[0].message.content or ""
-        
         # Clean up the completion
         generated_text = clean_completion(generated_text)
-        
-        # Ensure proper closure of any blocks
-        generated_text = ensure_proper_closure(generated_text, prompt_text)
+
+        # Ensure proper closure of any blocks not already closed after the cursor
+        generated_text = ensure_proper_closure(generated_text, prompt_text, suffix_text)
 
         return GenerateResponse(text=generated_text)
 
+    except CompletionSuperseded:
+        raise HTTPException(
+            status_code=409, detail="Superseded by a newer completion request."
+        )
+    except NoProviderAvailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"OpenAI API error: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"LLM provider error: {str(e)}")
 
 
 @router.post("/stream")
-async def generate_stream(req: GenerateRequest):
+def generate_stream(req: GenerateRequest, budget: LLMBudgetDep):
     """Generate code completion with streaming for real-time feedback"""
-    prompt_text = req.prompt.strip()
-    suffix_text = req.suffix.strip()
+    prompt_text, suffix_text = completion_context(req)
+    prompt_text = prompt_text.strip()
+    suffix_text = suffix_text.strip()
 
     if not prompt_text:
         raise HTTPException(status_code=400, detail="Prompt must not be empty.")
 
-    try:
-        access_token = get_access_token()
-    except RuntimeError as e:
-        raise HTTPException(status_code=500, detail=str(e))
-
-    # Build FIM prompt
-    if suffix_text:
-        final_prompt = f"<fim_prefix>{prompt_text}<fim_suffix>{suffix_text}<fim_middle>"
-    else:
-        final_prompt = prompt_text
-
-    url = f"https://{settings.VERTEX_LOCATION}-aiplatform.googleapis.com/v1/projects/{settings.VERTEX_PROJECT_NUMBER}/locations/{settings.VERTEX_LOCATION}/publishers/mistralai/models/codestral-2501:streamRawPredict"
-
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json",
-    }
-
-    payload = {
-        "model": "codestral-2501",
-        "prompt": final_prompt,
-        "max_tokens": req.max_tokens,
-        "temperature": req.temperature,
-        "stream": True,
-        "stop": ["\n\n\n", "endmodule", "endfunction", "endtask"],
-    }
+    llm_req = completion_request(
+        prompt_text,
+        suffix_text,
+        max_tokens=req.max_tokens,
+        temperature=req.temperature,
+        stop=["\n\n\n", "endmodule", "endfunction", "endtask"],
+    )
+    budget.charge(prompt_text + suffix_text, llm_req.max_tokens)
+    chunks = upstream_chunks(llm_req, req)
 
     def stream_generator():
+        accumulated = ""
         try:
-            with requests.post(
-                url, json=payload, headers=headers, stream=True, timeout=15
-            ) as response:
-                response.raise_for_status()
-                accumulated = ""
-
-                for line in response.iter_lines():
-                    if not line:
-                        continue
-
-                    decoded = line.decode("utf-8").strip()
-                    if decoded.startswith("data: "):
-                        decoded = decoded[6:]
-
-                    if decoded == "[DONE]":
-                        break
-
-                    try:
-                        data = json.loads(decoded)
-                        choices = data.get("choices", [])
-                        if choices:
-                            delta = choices[0].get("delta", {})
-                            content = delta.get("content", "")
-                            if content:
-                                accumulated += content
-                                # Clean and yield incrementally
-                                cleaned = clean_completion(accumulated)
-                                yield f"data: {json.dumps({'text': cleaned})}\n\n"
-                    except json.JSONDecodeError:
-                        continue
-
+            for content in chunks():
+                accumulated += content
+                # Clean and yield incrementally
+                cleaned = clean_completion(accumulated)
+                yield f"data: {json.dumps({'text': cleaned})}\n\n"
+
+        except CompletionSuperseded:
+            yield f"data: {json.dumps({'cancelled': True})}\n\n"
         except Exception as e:
             yield f"data: {json.dumps({'error': str(e)})}\n\n"
+        finally:
+            budget.settle(prompt_text + suffix_text, accumulated)
 
     return StreamingResponse(stream_generator(), media_type="text/event-stream")
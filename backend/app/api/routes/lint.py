@@ -5,8 +5,16 @@ import re
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
 
+from app.core import metrics, tracing
+from app.core.cache import Cache
+from app.core.config import settings
+from app.core.llm import request_key
+
 router = APIRouter(prefix="/lint", tags=["lint"])
 
+# Diagnostics by source, shared by all workers
+lint_cache = Cache("lint", ttl_seconds=settings.CACHE_LINT_TTL_SECONDS)
+
 class LintRequest(BaseModel):
     code: str
 
@@ -21,16 +29,22 @@ class LintResponse(BaseModel):
 
 @router.post("/", response_model=LintResponse)
 def lint(req: LintRequest):
+    key = request_key({"code": req.code})
+    cached = lint_cache.get(key)
+    if cached is not None:
+        return LintResponse(**cached)
+
     # Write code to a temp .v file
     with tempfile.NamedTemporaryFile(suffix=".v", delete=False) as f:
         path = f.name
         f.write(req.code.encode())
         print(f"Temporary file created at: {path}")
     try:
-        cp = subprocess.run(
-            ["verilator", "--lint-only", "--Wall", path],
-            capture_output=True, text=True
-        )
+        with tracing.span("lint.verilator"), metrics.timed(metrics.VERILATOR_LINT_SECONDS):
+            cp = subprocess.run(
+                ["verilator", "--lint-only", "--Wall", path],
+                capture_output=True, text=True
+            )
     except FileNotFoundError:
         raise HTTPException(500, "Verilator is not installed in the container")
 
@@ -38,19 +52,22 @@ def lint(req: LintRequest):
 
     diags = []
     print(cp.stdout)
-    # Regex to capture: %Error: <file>:<line>:<col>: <message>
-    pattern = re.compile(r"^%(Error|Warning):[^:]+:(\d+):(\d+):\s*(.+)$")
-    for line in cp.stdout.splitlines() + cp.stderr.splitlines():
-        m = pattern.match(line)
-        if not m:
-            continue  # skip any lines that don't match
-        sev_tag, ln, col, msg = m.groups()
-        severity = "error" if sev_tag == "Error" else "warning"
-        diags.append(Diagnostic(
-            line=int(ln),
-            column=int(col),
-            severity=severity,
-            message=msg.strip()
-        ))
+    with tracing.span("lint.parse"):
+        # Regex to capture: %Error: <file>:<line>:<col>: <message>
+        pattern = re.compile(r"^%(Error|Warning):[^:]+:(\d+):(\d+):\s*(.+)$")
+        for line in cp.stdout.splitlines() + cp.stderr.splitlines():
+            m = pattern.match(line)
+            if not m:
+                continue  # skip any lines that don't match
+            sev_tag, ln, col, msg = m.groups()
+            severity = "error" if sev_tag == "Error" else "warning"
+            diags.append(Diagnostic(
+                line=int(ln),
+                column=int(col),
+                severity=severity,
+                message=msg.strip()
+            ))
     print(f"Diagnostics found: {diags}")
-    return LintResponse(diagnostics=diags)
+    response = LintResponse(diagnostics=diags)
+    lint_cache.set(key, response.model_dump())
+    return response
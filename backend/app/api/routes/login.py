@@ -6,8 +6,13 @@ from fastapi.responses import HTMLResponse
 from fastapi.security import OAuth2PasswordRequestForm
 
 from app import crud
-from app.api.deps import CurrentUser, SessionDep, get_current_active_superuser
-from app.core import security
+from app.api.deps import (
+    CurrentUser,
+    SessionDep,
+    get_current_active_superuser,
+    invalidate_user,
+)
+from app.core import metrics, security
 from app.core.config import settings
 from app.core.security import get_password_hash
 from app.models import Message, NewPassword, Token, UserPublic
@@ -32,13 +37,18 @@ def login_access_token(
         session=session, email=form_data.username, password=form_data.password
     )
     if not user:
+        metrics.LOGINS.labels("failure").inc()
         raise HTTPException(status_code=400, detail="Incorrect email or password")
     elif not user.is_active:
+        metrics.LOGINS.labels("inactive").inc()
         raise HTTPException(status_code=400, detail="Inactive user")
+    metrics.LOGINS.labels("success").inc()
     access_token_expires = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
     return Token(
         access_token=security.create_access_token(
-            user.id, expires_delta=access_token_expires
+            user.id,
+            expires_delta=access_token_expires,
+            claims={"active": user.is_active} if settings.AUTH_TOKEN_CLAIMS else None,
         )
     )
 
@@ -95,6 +105,7 @@ def reset_password(session: SessionDep, body: NewPassword) -> Message:
     user.hashed_password = hashed_password
     session.add(user)
     session.commit()
+    invalidate_user(user.id)
     return Message(message="Password updated successfully")
 
 
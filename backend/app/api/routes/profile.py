@@ -0,0 +1,99 @@
+import os
+from dataclasses import asdict
+from typing import Any, Literal
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import PlainTextResponse
+
+from app.api.deps import get_current_active_superuser
+from app.core.profiler import (
+    ProfilerBusy,
+    ProfilerUnavailable,
+    child_pids,
+    collapsed,
+    memory_tracker,
+    memory_usage,
+    rss_bytes,
+    sample_cpu,
+)
+
+# Each request profiles the worker that serves it; responses carry its pid
+router = APIRouter(
+    prefix="/profile",
+    tags=["profile"],
+    dependencies=[Depends(get_current_active_superuser)],
+)
+
+
+@router.get("/cpu/", response_class=PlainTextResponse)
+def cpu_profile(
+    seconds: float = Query(default=10, gt=0, le=60),
+    interval_ms: float = Query(default=5, ge=1, le=1000),
+    mode: Literal["thread", "py-spy"] = "thread",
+) -> PlainTextResponse:
+    """
+    Sample the stacks of this worker for a while and return them collapsed
+    (flamegraph.pl / speedscope input).
+    """
+    try:
+        stacks = sample_cpu(seconds, interval_ms / 1000, mode)
+    except ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except ProfilerUnavailable as e:
+        raise HTTPException(status_code=501, detail=str(e))
+    return PlainTextResponse(
+        collapsed(stacks),
+        headers={
+            "X-Worker-Pid": str(os.getpid()),
+            "X-Profile-Samples": str(sum(stacks.values())),
+        },
+    )
+
+
+@router.post("/memory/start/")
+def start_memory_tracing(frames: int = Query(default=1, ge=1, le=50)) -> dict[str, Any]:
+    """
+    Start tracemalloc in this worker. Tracing slows allocations down, so stop
+    it when done.
+    """
+    memory_tracker.start(frames)
+    return {"pid": os.getpid(), "tracing": True, "rss_bytes": rss_bytes()}
+
+
+@router.get("/memory/snapshot/")
+def memory_snapshot(limit: int = Query(default=25, ge=1, le=500)) -> dict[str, Any]:
+    """
+    Top allocation sites of this worker, by growth since the previous snapshot.
+    """
+    try:
+        result = memory_tracker.snapshot(limit)
+    except ProfilerUnavailable as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {"pid": os.getpid(), **result, "top": [asdict(s) for s in result["top"]]}
+
+
+@router.post("/memory/stop/")
+def stop_memory_tracing() -> dict[str, Any]:
+    memory_tracker.stop()
+    return {"pid": os.getpid(), "tracing": False, "rss_bytes": rss_bytes()}
+
+
+@router.get("/memory/workers/")
+def worker_memory() -> dict[str, Any]:
+    """
+    RSS, PSS and USS of the server master (this worker's parent) and of each
+    of its workers. The sum of the PSS values is what the box really spends.
+    """
+    master = os.getppid()
+    usages = [memory_usage(pid) for pid in [master, *child_pids(master)]]
+    if usages[0] is None:
+        raise HTTPException(
+            status_code=501, detail="/proc/<pid>/smaps_rollup is not readable"
+        )
+    workers = [asdict(u) for u in usages[1:] if u is not None]
+    return {
+        "pid": os.getpid(),
+        "master": asdict(usages[0]),
+        "workers": workers,
+        "total_pss": sum(u.pss for u in usages if u is not None),
+    }
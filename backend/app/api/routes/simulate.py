@@ -9,8 +9,17 @@ from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
 from fastapi.responses import FileResponse
 
+from app.core import iverilog, metrics, tracing
+from app.core.cache import Cache
+from app.core.config import settings
+from app.core.llm import request_key
+
 router = APIRouter(prefix="/simulate", tags=["simulate"])
 
+# Simulation results by design, testbench and simulator version, shared by
+# all workers. The cached VCD id must still have its file on this box.
+simulate_cache = Cache("simulate", ttl_seconds=settings.CACHE_SIMULATE_TTL_SECONDS)
+
 # VCD storage directory
 VCD_STORAGE = Path("backend/vcd_files")
 VCD_STORAGE.mkdir(parents=True, exist_ok=True)
@@ -28,36 +37,59 @@ class SimulateResponse(BaseModel):
 
 @router.post("/", response_model=SimulateResponse)
 def simulate(req: SimulateRequest):
-    logs = ""
-
     # Check if iverilog is available
-    try:
-        subprocess.run(["iverilog", "-V"], capture_output=True, check=True)
-    except (subprocess.CalledProcessError, FileNotFoundError):
+    with tracing.span("simulate.iverilog_version"):
+        installed = iverilog.version() is not None
+    if not installed:
         raise HTTPException(
             status_code=500,
             detail="iverilog is not installed or not in PATH. Please install iverilog on the server.",
         )
 
+    key = request_key(
+        {"code": req.code, "testbench": req.testbench, "iverilog": iverilog.version()}
+    )
+    cached = simulate_cache.get(key)
+    if cached is not None and (
+        cached["vcd_id"] is None
+        or (VCD_STORAGE / f"{cached['vcd_id']}_test.vcd").exists()
+    ):
+        return SimulateResponse(**cached)
+
+    response = run_simulation(req)
+    simulate_cache.set(key, response.model_dump())
+    return response
+
+
+def run_simulation(req: SimulateRequest) -> SimulateResponse:
+    logs = ""
     try:
-        with tempfile.TemporaryDirectory() as tmpdir:
+        with (
+            metrics.SIMULATIONS_IN_FLIGHT.track_inprogress(),
+            tempfile.TemporaryDirectory() as tmpdir,
+        ):
             module_v = os.path.join(tmpdir, "module.v")
             tb_v = os.path.join(tmpdir, "tb.v")
             out_vvp = os.path.join(tmpdir, "sim.vvp")
             vcd_path = os.path.join(tmpdir, "test.vcd")
 
-            with open(module_v, "w") as f:
-                f.write(req.code)
-            with open(tb_v, "w") as f:
-                f.write(req.testbench)
+            with tracing.span("simulate.setup"):
+                with open(module_v, "w") as f:
+                    f.write(req.code)
+                with open(tb_v, "w") as f:
+                    f.write(req.testbench)
 
             try:
-                cp = subprocess.run(
-                    ["iverilog", "-o", out_vvp, module_v, tb_v],
-                    capture_output=True,
-                    text=True,
-                    check=True,
-                )
+                with (
+                    tracing.span("simulate.iverilog"),
+                    metrics.timed(metrics.IVERILOG_COMPILE_SECONDS.labels("simulate")),
+                ):
+                    cp = subprocess.run(
+                        ["iverilog", "-o", out_vvp, module_v, tb_v],
+                        capture_output=True,
+                        text=True,
+                        check=True,
+                    )
                 logs += cp.stdout + cp.stderr
             except subprocess.CalledProcessError as e:
                 logs += f"\n[Compiler error]\n{e.stdout}{e.stderr}"
@@ -68,9 +100,13 @@ def simulate(req: SimulateRequest):
             os.chdir(tmpdir)
 
             try:
-                cp = subprocess.run(
-                    ["vvp", out_vvp], capture_output=True, text=True, check=True
-                )
+                with (
+                    tracing.span("simulate.vvp"),
+                    metrics.timed(metrics.VVP_RUN_SECONDS),
+                ):
+                    cp = subprocess.run(
+                        ["vvp", out_vvp], capture_output=True, text=True, check=True
+                    )
                 logs += cp.stdout + cp.stderr
             except subprocess.CalledProcessError as e:
                 logs += f"\n[Simulation error]\n{e.stdout}{e.stderr}"
@@ -82,12 +118,15 @@ def simulate(req: SimulateRequest):
             # Check if VCD file was generated and persist it
             vcd_id = None
             if os.path.exists(vcd_path):
+                vcd_bytes = os.path.getsize(vcd_path)
+                metrics.VCD_BYTES.observe(vcd_bytes)
                 # Generate unique ID for this simulation
                 vcd_id = str(uuid.uuid4())[:8]
                 stored_vcd = VCD_STORAGE / f"{vcd_id}_test.vcd"
 
                 # Copy VCD to persistent storage
-                shutil.copyfile(vcd_path, stored_vcd)
+                with tracing.span("simulate.vcd_copy", **{"vcd.bytes": vcd_bytes}):
+                    shutil.copyfile(vcd_path, stored_vcd)
 
                 logs += (
                     f"\n✅ VCD waveform file generated successfully (ID: {vcd_id}).\n"
@@ -1,20 +1,38 @@
+import json
 import re
+import threading
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import asdict, dataclass, replace
+
 from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from openai import OpenAI
 
+from app.api.deps import LLMBudgetDep
+from app.core import iverilog, tracing, verilog
 from app.core.config import settings
+from app.core.llm import request_key, singleflight
+from app.core.llm_router import LLMRequest, NoProviderAvailable, router as llm_router
+from app.core.prompts import repair_messages, stimulus_messages, testbench_messages
+from app.core.ratelimit import LLMBudget
+from app.core.testbench import Skeleton, StimulusIndenter, build_skeleton
 
 router = APIRouter(prefix="/tb", tags=["tb"])
 
 
 class GenerateRequest(BaseModel):
     prompt: str
+    # Compile the testbench with iverilog and let the model repair errors
+    verify: bool = False
 
 
 class GenerateResponse(BaseModel):
     text: str
     module_name: str
+    # Only set with verify=true when iverilog is available
+    verified: bool | None = None
+    compile_errors: str | None = None
 
 
 def strip_code_fences(code: str) -> str:
@@ -29,6 +47,59 @@ def strip_code_fences(code: str) -> str:
     return cleaned.strip()
 
 
+_FENCE_LINE = re.compile(r"^\s*```[\w-]*\s*$")
+
+
+class CodeFenceStripper:
+    """
+    Incremental counterpart of strip_code_fences for streamed text: drops
+    fence lines and leading whitespace. Only a line that might still turn
+    out to be a fence is held back; everything else is passed through as
+    soon as it arrives.
+    """
+
+    def __init__(self) -> None:
+        self._line = ""  # held back start of the current line
+        self._passthrough = False  # current line is known not to be a fence
+        self._started = False
+
+    def _emit(self, text: str) -> str:
+        if not self._started:
+            text = text.lstrip()
+            self._started = bool(text)
+        return text
+
+    def feed(self, chunk: str) -> str:
+        out = []
+        while chunk:
+            newline = chunk.find("\n")
+            piece, chunk = (chunk, "") if newline == -1 else (chunk[: newline + 1], chunk[newline + 1 :])
+            if self._passthrough:
+                out.append(self._emit(piece))
+            else:
+                self._line += piece
+                if self._line.endswith("\n"):
+                    if not _FENCE_LINE.match(self._line):
+                        out.append(self._emit(self._line))
+                    self._line = ""
+                    continue
+                head = self._line.lstrip()
+                if head and not head.startswith("```") and not "```".startswith(head):
+                    out.append(self._emit(self._line))
+                    self._line = ""
+                    self._passthrough = True
+                    continue
+            if piece.endswith("\n"):
+                self._passthrough = False
+        return "".join(out)
+
+    def close(self) -> str:
+        line, self._line = self._line, ""
+        if _FENCE_LINE.match(line):
+            return ""
+        return self._emit(line)
+
+
 def extract_module_name(verilog_code: str) -> str:
     """
     Extract the module name from Verilog code.
@@ -41,123 +112,281 @@ def extract_module_name(verilog_code: str) -> str:
     return "module"
 
 
+def testbench_request(user_code: str) -> tuple[LLMRequest, Skeleton | None]:
+    """
+    When the DUT's ports can be parsed the testbench is built from a
+    skeleton and the LLM only writes the stimulus; otherwise it writes the
+    whole testbench.
+    """
+    skeleton = build_skeleton(user_code)
+    if skeleton is None:
+        return LLMRequest(
+            request_class="testbench",
+            messages=testbench_messages(user_code),
+            temperature=0.6,
+            max_tokens=2000,  # Testbenches can be longer
+        ), None
+    return LLMRequest(
+        request_class="testbench",
+        messages=stimulus_messages(user_code, skeleton.text),
+        temperature=0.6,
+        max_tokens=800,
+    ), skeleton
+
+
+def first_code_line(text: str) -> str | None:
+    """The first complete line of ``text`` that is not blank or a comment, if any."""
+    for line in text.splitlines(True):
+        if not line.endswith("\n"):
+            return None
+        if line.strip() and not line.lstrip().startswith("//"):
+            return line
+    return None
+
+
+def writes_whole_module(line: str) -> bool:
+    return re.match(r"\s*module\s", line) is not None
+
+
+def assemble_testbench(generated: str, skeleton: Skeleton | None) -> str:
+    cleaned = strip_code_fences(generated)
+    # A model that wrote a whole testbench anyway gets its own back
+    if skeleton is None or re.search(r"^\s*module\s", cleaned, re.MULTILINE):
+        return cleaned
+    return skeleton.fill(cleaned)
+
+
+@dataclass
+class Candidate:
+    testbench: str
+    result: iverilog.CompileResult | None
+    prompt: str
+    completion: str
+
+
+def run_candidate(
+    dut: str,
+    llm_req: LLMRequest,
+    skeleton: Skeleton | None,
+    temperature: float,
+    done: threading.Event,
+) -> Candidate:
+    """Generate, compile and repair one candidate until it compiles or runs out of rounds."""
+    messages = llm_req.messages
+    candidate = Candidate(testbench="", result=None, prompt="", completion="")
+    for _ in range(settings.TB_VERIFY_REPAIR_ROUNDS + 1):
+        output = ""
+        stream = llm_router.stream(replace(llm_req, messages=messages, temperature=temperature))
+        try:
+            for chunk in stream:
+                output += chunk
+                if done.is_set():
+                    # Another candidate already compiled
+                    break
+        finally:
+            stream.close()
+        candidate.prompt += "".join(m["content"] for m in messages)
+        candidate.completion += output
+        if done.is_set():
+            break
+
+        candidate.testbench = assemble_testbench(output, skeleton)
+        candidate.result = iverilog.check_testbench(dut, candidate.testbench)
+        if candidate.result.ok:
+            done.set()
+            break
+        stimulus_only = skeleton is not None and candidate.testbench != strip_code_fences(output)
+        messages = repair_messages(
+            messages, output, candidate.testbench, candidate.result.errors, stimulus_only
+        )
+    return candidate
+
+
+def verified_testbench(
+    dut: str, llm_req: LLMRequest, skeleton: Skeleton | None
+) -> tuple[Candidate, iverilog.CompileResult]:
+    """
+    Race one candidate per configured temperature; the first that compiles
+    wins and stops the others. Without a winner, the candidate with the
+    shortest error output is returned.
+    """
+    done = threading.Event()
+    temperatures = settings.TB_VERIFY_TEMPERATURES
+    candidates: list[Candidate] = []
+    errors: list[BaseException] = []
+    with ThreadPoolExecutor(max_workers=len(temperatures)) as pool:
+        futures = [
+            pool.submit(tracing.in_current_context(run_candidate), dut, llm_req, skeleton, t, done)
+            for t in temperatures
+        ]
+        for future in as_completed(futures):
+            try:
+                candidates.append(future.result())
+            except Exception as e:
+                errors.append(e)
+
+    checked = [(c, c.result) for c in candidates if c.result is not None]
+    if not checked:
+        raise errors[0] if errors else NoProviderAvailable("No testbench candidate finished")
+    best, result = min(checked, key=lambda pair: (not pair[1].ok, len(pair[1].errors)))
+    # Charge the caller for every candidate, not just the winner
+    best.prompt = "".join(c.prompt for c in candidates)
+    best.completion = "".join(c.completion for c in candidates)
+    return best, result
+
+
 @router.post("/", response_model=GenerateResponse)
-def generate(req: GenerateRequest):
-    """Generate Verilog testbench using OpenAI"""
+def generate(req: GenerateRequest, budget: LLMBudgetDep) -> GenerateResponse:
+    """Generate Verilog testbench from the fastest healthy provider"""
     # 1) Validate prompt
     user_code = req.prompt.strip()
     if not user_code:
         raise HTTPException(status_code=400, detail="Prompt must not be empty.")
 
-    # 2) Check for OpenAI API key
-    if not settings.OPENAI_API_KEY:
-        raise HTTPException(
-            status_code=500,
-            detail="OPENAI_API_KEY is not configured. Please add it to your .env file."
-        )
-    
-    # VerilogAI-TB System Prompt
-    system_prompt = """You are VerilogAI-TB, an expert hardware verification assistant.
-
-## Your Task:
-Generate a simple, high-quality Verilog testbench for the provided module.
-
-## Requirements:
-1. **Module instantiation**: Correctly instantiate the DUT with all ports
-2. **Clock generator**: If clock port detected (clk, clock), generate a clock signal (#5 toggle)
-3. **Reset generator**: If reset detected (rst, reset, rst_n, reset_n), generate proper reset sequence
-4. **VCD dumping**: MUST include these exact lines in initial block:
-   ```
-   $dumpfile("test.vcd");
-   $dumpvars(0, tb);
-   ```
-5. **Test naming**: Module must be named `tb` or `<module_name>_tb`
-6. **Stimulus**: Generate simple smoke test with basic input patterns
-7. **Finish**: End simulation with `$finish;` after reasonable delay
-8. **Display**: Use `$display()` to show test progress
-
-## Code Format:
-- Return ONLY pure Verilog code
-- NO markdown formatting, NO triple backticks, NO comments outside code
-- Start directly with `module tb;` or similar
-- Keep it simple but complete
-
-## Example Structure:
-```
-module <name>_tb;
-  // Signal declarations
-  reg clk, rst;
-  reg [7:0] input_signal;
-  wire [7:0] output_signal;
-  
-  // Clock generator (if needed)
-  initial begin
-    clk = 0;
-    forever #5 clk = ~clk;
-  end
-  
-  // DUT instantiation
-  <module_name> dut (
-    .clk(clk),
-    .rst(rst),
-    .input_signal(input_signal),
-    .output_signal(output_signal)
-  );
-  
-  // Test stimulus
-  initial begin
-    $dumpfile("test.vcd");
-    $dumpvars(0, tb);
-    
-    // Reset sequence
-    rst = 1;
-    #20;
-    rst = 0;
-    
-    // Test cases
-    input_signal = 8'd10;
-    #10;
-    $display("Test 1: input=%d, output=%d", input_signal, output_signal);
-    
-    input_signal = 8'd20;
-    #10;
-    $display("Test 2: input=%d, output=%d", input_signal, output_signal);
-    
-    #50;
-    $finish;
-  end
-endmodule
-```
-
-Now generate a testbench for this module:
-"""
+    if req.verify and iverilog.available():
+        return generate_verified(user_code, budget)
 
+    prompt = generated_text = ""
     try:
-        # 3) Create OpenAI client
-        client = OpenAI(api_key=settings.OPENAI_API_KEY)
-        
-        # 4) Call OpenAI API
-        response = client.chat.completions.create(
-            model="gpt-4o",  # or "gpt-4-turbo" or "gpt-3.5-turbo"
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": f"Generate testbench for:\n\n{user_code}"}
-            ],
-            temperature=0.6,
-            max_tokens=2000,  # Testbenches can be longer
-        )
+        llm_req, skeleton = testbench_request(user_code)
+        prompt = "".join(m["content"] for m in llm_req.messages)
+        budget.charge(prompt, llm_req.max_tokens)
 
-        # 5) Extract generated text
-        generated_text = response.choices[0].message.content or ""
+        # 2) Generate on the fastest healthy provider; a whole lab asking for
+        #    the same module's testbench at once shares one upstream call
+        generated_text = singleflight.do(
+            request_key(asdict(llm_req)), lambda: "".join(llm_router.stream(llm_req))
+        )
         
-        # 6) Clean and return
-        cleaned_text = strip_code_fences(generated_text)
-        module_name = extract_module_name(user_code)
+        # 3) Clean and return
+        cleaned_text = assemble_testbench(generated_text, skeleton)
+        module_name = skeleton.module.name if skeleton else extract_module_name(user_code)
         
         return GenerateResponse(text=cleaned_text, module_name=module_name)
 
+    except NoProviderAvailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=500,
-            detail=f"OpenAI API error: {str(e)}"
+            detail=f"LLM provider error: {str(e)}"
+        )
+    finally:
+        # Also refunds failed requests
+        budget.settle(prompt, generated_text)
+
+
+def generate_verified(user_code: str, budget: LLMBudget) -> GenerateResponse:
+    dut = verilog.module_source(user_code)
+    dut_result = iverilog.check_dut(dut)
+    if not dut_result.ok:
+        raise HTTPException(
+            status_code=422, detail=f"The module does not compile:\n{dut_result.errors}"
         )
+
+    llm_req, skeleton = testbench_request(user_code)
+    prompt = "".join(m["content"] for m in llm_req.messages)
+    # Worst case: every candidate uses all its repair rounds
+    calls = len(settings.TB_VERIFY_TEMPERATURES) * (settings.TB_VERIFY_REPAIR_ROUNDS + 1)
+    budget.charge(prompt * len(settings.TB_VERIFY_TEMPERATURES), llm_req.max_tokens * calls)
+
+    verified: tuple[Candidate, iverilog.CompileResult] | None = None
+    try:
+        verified = singleflight.do(
+            request_key({"verify": True, **asdict(llm_req)}),
+            lambda: verified_testbench(dut, llm_req, skeleton),
+        )
+    except NoProviderAvailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"LLM provider error: {str(e)}")
+    finally:
+        if verified is not None:
+            budget.settle(verified[0].prompt, verified[0].completion)
+        else:
+            budget.settle(prompt, "")
+
+    candidate, result = verified
+    return GenerateResponse(
+        text=candidate.testbench,
+        module_name=skeleton.module.name if skeleton else extract_module_name(user_code),
+        verified=result.ok,
+        compile_errors=result.errors or None,
+    )
+
+
+@router.post("/stream")
+def generate_stream(req: GenerateRequest, budget: LLMBudgetDep) -> StreamingResponse:
+    """
+    Stream a testbench as server-sent events. The first event carries the
+    module name, then ``{"text": ...}`` events carry the next piece of
+    fence-stripped code, and a final ``{"done": true}`` ends the stream.
+    With a skeleton, its head is sent as soon as the first line of the
+    stimulus is in, unless that line starts a module: a model that wrote a
+    whole testbench anyway gets it streamed unwrapped.
+    """
+    user_code = req.prompt.strip()
+    if not user_code:
+        raise HTTPException(status_code=400, detail="Prompt must not be empty.")
+
+    llm_req, skeleton = testbench_request(user_code)
+    prompt = "".join(m["content"] for m in llm_req.messages)
+    budget.charge(prompt, llm_req.max_tokens)
+    module_name = skeleton.module.name if skeleton else extract_module_name(user_code)
+
+    def stream_generator() -> Iterator[str]:
+        generated = ""
+        stripper = CodeFenceStripper()
+        indenter = StimulusIndenter()
+        # Fence-stripped text held back until we know whether to wrap it
+        pending = ""
+        wrap: bool | None = None if skeleton is not None else False
+
+        def event(text: str) -> str:
+            if wrap:
+                text = indenter.feed(text)
+            return f"data: {json.dumps({'text': text})}\n\n"
+
+        def decide(text: str) -> str:
+            nonlocal wrap
+            if skeleton is None or writes_whole_module(text):
+                wrap = False
+                return ""
+            wrap = True
+            return f"data: {json.dumps({'text': skeleton.head})}\n\n"
+
+        yield f"data: {json.dumps({'module_name': module_name})}\n\n"
+        try:
+            for chunk in singleflight.stream(
+                request_key(asdict(llm_req)), lambda: llm_router.stream(llm_req)
+            ):
+                generated += chunk
+                text = stripper.feed(chunk)
+                if wrap is None:
+                    pending += text
+                    line = first_code_line(pending)
+                    if line is None:
+                        continue
+                    if head := decide(line):
+                        yield head
+                    text, pending = pending, ""
+                if text:
+                    yield event(text)
+            text = stripper.close()
+            if wrap is None:
+                text = pending + text
+                if head := decide(first_code_line(text + "\n") or ""):
+                    yield head
+            if text:
+                yield event(text)
+            if wrap and skeleton is not None:
+                yield f"data: {json.dumps({'text': skeleton.tail})}\n\n"
+            yield f"data: {json.dumps({'done': True})}\n\n"
+        except Exception as e:
+            yield f"data: {json.dumps({'error': str(e)})}\n\n"
+        finally:
+            budget.settle(prompt, generated)
+
+    return StreamingResponse(stream_generator(), media_type="text/event-stream")
@@ -1,7 +1,12 @@
+from typing import Any
+
 from fastapi import APIRouter, Depends
 from pydantic.networks import EmailStr
 
 from app.api.deps import get_current_active_superuser
+from app.core.llm import local_llm
+from app.core.llm_router import router as llm_router
+from app.core.prompts import prompt_cache
 from app.models import Message
 from app.utils import generate_test_email, send_email
 
@@ -29,3 +34,54 @@ def test_email(email_to: EmailStr) -> Message:
 @router.get("/health-check/")
 async def health_check() -> bool:
     return True
+
+
+def local_llm_status(healthy: bool) -> dict[str, bool | str | None]:
+    return {
+        "configured": local_llm.configured,
+        "healthy": healthy,
+        "server": local_llm.server,
+        "model": local_llm.model,
+    }
+
+
+@router.get("/local-llm-health/")
+def local_llm_health() -> dict[str, bool | str | None]:
+    """
+    Report whether the local inference server is configured and serving its
+    model, as of the last (briefly cached) probe.
+    """
+    return local_llm_status(local_llm.healthy())
+
+
+@router.post(
+    "/local-llm-health/",
+    dependencies=[Depends(get_current_active_superuser)],
+)
+def probe_local_llm() -> dict[str, bool | str | None]:
+    """
+    Probe the local inference server now and report the result.
+    """
+    return local_llm_status(local_llm.healthy(force=True))
+
+
+@router.get(
+    "/llm-providers/",
+    dependencies=[Depends(get_current_active_superuser)],
+)
+def llm_providers() -> dict[str, dict[str, Any]]:
+    """
+    Rolling time-to-first-token percentiles, error rates and cooldown state per provider.
+    """
+    return llm_router.snapshot()
+
+
+@router.get(
+    "/prompt-cache/",
+    dependencies=[Depends(get_current_active_superuser)],
+)
+def prompt_cache_stats() -> dict[str, dict[str, Any]]:
+    """
+    Prompt tokens and provider-cached prompt tokens per provider and request class.
+    """
+    return prompt_cache.snapshot()
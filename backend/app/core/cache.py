@@ -0,0 +1,320 @@
+"""
+Two-tier result cache shared by the workers of a box.
+
+Each ``Cache`` keeps recently used entries in an in-process LRU (the front)
+and every entry also in a shared tier, so a result computed by one worker is
+a hit for the others instead of the hit rate being split between workers.
+The shared tier is a SQLite file on local disk by default (WAL mode with the
+file memory-mapped, no service to run); set ``CACHE_REDIS_URL`` to share it
+between boxes instead (requires the ``redis`` extra), or
+``CACHE_SHARED=false`` for the front alone.
+
+Values must be JSON-serializable. An entry expires at the same absolute time
+in both tiers: a front entry filled from the shared tier keeps the remaining
+TTL of the shared one. Sizes are the length of the JSON encoding; the front
+is bounded per cache (``CACHE_MEMORY_BYTES``), the SQLite file as a whole
+(``CACHE_SQLITE_MAX_BYTES``, oldest entries evicted first).
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Callable
+from typing import Any, Protocol, TypeVar
+
+from app.core import metrics
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class CacheBackend(Protocol):
+    def get(self, key: str) -> tuple[bytes, float] | None:
+        """Value and absolute expiry (``time.time()``) of a live entry."""
+        ...
+
+    def set(self, key: str, value: bytes, expires: float) -> None: ...
+
+    def delete(self, key: str) -> None: ...
+
+    def size(self, prefix: str) -> int | None:
+        """Bytes stored under keys starting with ``prefix``, if known."""
+        ...
+
+
+class SQLiteBackend:
+    """
+    One table in a SQLite file. Connections are per thread and per process,
+    so the backend can be created before the workers are forked.
+    """
+
+    # Trim the file every this many writes
+    TRIM_EVERY = 200
+
+    def __init__(self, path: str, max_bytes: int) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self._writes = 0
+        with self._connect() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                " key TEXT PRIMARY KEY, value BLOB NOT NULL,"
+                " expires REAL NOT NULL, size INTEGER NOT NULL)"
+            )
+            db.execute(
+                "CREATE INDEX IF NOT EXISTS entries_expires ON entries (expires)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA mmap_size={self.max_bytes * 2}")
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def get(self, key: str) -> tuple[bytes, float] | None:
+        row = (
+            self._connect()
+            .execute(
+                "SELECT value, expires FROM entries WHERE key = ? AND expires > ?",
+                (key, time.time()),
+            )
+            .fetchone()
+        )
+        return (row[0], row[1]) if row else None
+
+    def set(self, key: str, value: bytes, expires: float) -> None:
+        db = self._connect()
+        db.execute(
+            "INSERT OR REPLACE INTO entries (key, value, expires, size) VALUES (?, ?, ?, ?)",
+            (key, value, expires, len(value)),
+        )
+        self._writes += 1
+        if self._writes % self.TRIM_EVERY == 0:
+            self.trim()
+
+    def delete(self, key: str) -> None:
+        self._connect().execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def trim(self) -> int:
+        """Drop expired entries, then the soonest-expiring ones until under the size limit."""
+        db = self._connect()
+        removed = db.execute(
+            "DELETE FROM entries WHERE expires <= ?", (time.time(),)
+        ).rowcount
+        total = db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total > self.max_bytes:
+            # Down to 90%, so the next few writes do not trim again
+            excess = total - self.max_bytes * 0.9
+            cursor = db.execute("SELECT key, size FROM entries ORDER BY expires")
+            doomed = []
+            for key, size in cursor:
+                doomed.append((key,))
+                excess -= size
+                if excess <= 0:
+                    break
+            db.executemany("DELETE FROM entries WHERE key = ?", doomed)
+            removed += len(doomed)
+        return removed
+
+    def size(self, prefix: str) -> int | None:
+        row = (
+            self._connect()
+            .execute(
+                "SELECT COALESCE(SUM(size), 0) FROM entries WHERE substr(key, 1, ?) = ? AND expires > ?",
+                (len(prefix), prefix, time.time()),
+            )
+            .fetchone()
+        )
+        return int(row[0])
+
+
+class RedisBackend:
+    def __init__(self, url: str) -> None:
+        import redis
+
+        self._client = redis.Redis.from_url(url)
+
+    def get(self, key: str) -> tuple[bytes, float] | None:
+        pipe = self._client.pipeline()
+        pipe.get(f"cache:{key}")
+        pipe.pttl(f"cache:{key}")
+        value, ttl_ms = pipe.execute()
+        if value is None or ttl_ms <= 0:
+            return None
+        return value, time.time() + ttl_ms / 1000
+
+    def set(self, key: str, value: bytes, expires: float) -> None:
+        ttl_ms = int((expires - time.time()) * 1000)
+        if ttl_ms > 0:
+            self._client.set(f"cache:{key}", value, px=ttl_ms)
+
+    def delete(self, key: str) -> None:
+        self._client.delete(f"cache:{key}")
+
+    def size(self, prefix: str) -> int | None:  # noqa: ARG002
+        # Redis bounds its own memory (maxmemory with an eviction policy)
+        return None
+
+
+_shared: CacheBackend | None = None
+_shared_lock = threading.Lock()
+
+
+def shared_backend() -> CacheBackend | None:
+    """The configured shared tier (created on first use), or None."""
+    global _shared
+    if not settings.CACHE_SHARED:
+        return None
+    with _shared_lock:
+        if _shared is None:
+            if settings.CACHE_REDIS_URL:
+                _shared = RedisBackend(settings.CACHE_REDIS_URL)
+            else:
+                path = settings.CACHE_SQLITE_PATH or os.path.join(
+                    tempfile.gettempdir(), "verilogai-cache.sqlite3"
+                )
+                _shared = SQLiteBackend(path, settings.CACHE_SQLITE_MAX_BYTES)
+        return _shared
+
+
+# A backend, or a function returning the backend on first use
+BackendSource = CacheBackend | None | Callable[[], CacheBackend | None]
+
+
+class Cache:
+    def __init__(
+        self,
+        name: str,
+        ttl_seconds: float,
+        max_bytes: int | None = None,
+        backend: BackendSource = shared_backend,
+    ) -> None:
+        self.name = name
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = settings.CACHE_MEMORY_BYTES if max_bytes is None else max_bytes
+        self._backend = backend
+        self._lock = threading.Lock()
+        # key -> (value, size, absolute expiry)
+        self._front: OrderedDict[str, tuple[Any, int, float]] = OrderedDict()
+        self._front_bytes = 0
+
+    @property
+    def backend(self) -> CacheBackend | None:
+        return self._backend() if callable(self._backend) else self._backend
+
+    def _shared_key(self, key: str) -> str:
+        return f"{self.name}:{key}"
+
+    def _remember(self, key: str, value: Any, size: int, expires: float) -> None:
+        with self._lock:
+            old = self._front.pop(key, None)
+            if old is not None:
+                self._front_bytes -= old[1]
+            if size > self.max_bytes:
+                return
+            self._front[key] = (value, size, expires)
+            self._front_bytes += size
+            while self._front_bytes > self.max_bytes:
+                _, (_, evicted, _) = self._front.popitem(last=False)
+                self._front_bytes -= evicted
+                metrics.CACHE_EVICTIONS.labels(self.name).inc()
+            metrics.CACHE_MEMORY_BYTES.labels(self.name).set(self._front_bytes)
+
+    def get(self, key: str) -> Any | None:
+        now = time.time()
+        with self._lock:
+            entry = self._front.get(key)
+            if entry is not None and entry[2] <= now:
+                del self._front[key]
+                self._front_bytes -= entry[1]
+                entry = None
+            if entry is not None:
+                self._front.move_to_end(key)
+        if entry is not None:
+            metrics.cache_lookup(self.name, True)
+            metrics.CACHE_TIER_HITS.labels(self.name, "memory").inc()
+            return entry[0]
+
+        found = None
+        try:
+            backend = self.backend
+            if backend is not None:
+                found = backend.get(self._shared_key(key))
+        except Exception:
+            logger.warning("Shared cache lookup failed", exc_info=True)
+        metrics.cache_lookup(self.name, found is not None)
+        if found is None:
+            return None
+        metrics.CACHE_TIER_HITS.labels(self.name, "shared").inc()
+        raw, expires = found
+        value = json.loads(raw)
+        self._remember(key, value, len(raw), expires)
+        return value
+
+    def set(self, key: str, value: Any, ttl_seconds: float | None = None) -> None:
+        raw = json.dumps(value, separators=(",", ":")).encode()
+        expires = time.time() + (
+            self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        )
+        self._remember(key, value, len(raw), expires)
+        try:
+            backend = self.backend
+            if backend is not None:
+                backend.set(self._shared_key(key), raw, expires)
+        except Exception:
+            logger.warning("Shared cache write failed", exc_info=True)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            entry = self._front.pop(key, None)
+            if entry is not None:
+                self._front_bytes -= entry[1]
+        try:
+            backend = self.backend
+            if backend is not None:
+                backend.delete(self._shared_key(key))
+        except Exception:
+            logger.warning("Shared cache delete failed", exc_info=True)
+
+    def get_or_compute(self, key: str, compute: Callable[[], T]) -> T:
+        """Cached value of ``compute()``; concurrent misses each compute it."""
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.set(key, value)
+        return value
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            entries, front_bytes = len(self._front), self._front_bytes
+        shared = None
+        try:
+            backend = self.backend
+            if backend is not None:
+                shared = backend.size(self._shared_key(""))
+        except Exception:
+            logger.warning("Shared cache size lookup failed", exc_info=True)
+        return {
+            "name": self.name,
+            "memory_entries": entries,
+            "memory_bytes": front_bytes,
+            "shared_bytes": shared,
+        }
+
+    def clear(self) -> None:
+        """Empty the front (the shared tier only expires)."""
+        with self._lock:
+            self._front.clear()
+            self._front_bytes = 0
@@ -37,6 +37,21 @@ class Settings(BaseSettings):
     SECRET_KEY: str = secrets.token_urlsafe(32)
     # 60 minutes * 24 hours * 8 days = 8 days
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 60 * 24 * 8
+    # Users loaded by authenticated requests are cached per worker for this
+    # long. Changes invalidate every worker's copy through the shared cache
+    # tier; with CACHE_SHARED=false, changes made through another worker
+    # show up after at most this.
+    AUTH_USER_CACHE_TTL_SECONDS: int = 30
+    # Embed the user's active flag in new access tokens so that the LLM
+    # routes identify callers without a database lookup. A deactivated user
+    # keeps LLM access until the token expires.
+    AUTH_TOKEN_CLAIMS: bool = False
+    # bcrypt cost of new password hashes; existing hashes made with another
+    # cost are rehashed on the user's next login
+    BCRYPT_ROUNDS: int = 12
+    # Processes (per worker) that hash and verify passwords; 0 runs bcrypt
+    # in the request's thread
+    PASSWORD_HASH_WORKERS: int = 2
     FRONTEND_HOST: str = "http://localhost:5173"
     ENVIRONMENT: Literal["local", "staging", "production"] = "local"
 
@@ -101,9 +116,114 @@ class Settings(BaseSettings):
     VERTEX_PROJECT_NUMBER: str = "556201303018"
     VERTEX_LOCATION: str = "us-central1"
     VERTEX_ENDPOINT_ID: str = "6095566020552949760"
+    # Overrides for offline testing against a stub server such as
+    # benchmarks/fake_llm.py: the API root instead of
+    # https://{VERTEX_LOCATION}-aiplatform.googleapis.com, and a fixed bearer
+    # token instead of Application Default Credentials
+    VERTEX_BASE_URL: str | None = None
+    VERTEX_ACCESS_TOKEN: str | None = None
 
     # OpenAI Configuration
     OPENAI_API_KEY: str | None = None
+    # e.g. http://127.0.0.1:8090/v1 for the stub server
+    OPENAI_BASE_URL: str | None = None
+
+    # Local inference server (Ollama or llama.cpp `server`), e.g.
+    # http://localhost:11434 for Ollama. Unset disables local inference.
+    LOCAL_LLM_BASE_URL: str | None = None
+    LOCAL_LLM_SERVER: Literal["ollama", "llamacpp"] = "ollama"
+    LOCAL_LLM_MODEL: str = "codeqwen"
+    # How long Ollama keeps the model loaded after a request; the backend
+    # pings it more often than this so the model never gets unloaded.
+    LOCAL_LLM_KEEP_ALIVE: str = "30m"
+    LOCAL_LLM_KEEPALIVE_INTERVAL_SECONDS: int = 240
+    LOCAL_LLM_TIMEOUT_SECONDS: int = 30
+
+    # In-process CPU inference engine for air-gapped deployments
+    # (app/core/local_engine.py). When a model path is set the API spawns one
+    # engine process per box and, unless LOCAL_LLM_BASE_URL points elsewhere,
+    # uses it as the local server.
+    LOCAL_ENGINE_MODEL_PATH: str | None = None
+    LOCAL_ENGINE_PORT: int = 8089
+    LOCAL_ENGINE_QUANTIZATION: Literal["none", "int8", "int4"] = "int8"
+    LOCAL_ENGINE_MAX_BATCH_SIZE: int = 8
+    LOCAL_ENGINE_BATCH_WINDOW_MS: int = 15
+    LOCAL_ENGINE_PREFIX_CACHE_SIZE: int = 8
+    LOCAL_ENGINE_THREADS: int | None = None
+    LOCAL_ENGINE_FIM_TEMPLATE: str = "<fim_prefix>{prefix}<fim_suffix>{suffix}<fim_middle>"
+
+    # Provider routing (app/core/llm_router.py). Each request class lists
+    # the providers allowed to serve it ("openai", "vertex", "local"). With
+    # "latency" routing the fastest healthy provider by rolling
+    # time-to-first-token goes first; with "ordered" the list order is a strict
+    # preference, e.g. ["local", "vertex"] sends completions to the local
+    # model and falls back to Codestral while it is unhealthy. Completions
+    # start on OpenAI (gpt-4o chat completions, as before routing existed),
+    # but latency routing also measures Codestral FIM on Vertex and moves
+    # completions there if it is faster; set LLM_ROUTING="ordered" to keep
+    # them on OpenAI.
+    LLM_ROUTING: Literal["latency", "ordered"] = "latency"
+    LLM_COMPLETION_PROVIDERS: list[str] = ["openai", "vertex", "local"]
+    LLM_CHAT_PROVIDERS: list[str] = ["openai", "vertex", "local"]
+    LLM_TESTBENCH_PROVIDERS: list[str] = ["openai", "vertex"]
+    OPENAI_MODEL: str = "gpt-4o"
+    VERTEX_CODESTRAL_MODEL: str = "codestral-2501"
+    # Hedged completions: if the first provider has not produced a token
+    # within the delay (default: its rolling p95), race a second one.
+    LLM_HEDGE_COMPLETIONS: bool = False
+    LLM_HEDGE_DELAY_MS: int | None = None
+    # Seconds a provider is skipped after a 429 or repeated failures
+    LLM_PROVIDER_COOLDOWN_SECONDS: int = 30
+    # Token budget for the code context sent with a completion request when
+    # the editor sends the whole document (see app/core/context.py)
+    COMPLETION_CONTEXT_TOKENS: int = 1024
+    # Chat history sent to the model per turn; older turns are summarized in
+    # the background once a conversation outgrows it
+    CHAT_HISTORY_TOKEN_BUDGET: int = 8000
+    # Testbench generation with verify=true: one candidate per temperature is
+    # generated in parallel, compiled with iverilog and repaired from the
+    # compiler errors up to this many rounds; the first to compile wins.
+    TB_VERIFY_TEMPERATURES: list[float] = [0.2, 0.6, 0.9]
+    TB_VERIFY_REPAIR_ROUNDS: int = 2
+
+    # Per-caller budgets for the LLM routes. Authenticated users are limited
+    # per user, anonymous callers per client IP. Set RATE_LIMIT_REDIS_URL to
+    # share limiter state across workers (requires the redis extra).
+    RATE_LIMIT_USER_RPM: int = 60
+    RATE_LIMIT_USER_TPM: int = 60_000
+    # Everyone behind one address (a lab or classroom NAT) shares the IP
+    # bucket, so it is sized for a room of anonymous users rather than one
+    RATE_LIMIT_IP_RPM: int = 300
+    RATE_LIMIT_IP_TPM: int = 300_000
+    RATE_LIMIT_REDIS_URL: str | None = None
+    # Only enable behind a proxy that sets X-Forwarded-For (e.g. Traefik)
+    RATE_LIMIT_TRUST_PROXY_HEADERS: bool = False
+
+    # Lint, simulation and completion results (app/core/cache.py): an
+    # in-process LRU per worker in front of a tier shared by all workers, a
+    # SQLite file (default: in the temp dir) or Redis when CACHE_REDIS_URL is
+    # set (requires the redis extra).
+    CACHE_SHARED: bool = True
+    CACHE_SQLITE_PATH: str | None = None
+    CACHE_SQLITE_MAX_BYTES: int = 512 * 1024 * 1024
+    CACHE_REDIS_URL: str | None = None
+    # Per cache and worker
+    CACHE_MEMORY_BYTES: int = 16 * 1024 * 1024
+    CACHE_LINT_TTL_SECONDS: int = 24 * 3600
+    CACHE_SIMULATE_TTL_SECONDS: int = 3600
+    # Identical completion requests within this window get the same text
+    CACHE_COMPLETION_TTL_SECONDS: int = 600
+
+    # Prometheus metrics at /metrics (app/core/metrics.py). With several
+    # workers also set PROMETHEUS_MULTIPROC_DIR.
+    METRICS_ENABLED: bool = True
+
+    # OpenTelemetry tracing (app/core/tracing.py, requires the tracing
+    # extra): spans are exported over OTLP/HTTP to this collector, e.g.
+    # http://otel-collector:4318. Unset disables tracing.
+    OTEL_EXPORTER_OTLP_ENDPOINT: str | None = None
+    OTEL_SERVICE_NAME: str = "verilogai-backend"
+    OTEL_TRACES_SAMPLE_RATIO: float = 1.0
 
     def _check_default_secret(self, var_name: str, value: str | None) -> None:
         if value == "changethis":
@@ -0,0 +1,214 @@
+"""
+Prompt context selection for code completion.
+
+Instead of fixed character slices around the cursor, the completion prompt is
+assembled from the parts of the document that matter most, within a token
+budget: the code right before and after the cursor, plus the enclosing
+module's header (ports and parameters), its signal declarations and the
+always/initial blocks closest to the cursor. Skipped regions are marked with
+``// ...`` so the model does not mistake the excerpt for the whole module.
+"""
+
+import threading
+from collections import OrderedDict
+from collections.abc import Callable
+from functools import lru_cache
+from typing import Any
+
+from app.core import metrics, verilog
+from app.core.cache import Cache, CacheBackend, shared_backend
+
+ELISION = "\n    // ...\n"
+
+# Share of the budget for the code right before and right after the cursor.
+# The rest goes to the module structure.
+PREFIX_SHARE = 0.6
+SUFFIX_SHARE = 0.2
+
+
+@lru_cache(maxsize=1)
+def _encoding() -> Any:
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        # The BPE file could not be downloaded
+        return None
+
+
+def count_tokens(text: str) -> int:
+    """Token count with tiktoken, or an estimate when it is unavailable."""
+    if not text:
+        return 0
+    encoding = _encoding()
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+class DocumentStore:
+    """
+    Latest document text and its editor version per completion session, so
+    the editor only has to send the document when it changed.
+
+    Each worker keeps the documents it saw; the latest one is also written to
+    the shared cache tier, where a worker whose own copy is missing or older
+    than the requested version looks next. A copy is only used when its
+    version is the one the editor asked for.
+    """
+
+    def __init__(
+        self,
+        max_documents: int = 1024,
+        ttl_seconds: float = 3600,
+        backend: CacheBackend
+        | None
+        | Callable[[], CacheBackend | None] = shared_backend,
+    ) -> None:
+        self._lock = threading.Lock()
+        self._max_documents = max_documents
+        # session -> (version, document)
+        self._documents: OrderedDict[str, tuple[int | None, str]] = OrderedDict()
+        # No in-process front: the shared entry is the latest document
+        self._shared = Cache(
+            "completion_document_state", ttl_seconds, max_bytes=0, backend=backend
+        )
+
+    def _remember(self, session_id: str, version: int | None, document: str) -> None:
+        with self._lock:
+            self._documents[session_id] = (version, document)
+            self._documents.move_to_end(session_id)
+            while len(self._documents) > self._max_documents:
+                self._documents.popitem(last=False)
+
+    def put(self, session_id: str, document: str, version: int | None = None) -> None:
+        self._remember(session_id, version, document)
+        self._shared.set(session_id, {"version": version, "document": document})
+
+    def get(self, session_id: str, version: int | None = None) -> str | None:
+        """
+        The session's document at ``version``, or None if neither this worker
+        nor the shared tier has that version. Without a version, the latest.
+        """
+        with self._lock:
+            entry = self._documents.get(session_id)
+            if entry is not None:
+                self._documents.move_to_end(session_id)
+        if entry is None or version is None or entry[0] != version:
+            shared = self._shared.get(session_id)
+            if shared is not None:
+                entry = (shared["version"], shared["document"])
+                self._remember(session_id, *entry)
+        found = entry is not None and (version is None or entry[0] == version)
+        metrics.cache_lookup("completion_documents", found)
+        return entry[1] if entry is not None and found else None
+
+
+documents = DocumentStore()
+
+
+def _tail(text: str, budget: int) -> str:
+    """Longest run of whole lines at the end of ``text`` within ``budget``."""
+    lines = text.splitlines(keepends=True)
+    used = 0
+    start = len(lines)
+    while start > 0:
+        cost = count_tokens(lines[start - 1])
+        if used + cost > budget:
+            break
+        used += cost
+        start -= 1
+    if start == len(lines) and lines:
+        # Not even the cursor line fits, keep as much of it as we can
+        return lines[-1][-budget * 4 :] if budget > 0 else ""
+    return "".join(lines[start:])
+
+
+def _head(text: str, budget: int) -> str:
+    """Longest run of whole lines at the start of ``text`` within ``budget``."""
+    lines = text.splitlines(keepends=True)
+    used = 0
+    end = 0
+    while end < len(lines):
+        cost = count_tokens(lines[end])
+        if used + cost > budget:
+            break
+        used += cost
+        end += 1
+    if end == 0 and lines:
+        return lines[0][: budget * 4] if budget > 0 else ""
+    return "".join(lines[:end])
+
+
+def _stitch(document: str, spans: list[verilog.Span]) -> str:
+    """Join spans in document order, eliding the code between them."""
+    parts: list[str] = []
+    last_end: int | None = None
+    for span in sorted(spans, key=lambda s: s.start):
+        if last_end is not None:
+            gap = document[last_end : span.start]
+            parts.append(gap if not gap.strip() else ELISION)
+        parts.append(document[span.start : span.end])
+        last_end = span.end
+    return "".join(parts)
+
+
+def build_completion_context(
+    document: str, cursor: int, budget_tokens: int
+) -> tuple[str, str]:
+    """
+    Prefix and suffix for a completion at ``cursor`` that together fit in
+    ``budget_tokens``.
+    """
+    cursor = max(0, min(cursor, len(document)))
+    before, after = document[:cursor], document[cursor:]
+
+    local_prefix = _tail(before, int(budget_tokens * PREFIX_SHARE))
+    local_suffix = _head(after, int(budget_tokens * SUFFIX_SHARE))
+    window_start = cursor - len(local_prefix)
+    window_end = cursor + len(local_suffix)
+    remaining = budget_tokens - count_tokens(local_prefix) - count_tokens(local_suffix)
+
+    module = verilog.enclosing_module(verilog.parse_modules(document), cursor)
+    if module is None or remaining <= 0:
+        return local_prefix, local_suffix
+
+    # Most important first: the header carries the port list and parameters,
+    # then the signal declarations, then the blocks nearest to the cursor
+    blocks = sorted(
+        module.blocks,
+        key=lambda b: (
+            window_start - b.end if b.end <= window_start else b.start - window_end
+        ),
+    )
+    candidates = [module.header, *module.declarations, *blocks]
+
+    head_spans: list[verilog.Span] = []
+    tail_spans: list[verilog.Span] = []
+    for span in candidates:
+        if span.end <= window_start:
+            target = head_spans
+        elif span.start >= window_end:
+            target = tail_spans
+        else:
+            # Already part of the local window
+            continue
+        cost = count_tokens(span.text(document)) + 2
+        if cost > remaining:
+            continue
+        target.append(span)
+        remaining -= cost
+
+    prefix, suffix = local_prefix, local_suffix
+    if head_spans:
+        head = _stitch(document, head_spans)
+        gap = document[max(s.end for s in head_spans) : window_start]
+        prefix = head + (gap if not gap.strip() else ELISION) + local_prefix
+    if tail_spans:
+        tail = _stitch(document, tail_spans)
+        gap = document[window_end : min(s.start for s in tail_spans)]
+        suffix = local_suffix + (gap if not gap.strip() else ELISION) + tail
+    return prefix, suffix
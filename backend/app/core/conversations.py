@@ -0,0 +1,377 @@
+"""
+Server-side chat conversation state.
+
+Each conversation keeps the current editor document and the message history,
+so the chat client only sends what changed: text edits against the last
+document version it synced and the new messages of the turn. Keeping the
+history on the server also keeps the prompt prefix byte-identical across
+turns, which upstream prompt caching relies on.
+
+Conversations are kept in the shared cache tier, so every worker sees the
+latest turn and document, with a copy in process memory that is reloaded
+whenever another worker changed the conversation. Document versions are
+random rather than counted, so an edit made against a copy some other worker
+(or an earlier state) had never matches by accident: it is rejected and the
+client resends the document. When a conversation is unknown (evicted or
+expired) the client resends the full state.
+
+The history sent to the model is kept within a token budget: code blocks
+that a later reply (or the current document) supersedes are elided, the
+oldest turns are summarized in the background once the history outgrows the
+budget, and until that summary lands the oldest messages are dropped. Eliding
+and dropping only happen when the history outgrows the budget (or a summary
+lands); in between, turns are only appended, so the prefix sent upstream
+stays byte-identical and keeps hitting the prompt cache.
+"""
+
+import hashlib
+import logging
+import re
+import secrets
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from collections.abc import Callable
+from dataclasses import dataclass, field
+from typing import Any
+
+from app.core import metrics, verilog
+from app.core.cache import Cache, CacheBackend, shared_backend
+from app.core.context import count_tokens
+
+logger = logging.getLogger(__name__)
+
+# Most recent messages that are never summarized
+KEEP_RECENT_MESSAGES = 6
+
+SUMMARY_PREFIX = "Summary of the earlier conversation:\n"
+OMITTED_CODE = "```verilog\n// code omitted: superseded by a later version\n```"
+
+_CODE_BLOCK = re.compile(r"```[^\n`]*\n(.*?)```", re.DOTALL)
+
+
+class ConversationNotFound(Exception):
+    pass
+
+
+def new_version() -> int:
+    # Unique across workers and restarts, and exact as a JavaScript number
+    return secrets.randbits(53)
+
+
+class VersionMismatch(Exception):
+    def __init__(self, current: int) -> None:
+        super().__init__(f"Document is at version {current}")
+        self.current = current
+
+
+@dataclass
+class TextEdit:
+    """Replace ``document[start:end]`` with ``text``."""
+
+    start: int
+    end: int
+    text: str
+
+
+@dataclass
+class Conversation:
+    id: str
+    document: str = ""
+    version: int = field(default_factory=new_version)
+    file_path: str | None = None
+    messages: list[dict[str, str]] = field(default_factory=list)
+    # Tokens in the stored history
+    tokens: int = 0
+    # Changes with every write, so workers can tell their copy is stale
+    revision: str = ""
+    # History as sent to the model: rebuilt only when it outgrows the budget
+    # or a summary lands, appended to otherwise
+    window: list[dict[str, str]] | None = None
+    window_tokens: int = 0
+    summarizing: bool = False
+    updated_at: float = field(default_factory=time.monotonic)
+
+
+def message_tokens(messages: list[dict[str, str]]) -> int:
+    # A few tokens of per-message overhead for the role and separators
+    return sum(count_tokens(m["content"]) + 4 for m in messages)
+
+
+def _code_keys(code: str) -> set[str]:
+    """What makes a code block redundant: its exact text and the modules it defines."""
+    keys = {hashlib.sha256(code.strip().encode()).hexdigest()}
+    keys.update(f"module:{m.name}" for m in verilog.parse_modules(code))
+    return keys
+
+
+def dedupe_code_blocks(
+    messages: list[dict[str, str]], document: str | None = None
+) -> list[dict[str, str]]:
+    """
+    Elide code blocks in assistant replies that repeat the current document
+    or a later block, or define the same modules as a later block. Agentic
+    replies carry the whole file every turn, so only the latest version is
+    worth sending.
+    """
+    # Only exact copies of the document: a newer suggestion for the same
+    # module may not have been applied to it
+    seen = (
+        {hashlib.sha256(document.strip().encode()).hexdigest()} if document else set()
+    )
+    result = []
+    for message in reversed(messages):
+        if message["role"] != "assistant" or "```" not in message["content"]:
+            result.append(message)
+            continue
+
+        def replace(m: re.Match[str]) -> str:
+            keys = _code_keys(m.group(1))
+            if keys & seen:
+                return OMITTED_CODE
+            seen.update(keys)
+            return m.group(0)
+
+        content = _CODE_BLOCK.sub(replace, message["content"])
+        result.append(
+            message
+            if content == message["content"]
+            else {**message, "content": content}
+        )
+    result.reverse()
+    return result
+
+
+def fit_history(messages: list[dict[str, str]], budget: int) -> list[dict[str, str]]:
+    """Drop the oldest messages (after a leading summary) until the history fits."""
+    summary = (
+        messages[:1]
+        if messages and messages[0]["content"].startswith(SUMMARY_PREFIX)
+        else []
+    )
+    rest = messages[len(summary) :]
+    used = message_tokens(summary)
+    kept = 0
+    for message in reversed(rest):
+        cost = message_tokens([message])
+        if used + cost > budget:
+            break
+        used += cost
+        kept += 1
+    return summary + rest[len(rest) - kept :]
+
+
+def compact_history(
+    messages: list[dict[str, str]], document: str | None, budget: int
+) -> list[dict[str, str]]:
+    """
+    ``messages`` unchanged while they fit the budget; otherwise with
+    superseded code elided and, if still too long, the oldest dropped.
+    """
+    if message_tokens(messages) <= budget:
+        return messages
+    return fit_history(dedupe_code_blocks(messages, document), budget)
+
+
+def apply_edits(document: str, edits: list[TextEdit]) -> str:
+    """Apply edits in order; each edit's offsets refer to the result of the previous one."""
+    for edit in edits:
+        if not 0 <= edit.start <= edit.end <= len(document):
+            raise ValueError(
+                f"Edit range {edit.start}-{edit.end} is outside the document "
+                f"(length {len(document)})"
+            )
+        document = document[: edit.start] + edit.text + document[edit.end :]
+    return document
+
+
+# Written to the shared tier; the rest is derived per worker
+_SHARED_FIELDS = ("document", "version", "file_path", "messages", "tokens", "revision")
+
+
+class ConversationStore:
+    def __init__(
+        self,
+        max_conversations: int = 1024,
+        ttl_seconds: float = 3600,
+        backend: CacheBackend
+        | None
+        | Callable[[], CacheBackend | None] = shared_backend,
+    ) -> None:
+        self._lock = threading.Lock()
+        self._max_conversations = max_conversations
+        self._ttl = ttl_seconds
+        self._conversations: OrderedDict[str, Conversation] = OrderedDict()
+        # No in-process front: the shared entry is the latest state
+        self._shared = Cache(
+            "conversation_state", ttl_seconds, max_bytes=0, backend=backend
+        )
+
+    def _get(self, conversation_id: str) -> Conversation | None:
+        conversation = self._conversations.get(conversation_id)
+        if (
+            conversation is not None
+            and time.monotonic() - conversation.updated_at > self._ttl
+        ):
+            del self._conversations[conversation_id]
+            conversation = None
+        state: dict[str, Any] | None = self._shared.get(conversation_id)
+        if state is not None and (
+            conversation is None or conversation.revision != state["revision"]
+        ):
+            # New to this worker, or changed by another one since
+            conversation = Conversation(id=conversation_id, **state)
+            self._store(conversation)
+        if conversation is None:
+            return None
+        conversation.updated_at = time.monotonic()
+        self._conversations.move_to_end(conversation_id)
+        return conversation
+
+    def _store(self, conversation: Conversation) -> None:
+        self._conversations[conversation.id] = conversation
+        self._conversations.move_to_end(conversation.id)
+        while len(self._conversations) > self._max_conversations:
+            self._conversations.popitem(last=False)
+
+    def _save(self, conversation: Conversation) -> None:
+        conversation.revision = uuid.uuid4().hex
+        self._shared.set(
+            conversation.id,
+            {name: getattr(conversation, name) for name in _SHARED_FIELDS},
+        )
+
+    def get(self, conversation_id: str) -> Conversation | None:
+        with self._lock:
+            return self._get(conversation_id)
+
+    def create(
+        self,
+        conversation_id: str,
+        document: str = "",
+        messages: list[dict[str, str]] | None = None,
+    ) -> Conversation:
+        """Start (or restart) a conversation from the full client state."""
+        with self._lock:
+            conversation = Conversation(
+                id=conversation_id, document=document, messages=list(messages or [])
+            )
+            conversation.tokens = message_tokens(conversation.messages)
+            self._store(conversation)
+            self._save(conversation)
+            return conversation
+
+    def sync_document(
+        self,
+        conversation_id: str,
+        *,
+        document: str | None = None,
+        edits: list[TextEdit] | None = None,
+        base_version: int | None = None,
+    ) -> Conversation:
+        """
+        Bring the stored document up to date, either by replacing it or by
+        applying ``edits`` made against ``base_version``. Returns the
+        conversation; its version is bumped when the document changed.
+        """
+        with self._lock:
+            conversation = self._get(conversation_id)
+            metrics.cache_lookup("conversations", conversation is not None)
+            if conversation is None:
+                raise ConversationNotFound(conversation_id)
+            if document is not None:
+                new_document = document
+            elif edits:
+                if base_version != conversation.version:
+                    raise VersionMismatch(conversation.version)
+                new_document = apply_edits(conversation.document, edits)
+            else:
+                return conversation
+            if new_document != conversation.document:
+                conversation.document = new_document
+                conversation.version = new_version()
+                self._save(conversation)
+            return conversation
+
+    def append(self, conversation_id: str, messages: list[dict[str, str]]) -> None:
+        with self._lock:
+            conversation = self._get(conversation_id)
+            if conversation is not None:
+                tokens = message_tokens(messages)
+                conversation.messages.extend(messages)
+                conversation.tokens += tokens
+                if conversation.window is not None:
+                    conversation.window.extend(messages)
+                    conversation.window_tokens += tokens
+                self._save(conversation)
+
+    def history(self, conversation_id: str, budget: int) -> list[dict[str, str]]:
+        """The stored history as it should be sent to the model."""
+        with self._lock:
+            conversation = self._get(conversation_id)
+            if conversation is None:
+                return []
+            if conversation.window is not None and conversation.window_tokens <= budget:
+                return list(conversation.window)
+            messages, document = list(conversation.messages), conversation.document
+        window = compact_history(messages, document, budget)
+        with self._lock:
+            # Unless a turn or summary landed meanwhile
+            if conversation.messages == messages:
+                conversation.window = list(window)
+                conversation.window_tokens = message_tokens(window)
+        return window
+
+    def compact(
+        self,
+        conversation_id: str,
+        summarize: Callable[[list[dict[str, str]]], str],
+        budget: int,
+    ) -> threading.Thread | None:
+        """
+        Once the history outgrows ``budget``, summarize all but the most
+        recent messages in a background thread and replace them with the
+        summary. Returns the thread, or None if no compaction was needed.
+        """
+        with self._lock:
+            conversation = self._get(conversation_id)
+            if (
+                conversation is None
+                or conversation.summarizing
+                or conversation.tokens <= budget
+                or len(conversation.messages) <= KEEP_RECENT_MESSAGES
+            ):
+                return None
+            old = conversation.messages[:-KEEP_RECENT_MESSAGES]
+            conversation.summarizing = True
+
+        def run() -> None:
+            try:
+                summary = summarize(old)
+            except Exception:
+                logger.exception("Summarizing conversation %s failed", conversation_id)
+                summary = None
+            with self._lock:
+                conversation.summarizing = False
+                # The conversation may have been restarted meanwhile, here
+                # or by another worker
+                current = self._get(conversation_id)
+                if (
+                    summary
+                    and current is not None
+                    and current.messages[: len(old)] == old
+                ):
+                    current.messages[: len(old)] = [
+                        {"role": "system", "content": SUMMARY_PREFIX + summary.strip()}
+                    ]
+                    current.tokens = message_tokens(current.messages)
+                    current.window = None
+                    self._save(current)
+
+        thread = threading.Thread(target=run, name="conversation-summary", daemon=True)
+        thread.start()
+        return thread
+
+
+conversations = ConversationStore()
@@ -0,0 +1,127 @@
+"""
+Compile checks with Icarus Verilog.
+
+``check_testbench`` elaborates a testbench together with its DUT without
+producing a simulation binary (``-t null``), which is enough to catch syntax,
+port and name errors before a user hits Simulate. The DUT is written once per
+distinct source into a content-addressed cache directory and its own check
+result is memoized, so repeated checks of candidate testbenches for the same
+module only write and parse the testbench again. Entries unused for
+``DUT_CACHE_MAX_AGE_SECONDS`` are swept when new ones are written.
+"""
+
+import hashlib
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+
+from app.core import metrics, tracing
+
+COMPILE_TIMEOUT_SECONDS = 10
+DUT_CACHE_MAX_AGE_SECONDS = 24 * 3600
+DUT_CACHE_SWEEP_INTERVAL_SECONDS = 600
+
+_DUT_CACHE = Path(tempfile.gettempdir()) / "verilogai-dut-cache"
+_dut_lock = threading.Lock()
+_last_sweep = float("-inf")
+
+
+@dataclass(frozen=True)
+class CompileResult:
+    ok: bool
+    errors: str = ""
+
+
+def available() -> bool:
+    return shutil.which("iverilog") is not None
+
+
+@lru_cache(maxsize=1)
+def version() -> str | None:
+    """``iverilog -V`` output, or None if iverilog is missing. Probed once per process."""
+    try:
+        cp = subprocess.run(
+            ["iverilog", "-V"], capture_output=True, text=True, check=True
+        )
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return None
+    return cp.stdout
+
+
+def _run(files: list[Path], cwd: Path) -> CompileResult:
+    try:
+        with (
+            tracing.span("iverilog.check", **{"iverilog.files": len(files)}),
+            metrics.timed(metrics.IVERILOG_COMPILE_SECONDS.labels("check")),
+        ):
+            cp = subprocess.run(
+                ["iverilog", "-t", "null", *[str(f) for f in files]],
+                capture_output=True,
+                text=True,
+                timeout=COMPILE_TIMEOUT_SECONDS,
+                cwd=cwd,
+            )
+    except subprocess.TimeoutExpired:
+        return CompileResult(False, "iverilog timed out")
+    output = (cp.stdout + cp.stderr).strip()
+    # Report paths the way the user knows the files
+    for f in files:
+        output = output.replace(str(f), f.name)
+    return CompileResult(cp.returncode == 0, output)
+
+
+def _sweep_dut_cache() -> None:
+    """Remove DUT entries unused for DUT_CACHE_MAX_AGE_SECONDS. Call with _dut_lock held."""
+    global _last_sweep
+    now = time.time()
+    if now - _last_sweep < DUT_CACHE_SWEEP_INTERVAL_SECONDS:
+        return
+    _last_sweep = now
+    for entry in _DUT_CACHE.glob("*/module.v"):
+        try:
+            if now - entry.stat().st_mtime > DUT_CACHE_MAX_AGE_SECONDS:
+                shutil.rmtree(entry.parent, ignore_errors=True)
+        except FileNotFoundError:
+            # Swept by another worker
+            pass
+
+
+def _dut_path(code: str) -> Path:
+    digest = hashlib.sha256(code.encode()).hexdigest()
+    path = _DUT_CACHE / digest / "module.v"
+    with _dut_lock:
+        try:
+            # Mark as recently used so the sweep keeps it
+            os.utime(path)
+            cached = True
+        except FileNotFoundError:
+            cached = False
+        metrics.cache_lookup("dut_files", cached)
+        if not cached:
+            _sweep_dut_cache()
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_suffix(".tmp")
+            tmp.write_text(code)
+            tmp.replace(path)
+    return path
+
+
+@lru_cache(maxsize=256)
+def check_dut(code: str) -> CompileResult:
+    path = _dut_path(code)
+    return _run([path], path.parent)
+
+
+def check_testbench(dut_code: str, tb_code: str) -> CompileResult:
+    """Compile ``tb_code`` against ``dut_code``. Check the DUT first with check_dut."""
+    dut = _dut_path(dut_code)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        tb = Path(tmpdir) / "tb.v"
+        tb.write_text(tb_code)
+        return _run([dut, tb], Path(tmpdir))
@@ -1,18 +1,34 @@
+import hashlib
 import json
+import logging
+import threading
+import time
 import traceback
+from collections import OrderedDict
+from functools import partial
 import requests
-from typing import Generator, Dict, List
-
-from google.auth import default
-from google.auth.transport.requests import Request
-from google.auth.exceptions import DefaultCredentialsError
+from typing import Any, Callable, Generator, Dict, Iterable, List, Optional, TypeVar, cast
 
+from app.core import metrics, tracing
+from app.core.cache import CacheBackend, shared_backend
 from app.core.config import settings
 
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
 def get_access_token() -> str:
     """
     Load ADC and return a fresh OAuth2 token with cloud-platform scope.
     """
+    if settings.VERTEX_ACCESS_TOKEN:
+        return settings.VERTEX_ACCESS_TOKEN
+    # Imported on first use: google.auth is slow to import and only the
+    # Vertex provider needs it
+    from google.auth import default
+    from google.auth.exceptions import DefaultCredentialsError
+    from google.auth.transport.requests import Request
+
     try:
         creds, _ = default(scopes=["https://www.googleapis.com/auth/cloud-platform"])
     except DefaultCredentialsError as e:
@@ -33,61 +49,65 @@ def get_access_token() -> str:
         raise RuntimeError("Failed to obtain a valid access token from ADC.")
     return creds.token
 
-def stream_vertex_ai(messages: List[Dict[str, str]], temperature: float = 0.6, max_tokens: int = 1000) -> Generator[str, None, None]:
-    token = get_access_token()
-    
-    # Using the Publisher Model URL
-    # Note: We use streamRawPredict for streaming responses.
-    url = f"https://{settings.VERTEX_LOCATION}-aiplatform.googleapis.com/v1/projects/{settings.VERTEX_PROJECT_NUMBER}/locations/{settings.VERTEX_LOCATION}/publishers/mistralai/models/codestral-2501:streamRawPredict"
-    
-    headers = {
+def vertex_url(model: str) -> str:
+    """Publisher model endpoint for streaming (streamRawPredict) requests."""
+    base_url = (
+        settings.VERTEX_BASE_URL or f"https://{settings.VERTEX_LOCATION}-aiplatform.googleapis.com"
+    ).rstrip("/")
+    return f"{base_url}/v1/projects/{settings.VERTEX_PROJECT_NUMBER}/locations/{settings.VERTEX_LOCATION}/publishers/mistralai/models/{model}:streamRawPredict"
+
+def stream_vertex_raw(
+    payload: Dict[str, Any],
+    timeout: float = 15,
+    on_usage: Optional[Callable[[Dict[str, Any]], None]] = None,
+) -> Generator[str, None, None]:
+    """
+    Stream content deltas from a Vertex AI streamRawPredict call. Raises on
+    HTTP and connection errors so callers can fail over to another provider.
+    ``on_usage`` receives the ``usage`` object of the chunk that reports it.
+    """
+    with tracing.span("vertex.access_token"):
+        token = get_access_token()
+    headers = tracing.inject({
         "Authorization": f"Bearer {token}",
         "Content-Type": "application/json"
-    }
-    
-    payload = {
-        "model": "codestral-2501",
-        "messages": messages,
-        "temperature": temperature,
-        "max_tokens": max_tokens,
-        "stream": True 
-    }
-    
-    try:
-        with requests.post(url, json=payload, headers=headers, stream=True) as response:
-            response.raise_for_status()
-            # Vertex AI streamRawPredict returns a stream of JSON objects.
-            # Note: requests.iter_lines() splits by newline.
-            for line in response.iter_lines():
-                if line:
-                    decoded_line = line.decode('utf-8').strip()
-                    if not decoded_line:
-                        continue
-                        
-                    # Remove "data: " prefix if present (SSE format)
-                    if decoded_line.startswith("data: "):
-                        decoded_line = decoded_line[6:]
-                    
-                    if decoded_line == "[DONE]":
-                        break
-                        
-                    try:
-                        # Sometimes the response might be wrapped in an array or just raw JSON objects
-                        if decoded_line.startswith("[") and decoded_line.endswith("]"):
-                             # It might be a list of objects, but stream usually sends one object at a time
-                             # or a list containing one object.
-                             data_list = json.loads(decoded_line)
-                             for data in data_list:
-                                 yield _extract_content(data)
-                        else:
-                             data = json.loads(decoded_line)
-                             yield _extract_content(data)
-                    except json.JSONDecodeError:
-                        print(f"Failed to decode JSON line: {decoded_line}")
-                        continue
-    except Exception as e:
-        print(f"Streaming error: {e}")
-        yield f"\n[Error during generation: {str(e)}]"
+    })
+
+    with requests.post(
+        vertex_url(payload["model"]), json={**payload, "stream": True},
+        headers=headers, stream=True, timeout=timeout,
+    ) as response:
+        tracing.event("response_headers", status=response.status_code)
+        response.raise_for_status()
+        # Vertex AI streamRawPredict returns a stream of JSON objects.
+        # Note: requests.iter_lines() splits by newline.
+        for line in response.iter_lines():
+            if not line:
+                continue
+            decoded_line = line.decode('utf-8').strip()
+
+            # Remove "data: " prefix if present (SSE format)
+            if decoded_line.startswith("data: "):
+                decoded_line = decoded_line[6:]
+
+            if decoded_line == "[DONE]":
+                break
+
+            try:
+                # Sometimes the response might be wrapped in an array or just raw JSON objects
+                if decoded_line.startswith("[") and decoded_line.endswith("]"):
+                    data_list = json.loads(decoded_line)
+                else:
+                    data_list = [json.loads(decoded_line)]
+            except json.JSONDecodeError:
+                print(f"Failed to decode JSON line: {decoded_line}")
+                continue
+            for data in data_list:
+                if on_usage and data.get("usage"):
+                    on_usage(data["usage"])
+                content = _extract_content(data)
+                if content:
+                    yield content
 
 def _extract_content(data: Dict) -> str:
     """Helper to extract content from Vertex AI response chunk"""
@@ -107,3 +127,544 @@ def _extract_content(data: Dict) -> str:
         
     return content
 
+
+
+# ---------------------------------------------------------------------------
+# Request coalescing (single-flight)
+# ---------------------------------------------------------------------------
+
+def request_key(payload: Dict[str, Any]) -> str:
+    """
+    Stable hash of an upstream request payload. Only include fields that
+    affect the model output (never auth headers).
+    """
+    raw = json.dumps(payload, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class _InFlight:
+    """State shared between the leader and all waiters of one upstream call."""
+
+    def __init__(self) -> None:
+        self.cond = threading.Condition()
+        self.chunks: List[str] = []
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.done = False
+
+    def ready(self, index: int) -> bool:
+        """Whether chunks past ``index`` arrived or the call finished."""
+        return index < len(self.chunks) or self.done
+
+
+class SingleFlight:
+    """
+    Deduplicate identical in-flight upstream LLM calls.
+
+    The first caller for a key performs the call; callers arriving while it is
+    still running wait for and share its result. For streams every subscriber
+    replays the chunks produced so far and then follows the live stream, so a
+    late joiner still receives the full text. Nothing is cached once the call
+    completes.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _InFlight] = {}
+
+    def _join(self, key: str) -> tuple[_InFlight, bool]:
+        with self._lock:
+            call = self._calls.get(key)
+            metrics.cache_lookup("singleflight", call is not None)
+            if call is not None:
+                return call, False
+            call = _InFlight()
+            self._calls[key] = call
+            metrics.SINGLEFLIGHT_IN_FLIGHT.inc()
+            return call, True
+
+    def _finish(self, key: str, call: _InFlight) -> None:
+        with self._lock:
+            if self._calls.get(key) is call:
+                del self._calls[key]
+                metrics.SINGLEFLIGHT_IN_FLIGHT.dec()
+        with call.cond:
+            call.done = True
+            call.cond.notify_all()
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._calls)
+
+    def do(self, key: str, fn: Callable[[], T]) -> T:
+        """Run ``fn`` once per key among concurrent callers and share the result."""
+        call, leader = self._join(key)
+        if leader:
+            try:
+                call.result = fn()
+            except BaseException as e:
+                call.error = e
+            finally:
+                self._finish(key, call)
+        else:
+            with call.cond:
+                call.cond.wait_for(lambda: call.done)
+
+        if call.error is not None:
+            raise call.error
+        return cast(T, call.result)
+
+    def stream(
+        self, key: str, fn: Callable[[], Iterable[str]]
+    ) -> Generator[str, None, None]:
+        """
+        Share one upstream stream between all concurrent subscribers of ``key``.
+
+        The upstream iterator is drained by a background thread so that one
+        subscriber disconnecting does not cut the stream short for the others.
+        """
+        call, leader = self._join(key)
+        if leader:
+            threading.Thread(
+                target=tracing.in_current_context(self._produce),
+                args=(key, call, fn),
+                daemon=True,
+            ).start()
+
+        index = 0
+        while True:
+            with call.cond:
+                call.cond.wait_for(partial(call.ready, index))
+                pending = call.chunks[index:]
+                finished = call.done
+            index += len(pending)
+            yield from pending
+            if finished and index >= len(call.chunks):
+                break
+
+        if call.error is not None:
+            raise call.error
+
+    def _produce(
+        self, key: str, call: _InFlight, fn: Callable[[], Iterable[str]]
+    ) -> None:
+        try:
+            for chunk in fn():
+                with call.cond:
+                    call.chunks.append(chunk)
+                    call.cond.notify_all()
+        except BaseException as e:
+            call.error = e
+        finally:
+            self._finish(key, call)
+
+
+singleflight = SingleFlight()
+
+
+# ---------------------------------------------------------------------------
+# Completion sessions (cancellation of superseded requests)
+# ---------------------------------------------------------------------------
+
+class CompletionSuperseded(Exception):
+    """Raised when a newer request for the same completion session arrived."""
+
+
+class SessionCancel(threading.Event):
+    """
+    Cancel event of one session request. Besides being set by a newer
+    request in this worker, ``is_set`` notices (at most every
+    ``CompletionSessions.CHECK_INTERVAL_SECONDS``) a newer request that
+    another worker recorded in the shared tier.
+    """
+
+    def __init__(self, sessions: "CompletionSessions", session_id: str, seq: int) -> None:
+        super().__init__()
+        self._sessions = sessions
+        self._session_id = session_id
+        self._seq = seq
+        self._checked = time.monotonic()
+
+    def is_set(self) -> bool:
+        if super().is_set():
+            return True
+        now = time.monotonic()
+        if now - self._checked >= self._sessions.CHECK_INTERVAL_SECONDS:
+            self._checked = now
+            if self._sessions.shared_latest(self._session_id) > self._seq:
+                self.set()
+                return True
+        return False
+
+
+class CompletionSessions:
+    """
+    Track the newest completion request per editor session.
+
+    The editor tags every completion request with its session/document id and
+    a monotonically increasing sequence number. Starting a request cancels the
+    older in-flight request of the same session, and requests that arrive
+    after a newer one has started are rejected without calling upstream.
+    Tokens that would have been generated for cancelled requests are counted
+    as saved.
+
+    The latest sequence number per session is also kept in the shared cache
+    tier (app/core/cache.py), so a newer request served by another worker
+    cancels the in-flight one too; in-flight requests poll it between chunks.
+    """
+
+    CHECK_INTERVAL_SECONDS = 0.05
+    # Sessions idle for longer are forgotten by the shared tier
+    SHARED_TTL_SECONDS = 600
+
+    def __init__(
+        self,
+        max_sessions: int = 10_000,
+        backend: CacheBackend | None | Callable[[], CacheBackend | None] = shared_backend,
+    ) -> None:
+        self._lock = threading.Lock()
+        self._max_sessions = max_sessions
+        self._backend = backend
+        # session id -> (latest seq, cancel event of the latest request)
+        self._latest: OrderedDict[str, tuple[int, threading.Event]] = OrderedDict()
+        self.cancelled_requests = 0
+        self.saved_tokens = 0
+
+    @property
+    def backend(self) -> CacheBackend | None:
+        return self._backend() if callable(self._backend) else self._backend
+
+    def shared_latest(self, session_id: str) -> int:
+        """Latest seq of the session recorded by any worker (-1 if unknown)."""
+        backend = self.backend
+        if backend is None:
+            return -1
+        try:
+            found = backend.get(f"completion-seq:{session_id}")
+        except Exception:
+            logger.warning("Shared completion session lookup failed", exc_info=True)
+            return -1
+        return int(found[0]) if found else -1
+
+    def _share(self, session_id: str, seq: int) -> None:
+        backend = self.backend
+        if backend is None:
+            return
+        try:
+            backend.set(
+                f"completion-seq:{session_id}",
+                str(seq).encode(),
+                time.time() + self.SHARED_TTL_SECONDS,
+            )
+        except Exception:
+            logger.warning("Shared completion session write failed", exc_info=True)
+
+    def begin(self, session_id: str, seq: int) -> threading.Event:
+        """
+        Register request ``seq`` of ``session_id`` and return its cancel event.
+        The event is already set if a newer request of the session exists.
+        """
+        cancel = SessionCancel(self, session_id, seq)
+        if self.shared_latest(session_id) > seq:
+            cancel.set()
+            return cancel
+        with self._lock:
+            latest = self._latest.get(session_id)
+            if latest is not None and latest[0] >= seq:
+                cancel.set()
+                return cancel
+            if latest is not None:
+                latest[1].set()
+            self._latest[session_id] = (seq, cancel)
+            self._latest.move_to_end(session_id)
+            while len(self._latest) > self._max_sessions:
+                self._latest.popitem(last=False)
+        self._share(session_id, seq)
+        return cancel
+
+    def record_cancelled(self, max_tokens: int, generated_tokens: int) -> None:
+        with self._lock:
+            self.cancelled_requests += 1
+            self.saved_tokens += max(max_tokens - generated_tokens, 0)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "active_sessions": len(self._latest),
+                "cancelled_requests": self.cancelled_requests,
+                "saved_tokens": self.saved_tokens,
+            }
+
+
+completion_sessions = CompletionSessions()
+
+
+def cancellable(
+    chunks: Iterable[str], cancel: threading.Event, max_tokens: int
+) -> Generator[str, None, None]:
+    """
+    Yield upstream chunks until ``cancel`` is set. On cancellation the upstream
+    iterator is closed (which closes the HTTP connection) and the remaining
+    token budget is recorded as saved before raising CompletionSuperseded.
+    Each streamed delta is counted as one token.
+    """
+    generated = 0
+    iterator = iter(chunks)
+    try:
+        if cancel.is_set():
+            raise CompletionSuperseded()
+        for chunk in iterator:
+            generated += 1
+            yield chunk
+            if cancel.is_set():
+                raise CompletionSuperseded()
+    except CompletionSuperseded:
+        completion_sessions.record_cancelled(max_tokens, generated)
+        raise
+    finally:
+        close = getattr(iterator, "close", None)
+        if close is not None:
+            close()
+
+
+# ---------------------------------------------------------------------------
+# Local inference (Ollama / llama.cpp server)
+# ---------------------------------------------------------------------------
+
+class LocalLLM:
+    """
+    Client for a local Ollama or llama.cpp server.
+
+    Completions use the server's native fill-in-the-middle support (Ollama's
+    ``suffix`` field, llama.cpp's ``/infill``). Ollama is asked to keep the
+    model resident for ``keep_alive`` and a background thread re-pings it
+    before that expires so the first completion after a quiet period does not
+    pay the model load time.
+    """
+
+    HEALTH_TTL_SECONDS = 10.0
+
+    def __init__(
+        self,
+        base_url: Optional[str],
+        server: str = "ollama",
+        model: str = "codeqwen",
+        keep_alive: str = "30m",
+        timeout: float = 30,
+    ) -> None:
+        self.base_url = base_url.rstrip("/") if base_url else None
+        self.server = server
+        self.model = model
+        self.keep_alive = keep_alive
+        self.timeout = timeout
+        self._health_lock = threading.Lock()
+        self._healthy = False
+        self._checked_at = float("-inf")
+        self._probing = False
+        self._keepalive_stop: Optional[threading.Event] = None
+
+    @property
+    def configured(self) -> bool:
+        return self.base_url is not None
+
+    def healthy(self, force: bool = False) -> bool:
+        """
+        Return whether the server is up and serving the model (cached briefly).
+
+        One caller at a time probes, outside the lock; the others read the
+        last result instead of queueing behind the probe's timeout.
+        """
+        if not self.configured:
+            return False
+        with self._health_lock:
+            now = time.monotonic()
+            fresh = now - self._checked_at < self.HEALTH_TTL_SECONDS
+            if not force and (fresh or self._probing):
+                return self._healthy
+            self._checked_at = now
+            self._probing = True
+        healthy = False
+        try:
+            healthy = self._probe()
+        finally:
+            with self._health_lock:
+                self._healthy = healthy
+                self._probing = False
+        return healthy
+
+    def _probe(self) -> bool:
+        try:
+            if self.server == "llamacpp":
+                r = requests.get(f"{self.base_url}/health", timeout=2)
+                return r.status_code == 200
+            r = requests.get(f"{self.base_url}/api/tags", timeout=2)
+            r.raise_for_status()
+            names = [m.get("name", "") for m in r.json().get("models", [])]
+            return any(n == self.model or n.startswith(f"{self.model}:") for n in names)
+        except (requests.RequestException, ValueError):
+            return False
+
+    def warm(self) -> None:
+        """Load the model (if needed) and extend its keep-alive."""
+        if self.server != "ollama":
+            # llama.cpp keeps its single model loaded for the process lifetime
+            return
+        requests.post(
+            f"{self.base_url}/api/generate",
+            json={"model": self.model, "keep_alive": self.keep_alive},
+            timeout=self.timeout,
+        ).raise_for_status()
+
+    def start_keepalive(self, interval: float) -> None:
+        """Ping the server every ``interval`` seconds from a daemon thread."""
+        if not self.configured or self._keepalive_stop is not None:
+            return
+        stop = threading.Event()
+        self._keepalive_stop = stop
+
+        def run() -> None:
+            while True:
+                try:
+                    self.warm()
+                except requests.RequestException as e:
+                    logger.warning("Local LLM keep-alive failed: %s", e)
+                if stop.wait(interval):
+                    return
+
+        threading.Thread(target=run, name="local-llm-keepalive", daemon=True).start()
+
+    def stop_keepalive(self) -> None:
+        if self._keepalive_stop is not None:
+            self._keepalive_stop.set()
+            self._keepalive_stop = None
+
+    def stream_fim(
+        self,
+        prefix: str,
+        suffix: str = "",
+        max_tokens: int = 150,
+        temperature: float = 0.4,
+        stop: Optional[List[str]] = None,
+    ) -> Generator[str, None, None]:
+        """Stream a fill-in-the-middle completion between ``prefix`` and ``suffix``."""
+        if self.server == "llamacpp":
+            payload: Dict[str, Any] = {
+                "input_prefix": prefix,
+                "input_suffix": suffix,
+                "n_predict": max_tokens,
+                "temperature": temperature,
+                "stop": stop or [],
+                "stream": True,
+            }
+            yield from self._stream(f"{self.base_url}/infill", payload, _llamacpp_content)
+            return
+
+        payload = {
+            "model": self.model,
+            "prompt": prefix,
+            "suffix": suffix,
+            "stream": True,
+            "keep_alive": self.keep_alive,
+            "options": {
+                "temperature": temperature,
+                "num_predict": max_tokens,
+                "stop": stop or [],
+            },
+        }
+        yield from self._stream(
+            f"{self.base_url}/api/generate", payload, lambda d: d.get("response", "")
+        )
+
+    def stream_chat(
+        self,
+        messages: List[Dict[str, str]],
+        max_tokens: int = 1000,
+        temperature: float = 0.6,
+    ) -> Generator[str, None, None]:
+        """Stream a chat completion."""
+        if self.server == "llamacpp":
+            payload: Dict[str, Any] = {
+                "messages": messages,
+                "max_tokens": max_tokens,
+                "temperature": temperature,
+                "stream": True,
+            }
+            yield from self._stream(
+                f"{self.base_url}/v1/chat/completions", payload, _extract_content
+            )
+            return
+
+        payload = {
+            "model": self.model,
+            "messages": messages,
+            "stream": True,
+            "keep_alive": self.keep_alive,
+            "options": {"temperature": temperature, "num_predict": max_tokens},
+        }
+        yield from self._stream(
+            f"{self.base_url}/api/chat",
+            payload,
+            lambda d: d.get("message", {}).get("content", ""),
+        )
+
+    def _stream(
+        self, url: str, payload: Dict[str, Any], extract: Callable[[Dict[str, Any]], str]
+    ) -> Generator[str, None, None]:
+        # Ollama streams newline-delimited JSON, llama.cpp streams SSE
+        with requests.post(
+            url, json=payload, headers=tracing.inject({}), stream=True, timeout=self.timeout
+        ) as response:
+            tracing.event("response_headers", status=response.status_code)
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                decoded = line.decode("utf-8").strip()
+                if decoded.startswith("data: "):
+                    decoded = decoded[6:]
+                if decoded == "[DONE]":
+                    break
+                try:
+                    data = json.loads(decoded)
+                except json.JSONDecodeError:
+                    continue
+                content = extract(data)
+                if content:
+                    yield content
+                if data.get("done") or data.get("stop") is True:
+                    break
+
+
+def _llamacpp_content(data: Dict[str, Any]) -> str:
+    return str(data.get("content", ""))
+
+
+if settings.LOCAL_LLM_BASE_URL is None and settings.LOCAL_ENGINE_MODEL_PATH:
+    # The bundled CPU engine speaks the llama.cpp server API
+    local_llm = LocalLLM(
+        f"http://127.0.0.1:{settings.LOCAL_ENGINE_PORT}",
+        server="llamacpp",
+        model=settings.LOCAL_ENGINE_MODEL_PATH,
+        timeout=settings.LOCAL_LLM_TIMEOUT_SECONDS,
+    )
+else:
+    local_llm = LocalLLM(
+        settings.LOCAL_LLM_BASE_URL,
+        server=settings.LOCAL_LLM_SERVER,
+        model=settings.LOCAL_LLM_MODEL,
+        keep_alive=settings.LOCAL_LLM_KEEP_ALIVE,
+        timeout=settings.LOCAL_LLM_TIMEOUT_SECONDS,
+    )
+
+
+_openai_client: Any = None
+
+
+def get_openai_client() -> Any:
+    """Shared OpenAI client so connections are pooled across requests."""
+    global _openai_client
+    if _openai_client is None:
+        from openai import OpenAI
+
+        _openai_client = OpenAI(api_key=settings.OPENAI_API_KEY, base_url=settings.OPENAI_BASE_URL)
+    return _openai_client
@@ -0,0 +1,661 @@
+"""
+Provider routing with latency-aware selection and failover.
+
+Every LLM call goes through ``router.stream(LLMRequest(...))``. The router
+keeps rolling time-to-first-token (TTFT) samples and outcomes per provider,
+orders the providers allowed for the request class by speed (or by the
+configured order), skips providers that are cooling down after rate limits or
+repeated failures, and fails over to the next provider on connection errors,
+timeouts, 429s and 5xx responses. Completions that fail after some text was
+already streamed continue on the next provider with the partial output
+appended to the prompt. Completion requests can optionally be hedged.
+"""
+
+import queue
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+from collections.abc import Generator, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field, replace
+from typing import Any
+
+import requests
+
+from app.core import metrics, tracing
+from app.core.config import settings
+from app.core.context import count_tokens
+from app.core.llm import (
+    CompletionSuperseded,
+    cancellable,
+    get_openai_client,
+    local_llm,
+    stream_vertex_raw,
+)
+from app.core.prompts import completion_messages, prompt_cache
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+
+@dataclass
+class LLMRequest:
+    """
+    Provider-neutral request. ``messages`` is the chat form used by chat
+    models; completion requests also carry ``prompt``/``suffix`` so providers
+    with native fill-in-the-middle support can use them instead.
+    """
+
+    request_class: str  # "completion", "chat" or "testbench"
+    messages: list[dict[str, str]] = field(default_factory=list)
+    prompt: str = ""
+    suffix: str = ""
+    max_tokens: int = 1000
+    temperature: float = 0.6
+    stop: list[str] | None = None
+
+
+class NoProviderAvailable(RuntimeError):
+    pass
+
+
+class ProviderUnavailable(RuntimeError):
+    """A provider could not be used at all, e.g. missing credentials."""
+
+
+def is_retryable(exc: BaseException) -> bool:
+    """Whether another provider might succeed where this one failed."""
+    if isinstance(exc, ProviderUnavailable):
+        return True
+    if isinstance(exc, requests.HTTPError) and exc.response is not None:
+        return exc.response.status_code in RETRYABLE_STATUS
+    if isinstance(exc, (requests.ConnectionError, requests.Timeout)):
+        return True
+    if isinstance(exc, requests.exceptions.ChunkedEncodingError):
+        # The connection dropped mid-stream
+        return True
+    status = getattr(exc, "status_code", None)
+    if status is not None:
+        return status in RETRYABLE_STATUS
+    # openai.APIConnectionError / APITimeoutError carry no status code
+    return type(exc).__name__ in {"APIConnectionError", "APITimeoutError"}
+
+
+def _status_code(exc: BaseException) -> int | None:
+    if isinstance(exc, requests.HTTPError) and exc.response is not None:
+        return exc.response.status_code
+    return getattr(exc, "status_code", None)
+
+
+class ProviderStats:
+    """Rolling TTFT samples and outcomes for one provider."""
+
+    def __init__(self, window: int = 100) -> None:
+        self._lock = threading.Lock()
+        self.ttft: deque[float] = deque(maxlen=window)
+        self.outcomes: deque[bool] = deque(maxlen=window)
+        self.consecutive_failures = 0
+        self.cooldown_until = 0.0
+
+    def record_success(self, ttft: float) -> None:
+        with self._lock:
+            self.ttft.append(ttft)
+            self.outcomes.append(True)
+            self.consecutive_failures = 0
+
+    def record_failure(self, cooldown: float | None = None) -> None:
+        with self._lock:
+            self.outcomes.append(False)
+            self.consecutive_failures += 1
+            if cooldown is None and self.consecutive_failures >= 3:
+                cooldown = settings.LLM_PROVIDER_COOLDOWN_SECONDS
+            if cooldown:
+                self.cooldown_until = max(
+                    self.cooldown_until, time.monotonic() + cooldown
+                )
+
+    def cooling_down(self) -> bool:
+        return time.monotonic() < self.cooldown_until
+
+    def percentile(self, q: float) -> float | None:
+        with self._lock:
+            samples = sorted(self.ttft)
+        if not samples:
+            return None
+        return samples[min(int(q * len(samples)), len(samples) - 1)]
+
+    def error_rate(self) -> float:
+        with self._lock:
+            if not self.outcomes:
+                return 0.0
+            return self.outcomes.count(False) / len(self.outcomes)
+
+    def snapshot(self) -> dict[str, Any]:
+        return {
+            "ttft_p50": self.percentile(0.5),
+            "ttft_p95": self.percentile(0.95),
+            "error_rate": self.error_rate(),
+            "samples": len(self.ttft),
+            "cooling_down": self.cooling_down(),
+        }
+
+
+class Provider(ABC):
+    name = ""
+    # Whether complete_n can return several choices from one upstream call
+    supports_n = False
+
+    def available(self) -> bool:
+        return True
+
+    @abstractmethod
+    def stream(self, req: LLMRequest) -> Iterator[str]: ...
+
+    def complete_n(
+        self, req: LLMRequest, n: int, cancel: threading.Event | None = None
+    ) -> list[str]:
+        """
+        ``n`` completions; providers with ``supports_n`` make one upstream
+        call. Setting ``cancel`` stops generating and raises
+        CompletionSuperseded.
+        """
+        results = []
+        for _ in range(n):
+            chunks = self.stream(req)
+            if cancel is not None:
+                chunks = cancellable(chunks, cancel, req.max_tokens)
+            results.append("".join(chunks))
+        return results
+
+
+class OpenAIProvider(Provider):
+    name = "openai"
+    supports_n = True
+
+    def available(self) -> bool:
+        return bool(settings.OPENAI_API_KEY)
+
+    def stream(self, req: LLMRequest) -> Iterator[str]:
+        params: dict[str, Any] = {
+            "model": settings.OPENAI_MODEL,
+            "messages": req.messages,
+            "max_tokens": req.max_tokens,
+            "temperature": req.temperature,
+            "stream": True,
+            # The final chunk then reports usage, including cached prompt tokens
+            "stream_options": {"include_usage": True},
+        }
+        if req.stop:
+            # OpenAI accepts at most four stop sequences
+            params["stop"] = req.stop[:4]
+        headers = tracing.inject({})
+        if headers:
+            params["extra_headers"] = headers
+        stream = get_openai_client().chat.completions.create(**params)
+        tracing.event("response_headers")
+        try:
+            for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+                if getattr(chunk, "usage", None):
+                    details = getattr(chunk.usage, "prompt_tokens_details", None)
+                    prompt_cache.record(
+                        self.name,
+                        req.request_class,
+                        chunk.usage.prompt_tokens,
+                        getattr(details, "cached_tokens", None) or 0,
+                    )
+        finally:
+            stream.close()
+
+    def complete_n(
+        self, req: LLMRequest, n: int, cancel: threading.Event | None = None
+    ) -> list[str]:
+        params: dict[str, Any] = {
+            "model": settings.OPENAI_MODEL,
+            "messages": req.messages,
+            "max_tokens": req.max_tokens,
+            "temperature": req.temperature,
+            "n": n,
+        }
+        if req.stop:
+            params["stop"] = req.stop[:4]
+        headers = tracing.inject({})
+        if headers:
+            params["extra_headers"] = headers
+        if cancel is not None:
+            # Streamed, so that closing the stream stops generating
+            return self._stream_n(req, params, cancel)
+        response = get_openai_client().chat.completions.create(**params)
+        if response.usage is not None:
+            self._record_usage(req, response.usage)
+        return [choice.message.content or "" for choice in response.choices]
+
+    def _stream_n(
+        self, req: LLMRequest, params: dict[str, Any], cancel: threading.Event
+    ) -> list[str]:
+        stream = get_openai_client().chat.completions.create(
+            **params, stream=True, stream_options={"include_usage": True}
+        )
+        texts = [""] * params["n"]
+        try:
+            for chunk in stream:
+                if cancel.is_set():
+                    raise CompletionSuperseded()
+                for choice in chunk.choices:
+                    texts[choice.index] += choice.delta.content or ""
+                if getattr(chunk, "usage", None):
+                    self._record_usage(req, chunk.usage)
+        finally:
+            stream.close()
+        return texts
+
+    def _record_usage(self, req: LLMRequest, usage: Any) -> None:
+        details = getattr(usage, "prompt_tokens_details", None)
+        prompt_cache.record(
+            self.name,
+            req.request_class,
+            usage.prompt_tokens,
+            getattr(details, "cached_tokens", None) or 0,
+        )
+
+
+class VertexCodestralProvider(Provider):
+    name = "vertex"
+
+    def stream(self, req: LLMRequest) -> Iterator[str]:
+        payload: dict[str, Any] = {
+            "model": settings.VERTEX_CODESTRAL_MODEL,
+            "max_tokens": req.max_tokens,
+            "temperature": req.temperature,
+        }
+        if req.stop:
+            payload["stop"] = req.stop
+        if req.request_class == "completion":
+            # Codestral fill-in-the-middle prompt
+            if req.suffix.strip():
+                payload["prompt"] = (
+                    f"<fim_prefix>{req.prompt}<fim_suffix>{req.suffix}<fim_middle>"
+                )
+            else:
+                payload["prompt"] = req.prompt
+        else:
+            payload["messages"] = req.messages
+
+        def record_usage(usage: dict[str, Any]) -> None:
+            # Reported on the final chunk; cached tokens only where the model supports it
+            details = usage.get("prompt_tokens_details") or {}
+            prompt_cache.record(
+                self.name,
+                req.request_class,
+                usage.get("prompt_tokens", 0),
+                details.get("cached_tokens", 0),
+            )
+
+        try:
+            yield from stream_vertex_raw(
+                payload,
+                timeout=15 if req.request_class == "completion" else 60,
+                on_usage=record_usage,
+            )
+        except RuntimeError as e:
+            # Application Default Credentials could not be loaded or refreshed
+            raise ProviderUnavailable(str(e)) from e
+
+
+class LocalProvider(Provider):
+    name = "local"
+
+    def available(self) -> bool:
+        return local_llm.healthy()
+
+    def stream(self, req: LLMRequest) -> Iterator[str]:
+        if req.request_class == "completion":
+            return local_llm.stream_fim(
+                req.prompt,
+                req.suffix,
+                max_tokens=req.max_tokens,
+                temperature=req.temperature,
+                stop=req.stop,
+            )
+        return local_llm.stream_chat(
+            req.messages, max_tokens=req.max_tokens, temperature=req.temperature
+        )
+
+
+class _Attempt:
+    """One provider stream drained by a background thread (used for hedging)."""
+
+    def __init__(
+        self,
+        provider: Provider,
+        req: LLMRequest,
+        out: "queue.Queue[tuple[_Attempt, str, Any]]",
+    ) -> None:
+        self.provider = provider
+        self.cancelled = threading.Event()
+        self.started = time.monotonic()
+        threading.Thread(
+            target=tracing.in_current_context(self._run), args=(req, out), daemon=True
+        ).start()
+
+    def _run(
+        self, req: LLMRequest, out: "queue.Queue[tuple[_Attempt, str, Any]]"
+    ) -> None:
+        in_flight = metrics.LLM_REQUESTS_IN_FLIGHT.labels(self.provider.name)
+        in_flight.inc()
+        attributes = {
+            "llm.provider": self.provider.name,
+            "llm.request_class": req.request_class,
+            "llm.hedged": True,
+        }
+        iterator = iter(
+            tracing.traced_stream(
+                "llm.stream", lambda: self.provider.stream(req), **attributes
+            )
+        )
+        try:
+            for chunk in iterator:
+                if self.cancelled.is_set():
+                    return
+                out.put((self, "chunk", chunk))
+            out.put((self, "done", None))
+        except BaseException as e:
+            out.put((self, "error", e))
+        finally:
+            close = getattr(iterator, "close", None)
+            if close is not None:
+                close()
+            in_flight.dec()
+
+
+class Router:
+    def __init__(self, providers: list[Provider]) -> None:
+        self.providers = {p.name: p for p in providers}
+        self.stats = {p.name: ProviderStats() for p in providers}
+
+    def _allowed(self, request_class: str) -> list[str]:
+        return {
+            "completion": settings.LLM_COMPLETION_PROVIDERS,
+            "chat": settings.LLM_CHAT_PROVIDERS,
+            "testbench": settings.LLM_TESTBENCH_PROVIDERS,
+        }.get(request_class, settings.LLM_CHAT_PROVIDERS)
+
+    def candidates(self, request_class: str) -> list[Provider]:
+        """Healthy providers for the class, best first."""
+        names = [n for n in self._allowed(request_class) if n in self.providers]
+        healthy = [
+            n
+            for n in names
+            if not self.stats[n].cooling_down() and self.providers[n].available()
+        ]
+        if settings.LLM_ROUTING == "latency":
+            # Providers without samples yet sort first so they get measured;
+            # errors inflate the effective latency.
+            def score(name: str) -> float:
+                p50 = self.stats[name].percentile(0.5)
+                if p50 is None:
+                    return 0.0
+                return p50 * (1 + 4 * self.stats[name].error_rate())
+
+            healthy.sort(key=score)
+        return [self.providers[n] for n in healthy]
+
+    def _record_failure(self, provider: Provider, exc: BaseException) -> None:
+        cooldown = None
+        if _status_code(exc) == 429:
+            retry_after = getattr(getattr(exc, "response", None), "headers", {}).get(
+                "Retry-After"
+            )
+            try:
+                cooldown = (
+                    float(retry_after)
+                    if retry_after
+                    else float(settings.LLM_PROVIDER_COOLDOWN_SECONDS)
+                )
+            except ValueError:
+                cooldown = float(settings.LLM_PROVIDER_COOLDOWN_SECONDS)
+        self.stats[provider.name].record_failure(cooldown)
+        metrics.LLM_ERRORS.labels(provider.name).inc()
+
+    def _record_first_token(
+        self, provider: Provider, req: LLMRequest, ttft: float
+    ) -> None:
+        self.stats[provider.name].record_success(ttft)
+        metrics.LLM_TIME_TO_FIRST_TOKEN_SECONDS.labels(
+            provider.name, req.request_class
+        ).observe(ttft)
+
+    def _record_output(
+        self,
+        provider: Provider,
+        req: LLMRequest,
+        text: str,
+        first_token_at: float | None,
+    ) -> None:
+        """Tokens generated, and the generation speed of a stream after its first token."""
+        tokens = count_tokens(text) if text else 0
+        metrics.LLM_COMPLETION_TOKENS.labels(provider.name, req.request_class).inc(
+            tokens
+        )
+        if first_token_at is not None and tokens > 1:
+            elapsed = time.monotonic() - first_token_at
+            if elapsed > 0:
+                metrics.LLM_TOKENS_PER_SECOND.labels(
+                    provider.name, req.request_class
+                ).observe((tokens - 1) / elapsed)
+
+    def stream(
+        self, req: LLMRequest, hedge: bool = False
+    ) -> Generator[str, None, None]:
+        """
+        Stream the response from the best provider, failing over on
+        retryable errors. Raises NoProviderAvailable when every candidate
+        failed or none is healthy.
+        """
+        remaining = self.candidates(req.request_class)
+        if not remaining:
+            raise NoProviderAvailable(
+                f"No healthy LLM provider for {req.request_class} requests"
+            )
+
+        emitted = ""
+        last_error: BaseException | None = None
+        while remaining:
+            if hedge and len(remaining) > 1 and not emitted:
+                attempt = self._stream_hedged(req, remaining)
+            else:
+                attempt = self._stream_one(req, remaining.pop(0))
+            try:
+                for chunk in attempt:
+                    emitted += chunk
+                    yield chunk
+                return
+            except BaseException as e:
+                if not is_retryable(e):
+                    raise
+                last_error = e
+                if emitted:
+                    if req.request_class != "completion":
+                        # Chat replies cannot be resumed transparently
+                        raise
+                    # Continue the completion where the failed provider
+                    # stopped: the emitted text joins the prefix, before the
+                    # suffix, in both the FIM and the chat form
+                    prompt = req.prompt + emitted
+                    req = replace(
+                        req,
+                        messages=completion_messages(prompt, req.suffix)
+                        if req.messages
+                        else [],
+                        prompt=prompt,
+                        max_tokens=max(req.max_tokens - len(emitted) // 4, 1),
+                    )
+                    emitted = ""
+        raise NoProviderAvailable(
+            f"All LLM providers failed: {last_error}"
+        ) from last_error
+
+    def _stream_one(
+        self, req: LLMRequest, provider: Provider
+    ) -> Generator[str, None, None]:
+        started = time.monotonic()
+        first_token_at = None
+        parts = []
+        in_flight = metrics.LLM_REQUESTS_IN_FLIGHT.labels(provider.name)
+        in_flight.inc()
+        try:
+            chunks = tracing.traced_stream(
+                "llm.stream",
+                lambda: provider.stream(req),
+                **{
+                    "llm.provider": provider.name,
+                    "llm.request_class": req.request_class,
+                },
+            )
+            for chunk in chunks:
+                if first_token_at is None:
+                    first_token_at = time.monotonic()
+                    self._record_first_token(provider, req, first_token_at - started)
+                parts.append(chunk)
+                yield chunk
+        except BaseException as e:
+            if isinstance(e, GeneratorExit):
+                raise
+            self._record_failure(provider, e)
+            raise
+        finally:
+            in_flight.dec()
+            if parts:
+                self._record_output(provider, req, "".join(parts), first_token_at)
+
+    def complete_n(
+        self, req: LLMRequest, n: int, cancel: threading.Event | None = None
+    ) -> list[str]:
+        """
+        ``n`` alternative completions. When the best provider can return
+        several choices from one call it is asked once; otherwise (or if that
+        call fails) ``n`` streams run in parallel with temperatures spread
+        upwards from the requested one. Failed streams are left out unless
+        all of them fail. Setting ``cancel`` stops every upstream call and
+        raises CompletionSuperseded.
+        """
+        remaining = self.candidates(req.request_class)
+        if not remaining:
+            raise NoProviderAvailable(
+                f"No healthy LLM provider for {req.request_class} requests"
+            )
+        best = remaining[0]
+        if n > 1 and best.supports_n:
+            try:
+                with tracing.span(
+                    "llm.complete_n", **{"llm.provider": best.name, "llm.n": n}
+                ):
+                    results = best.complete_n(req, n, cancel)
+                self._record_output(best, req, "".join(results), None)
+                return results
+            except Exception as e:
+                if not is_retryable(e):
+                    raise
+                self._record_failure(best, e)
+
+        def one(temperature: float) -> str:
+            chunks: Iterator[str] = self.stream(replace(req, temperature=temperature))
+            if cancel is not None:
+                chunks = cancellable(chunks, cancel, req.max_tokens)
+            return "".join(chunks)
+
+        temperatures = [min(req.temperature + 0.15 * i, 1.0) for i in range(n)]
+        with ThreadPoolExecutor(max_workers=n) as pool:
+            futures = [
+                pool.submit(tracing.in_current_context(one), t) for t in temperatures
+            ]
+        if cancel is not None and cancel.is_set():
+            raise CompletionSuperseded()
+        results, errors = [], []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                errors.append(e)
+        if not results:
+            raise errors[0]
+        return results
+
+    def hedge_delay(self, provider: Provider) -> float:
+        if settings.LLM_HEDGE_DELAY_MS is not None:
+            return settings.LLM_HEDGE_DELAY_MS / 1000
+        p95 = self.stats[provider.name].percentile(0.95)
+        return p95 if p95 is not None else 0.3
+
+    def _stream_hedged(
+        self, req: LLMRequest, remaining: list[Provider]
+    ) -> Generator[str, None, None]:
+        """
+        Start the first provider; if it has produced nothing after the hedge
+        delay, start the second as well. The first to produce a token wins and
+        the other is cancelled. Consumes the providers it started from
+        ``remaining``.
+        """
+        out: queue.Queue[tuple[_Attempt, str, Any]] = queue.Queue()
+        attempts = [_Attempt(remaining.pop(0), req, out)]
+        deadline = time.monotonic() + self.hedge_delay(attempts[0].provider)
+        winner: _Attempt | None = None
+        first_token_at: float | None = None
+        parts: list[str] = []
+        failures: list[BaseException] = []
+
+        try:
+            while True:
+                timeout = None
+                if winner is None and len(attempts) == 1 and remaining:
+                    timeout = max(deadline - time.monotonic(), 0)
+                try:
+                    attempt, kind, value = out.get(timeout=timeout)
+                except queue.Empty:
+                    attempts.append(_Attempt(remaining.pop(0), req, out))
+                    continue
+                if winner is not None and attempt is not winner:
+                    continue
+                if attempt.cancelled.is_set():
+                    continue
+
+                if kind == "error":
+                    self._record_failure(attempt.provider, value)
+                    if winner is attempt or not is_retryable(value):
+                        raise value
+                    failures.append(value)
+                    attempt.cancelled.set()
+                    if len(failures) == len(attempts):
+                        if remaining and len(attempts) == 1:
+                            attempts.append(_Attempt(remaining.pop(0), req, out))
+                            continue
+                        raise value
+                    continue
+
+                if winner is None:
+                    winner = attempt
+                    first_token_at = time.monotonic()
+                    self._record_first_token(
+                        attempt.provider, req, first_token_at - attempt.started
+                    )
+                    for other in attempts:
+                        if other is not winner:
+                            other.cancelled.set()
+                if kind == "done":
+                    return
+                parts.append(value)
+                yield value
+        finally:
+            for attempt in attempts:
+                attempt.cancelled.set()
+            if winner is not None and parts:
+                self._record_output(
+                    winner.provider, req, "".join(parts), first_token_at
+                )
+
+    def snapshot(self) -> dict[str, dict[str, Any]]:
+        return {name: stats.snapshot() for name, stats in self.stats.items()}
+
+
+router = Router([OpenAIProvider(), VertexCodestralProvider(), LocalProvider()])
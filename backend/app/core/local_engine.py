@@ -0,0 +1,441 @@
+"""
+In-process CPU inference engine for small fill-in-the-middle code models.
+
+Meant for air-gapped lab deployments without access to cloud LLMs. The engine
+runs as one dedicated process per box (``python -m app.core.local_engine``, or
+started by the prefork master, or a single-process server, when
+``LOCAL_ENGINE_MODEL_PATH`` is set), so the model weights and the GIL-heavy
+decode loop stay out of the API workers. It serves the llama.cpp server
+``/health``, ``/infill`` and ``/v1/chat/completions`` API, which lets the
+``LocalLLM`` client and routing rules in ``app.core.llm`` use it unchanged.
+
+Concurrent requests from all API workers are collected into dynamic batches:
+the first request opens a short batching window and everything that arrives
+within it (up to ``max_batch_size``) is decoded together. Requests decoded on
+their own reuse the KV cache of the longest previously seen prompt prefix,
+which is the common case for completions while a user keeps typing.
+"""
+
+import argparse
+import copy
+import json
+import logging
+import os
+import queue
+import socket
+import subprocess
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Set for the workers of a server whose master owns the engine process
+SUPERVISED_ENV = "LOCAL_ENGINE_SUPERVISED"
+
+
+@dataclass
+class EngineConfig:
+    model_path: str
+    quantization: str = "int8"
+    max_batch_size: int = 8
+    batch_window_ms: int = 15
+    prefix_cache_size: int = 8
+    threads: int | None = None
+    fim_template: str = "<fim_prefix>{prefix}<fim_suffix>{suffix}<fim_middle>"
+
+    @classmethod
+    def from_settings(cls, model_path: str) -> "EngineConfig":
+        return cls(
+            model_path=model_path,
+            quantization=settings.LOCAL_ENGINE_QUANTIZATION,
+            max_batch_size=settings.LOCAL_ENGINE_MAX_BATCH_SIZE,
+            batch_window_ms=settings.LOCAL_ENGINE_BATCH_WINDOW_MS,
+            prefix_cache_size=settings.LOCAL_ENGINE_PREFIX_CACHE_SIZE,
+            threads=settings.LOCAL_ENGINE_THREADS,
+            fim_template=settings.LOCAL_ENGINE_FIM_TEMPLATE,
+        )
+
+
+@dataclass
+class _Job:
+    prompt: str
+    max_tokens: int
+    temperature: float
+    stop: list[str]
+    future: "Future[str]" = field(default_factory=Future)
+
+
+def _truncate_at_stop(text: str, stop: list[str]) -> str:
+    cut = len(text)
+    for s in stop:
+        if s:
+            i = text.find(s)
+            if i != -1:
+                cut = min(cut, i)
+    return text[:cut]
+
+
+class PrefixCache:
+    """
+    LRU of prefilled prompts: token ids -> (past_key_values, last logits).
+
+    ``lookup`` returns the entry with the longest key that is a prefix of the
+    new prompt, so only the tokens after it need to be prefilled.
+    """
+
+    def __init__(self, capacity: int) -> None:
+        self.capacity = capacity
+        self._entries: OrderedDict[tuple[int, ...], tuple[Any, Any]] = OrderedDict()
+
+    def lookup(self, ids: list[int]) -> tuple[int, Any, Any]:
+        best: tuple[int, ...] = ()
+        for key in self._entries:
+            if len(best) < len(key) <= len(ids) and tuple(ids[: len(key)]) == key:
+                best = key
+        if not best:
+            return 0, None, None
+        self._entries.move_to_end(best)
+        past, logits = self._entries[best]
+        return len(best), past, logits
+
+    def store(self, ids: list[int], past: Any, logits: Any) -> None:
+        if self.capacity <= 0:
+            return
+        self._entries[tuple(ids)] = (past, logits)
+        self._entries.move_to_end(tuple(ids))
+        while len(self._entries) > self.capacity:
+            self._entries.popitem(last=False)
+
+
+class Engine:
+    """Owns the model and runs the batching decode loop on one thread."""
+
+    def __init__(self, config: EngineConfig) -> None:
+        self.config = config
+        self.jobs: queue.Queue[_Job] = queue.Queue()
+        self.prefix_cache = PrefixCache(config.prefix_cache_size)
+        self.model: Any = None
+        self.tokenizer: Any = None
+
+    def load(self) -> None:
+        import torch
+        from transformers import AutoModelForCausalLM, AutoTokenizer
+
+        if self.config.threads:
+            torch.set_num_threads(self.config.threads)
+
+        started = time.perf_counter()
+        tokenizer = AutoTokenizer.from_pretrained(self.config.model_path)
+        tokenizer.padding_side = "left"
+        if tokenizer.pad_token is None:
+            tokenizer.pad_token = tokenizer.eos_token
+
+        kwargs: dict[str, Any] = {"torch_dtype": torch.float32}
+        if self.config.quantization == "int4":
+            # Needs a bitsandbytes build with CPU support
+            from transformers import BitsAndBytesConfig
+
+            kwargs["quantization_config"] = BitsAndBytesConfig(
+                load_in_4bit=True, bnb_4bit_compute_dtype=torch.float32
+            )
+        model = AutoModelForCausalLM.from_pretrained(self.config.model_path, **kwargs)
+        if self.config.quantization == "int8":
+            model = torch.ao.quantization.quantize_dynamic(
+                model, {torch.nn.Linear}, dtype=torch.qint8
+            )
+        model.eval()
+
+        self.model, self.tokenizer = model, tokenizer
+        logger.info(
+            "Loaded %s (%s) in %.1fs",
+            self.config.model_path,
+            self.config.quantization,
+            time.perf_counter() - started,
+        )
+
+    def submit(
+        self, prompt: str, max_tokens: int, temperature: float, stop: list[str]
+    ) -> "Future[str]":
+        job = _Job(prompt, max_tokens, temperature, stop)
+        self.jobs.put(job)
+        return job.future
+
+    def fim_prompt(self, prefix: str, suffix: str) -> str:
+        return self.config.fim_template.format(prefix=prefix, suffix=suffix)
+
+    def chat_prompt(self, messages: list[dict[str, str]]) -> str:
+        if getattr(self.tokenizer, "chat_template", None):
+            prompt: str = self.tokenizer.apply_chat_template(
+                messages, tokenize=False, add_generation_prompt=True
+            )
+            return prompt
+        # Base code models ship without a chat template
+        turns = "".join(f"{m['role']}: {m['content']}\n\n" for m in messages)
+        return f"{turns}assistant: "
+
+    def _next_batch(self) -> list[_Job]:
+        batch = [self.jobs.get()]
+        deadline = time.monotonic() + self.config.batch_window_ms / 1000
+        while len(batch) < self.config.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.jobs.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def run_forever(self) -> None:
+        while True:
+            batch = self._next_batch()
+            # Sampling settings are per generate() call, so group by them
+            groups: dict[float, list[_Job]] = {}
+            for job in batch:
+                groups.setdefault(round(job.temperature, 2), []).append(job)
+            for jobs in groups.values():
+                try:
+                    if len(jobs) == 1:
+                        texts = [self._generate_one(jobs[0])]
+                    else:
+                        texts = self._generate_batch(jobs)
+                except Exception as e:
+                    logger.exception("Local engine generation failed")
+                    for job in jobs:
+                        job.future.set_exception(e)
+                    continue
+                for job, text in zip(jobs, texts, strict=True):
+                    job.future.set_result(_truncate_at_stop(text, job.stop))
+
+    def _sample(self, logits: Any, temperature: float) -> int:
+        import torch
+
+        if temperature < 1e-3:
+            return int(torch.argmax(logits, dim=-1).item())
+        probs = torch.softmax(logits / temperature, dim=-1)
+        return int(torch.multinomial(probs, num_samples=1).item())
+
+    def _generate_one(self, job: _Job) -> str:
+        import torch
+
+        ids = self.tokenizer(job.prompt)["input_ids"]
+        cached, past, logits = self.prefix_cache.lookup(ids)
+
+        with torch.inference_mode():
+            if past is not None:
+                # The decode loop extends the cache in place; keep the stored copy intact
+                past = copy.deepcopy(past)
+            if cached < len(ids):
+                out = self.model(
+                    input_ids=torch.tensor([ids[cached:]]),
+                    past_key_values=past,
+                    use_cache=True,
+                )
+                past, logits = out.past_key_values, out.logits[0, -1]
+                self.prefix_cache.store(ids, copy.deepcopy(past), logits)
+
+            generated: list[int] = []
+            for _ in range(job.max_tokens):
+                token = self._sample(logits, job.temperature)
+                if token == self.tokenizer.eos_token_id:
+                    break
+                generated.append(token)
+                if job.stop and any(
+                    s in self.tokenizer.decode(generated[-16:]) for s in job.stop
+                ):
+                    break
+                out = self.model(
+                    input_ids=torch.tensor([[token]]),
+                    past_key_values=past,
+                    use_cache=True,
+                )
+                past, logits = out.past_key_values, out.logits[0, -1]
+
+        return str(self.tokenizer.decode(generated, skip_special_tokens=True))
+
+    def _generate_batch(self, jobs: list[_Job]) -> list[str]:
+        import torch
+
+        enc = self.tokenizer(
+            [j.prompt for j in jobs], return_tensors="pt", padding=True
+        )
+        temperature = jobs[0].temperature
+        sampling: dict[str, Any] = (
+            {"do_sample": True, "temperature": temperature}
+            if temperature >= 1e-3
+            else {"do_sample": False}
+        )
+        with torch.inference_mode():
+            out = self.model.generate(
+                **enc,
+                max_new_tokens=max(j.max_tokens for j in jobs),
+                pad_token_id=self.tokenizer.pad_token_id,
+                **sampling,
+            )
+        prompt_len = enc["input_ids"].shape[1]
+        return [
+            self.tokenizer.decode(
+                row[prompt_len:][: job.max_tokens], skip_special_tokens=True
+            )
+            for row, job in zip(out, jobs, strict=True)
+        ]
+
+
+def _make_handler(engine: Engine) -> type[BaseHTTPRequestHandler]:
+    class Handler(BaseHTTPRequestHandler):
+        """
+        llama.cpp server compatible subset: GET /health, POST /infill and
+        POST /v1/chat/completions.
+        """
+
+        def log_message(self, *_args: Any) -> None:
+            pass
+
+        def _json(self, status: int, body: dict[str, Any]) -> None:
+            raw = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(raw)))
+            self.end_headers()
+            self.wfile.write(raw)
+
+        def do_GET(self) -> None:
+            if self.path == "/health" and engine.model is None:
+                self._json(503, {"status": "loading model"})
+            elif self.path == "/health":
+                self._json(200, {"status": "ok", "queued": engine.jobs.qsize()})
+            else:
+                self._json(404, {"error": "not found"})
+
+        def _events(self, events: list[str]) -> None:
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.end_headers()
+            self.wfile.write("".join(f"data: {e}\n\n" for e in events).encode())
+
+        def do_POST(self) -> None:
+            if self.path not in ("/infill", "/v1/chat/completions"):
+                self._json(404, {"error": "not found"})
+                return
+            req = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            chat = self.path == "/v1/chat/completions"
+            if chat:
+                prompt = engine.chat_prompt(req.get("messages", []))
+                max_tokens = int(req.get("max_tokens", 1000))
+            else:
+                prompt = engine.fim_prompt(
+                    req.get("input_prefix", ""), req.get("input_suffix", "")
+                )
+                max_tokens = int(req.get("n_predict", 150))
+            stop = req.get("stop") or []
+            future = engine.submit(
+                prompt,
+                max_tokens=max_tokens,
+                temperature=float(req.get("temperature", 0.4)),
+                stop=[stop] if isinstance(stop, str) else list(stop),
+            )
+            try:
+                content = future.result()
+            except Exception as e:
+                self._json(500, {"error": str(e)})
+                return
+
+            # Batched decoding finishes all sequences together, so a stream
+            # carries the whole completion in a single event
+            if not chat:
+                if req.get("stream"):
+                    self._events([json.dumps({"content": content, "stop": True})])
+                else:
+                    self._json(200, {"content": content, "stop": True})
+            elif req.get("stream"):
+                choice = {
+                    "index": 0,
+                    "delta": {"content": content},
+                    "finish_reason": "stop",
+                }
+                self._events([json.dumps({"choices": [choice]}), "[DONE]"])
+            else:
+                message = {"role": "assistant", "content": content}
+                choice = {"index": 0, "message": message, "finish_reason": "stop"}
+                self._json(200, {"choices": [choice]})
+
+    return Handler
+
+
+def serve(config: EngineConfig, host: str, port: int) -> None:
+    engine = Engine(config)
+    # Bind before loading the model: when a second engine is started on the
+    # box, it finds the port taken and exits cheaply
+    try:
+        server = ThreadingHTTPServer((host, port), _make_handler(engine))
+    except OSError:
+        logger.info("Local engine already running on %s:%s", host, port)
+        return
+
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    engine.load()
+    logger.info("Local engine listening on %s:%s", host, port)
+    engine.run_forever()
+
+
+def _port_in_use(host: str, port: int) -> bool:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.settimeout(0.2)
+        return s.connect_ex((host, port)) == 0
+
+
+def spawn_local_engine() -> subprocess.Popen[bytes] | None:
+    """
+    Start the engine process for this box unless it is already running or
+    owned by the prefork master. Called from the master before it forks, and
+    from the lifespan of a single-process server; returns None when nothing
+    was started. Pair with ``stop_local_engine``.
+    """
+    if not settings.LOCAL_ENGINE_MODEL_PATH or os.environ.get(SUPERVISED_ENV):
+        return None
+    if _port_in_use("127.0.0.1", settings.LOCAL_ENGINE_PORT):
+        return None
+    return subprocess.Popen(
+        [sys.executable, "-m", "app.core.local_engine"],
+        env=os.environ.copy(),
+        start_new_session=True,
+    )
+
+
+def stop_local_engine(
+    process: subprocess.Popen[bytes] | None, timeout: float = 10
+) -> None:
+    """Terminate and reap an engine started by ``spawn_local_engine``."""
+    if process is None or process.poll() is not None:
+        return
+    process.terminate()
+    try:
+        process.wait(timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--model-path", default=settings.LOCAL_ENGINE_MODEL_PATH)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=settings.LOCAL_ENGINE_PORT)
+    args = parser.parse_args()
+    if not args.model_path:
+        parser.error("--model-path or LOCAL_ENGINE_MODEL_PATH is required")
+
+    serve(EngineConfig.from_settings(args.model_path), args.host, args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+"""
+Prometheus metrics.
+
+Everything the backend measures is defined here, so the instrumented modules
+only import the metric they update. Instrumentation stays on the cheap side:
+labels are route templates, provider names and request classes (never paths
+or user input), and counting is a dict lookup and an atomic add per event.
+
+With several workers (``python -m app.prefork --workers 4``) the master
+sets ``PROMETHEUS_MULTIPROC_DIR`` to an empty, writable directory before
+the workers start (unless it is already set); every worker then writes its
+samples there and ``/metrics`` aggregates them, whichever worker serves the
+scrape.
+"""
+
+import os
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# Most LLM and simulation latencies are between 100ms and tens of seconds
+_SLOW_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 40.0, 80.0)
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds",
+    "Time to send the full response, including streamed bodies",
+    ["method", "route", "status"],
+)
+HTTP_REQUESTS_IN_FLIGHT = Gauge(
+    "http_requests_in_flight",
+    "Requests being handled",
+    multiprocess_mode="livesum",
+)
+
+LLM_TIME_TO_FIRST_TOKEN_SECONDS = Histogram(
+    "llm_time_to_first_token_seconds",
+    "Time from sending an LLM request to its first token",
+    ["provider", "request_class"],
+    buckets=_SLOW_BUCKETS,
+)
+LLM_TOKENS_PER_SECOND = Histogram(
+    "llm_tokens_per_second",
+    "Generation speed of a streamed response after its first token",
+    ["provider", "request_class"],
+    buckets=(5, 10, 20, 40, 60, 80, 120, 160, 240, 320),
+)
+LLM_COMPLETION_TOKENS = Counter(
+    "llm_completion_tokens",
+    "Tokens generated",
+    ["provider", "request_class"],
+)
+LLM_PROMPT_TOKENS = Counter(
+    "llm_prompt_tokens",
+    "Prompt tokens reported by providers",
+    ["provider", "request_class"],
+)
+LLM_CACHED_PROMPT_TOKENS = Counter(
+    "llm_cached_prompt_tokens",
+    "Prompt tokens served from the provider's prompt cache",
+    ["provider", "request_class"],
+)
+LLM_ERRORS = Counter("llm_errors", "Failed LLM calls", ["provider"])
+LLM_REQUESTS_IN_FLIGHT = Gauge(
+    "llm_requests_in_flight",
+    "Open upstream LLM streams",
+    ["provider"],
+    multiprocess_mode="livesum",
+)
+SINGLEFLIGHT_IN_FLIGHT = Gauge(
+    "llm_singleflight_in_flight",
+    "Distinct upstream LLM calls shared by concurrent callers",
+    multiprocess_mode="livesum",
+)
+
+IVERILOG_COMPILE_SECONDS = Histogram(
+    "iverilog_compile_seconds",
+    "iverilog run time",
+    ["purpose"],
+    buckets=_SLOW_BUCKETS,
+)
+VVP_RUN_SECONDS = Histogram(
+    "vvp_run_seconds", "vvp simulation run time", buckets=_SLOW_BUCKETS
+)
+VCD_BYTES = Histogram(
+    "simulation_vcd_bytes",
+    "Size of the VCD files simulations write",
+    buckets=(1e3, 1e4, 1e5, 1e6, 1e7, 1e8, 1e9),
+)
+SIMULATIONS_IN_FLIGHT = Gauge(
+    "simulations_in_flight",
+    "Simulations compiling or running",
+    multiprocess_mode="livesum",
+)
+VERILATOR_LINT_SECONDS = Histogram(
+    "verilator_lint_seconds", "verilator --lint-only run time", buckets=_SLOW_BUCKETS
+)
+
+CACHE_LOOKUPS = Counter("cache_lookups", "Cache lookups", ["cache", "result"])
+CACHE_TIER_HITS = Counter(
+    "cache_tier_hits",
+    "Two-tier cache hits by the tier that had the entry",
+    ["cache", "tier"],
+)
+CACHE_EVICTIONS = Counter(
+    "cache_evictions", "Entries evicted from the in-process cache tier", ["cache"]
+)
+CACHE_MEMORY_BYTES = Gauge(
+    "cache_memory_bytes",
+    "Size of the in-process cache tier",
+    ["cache"],
+    multiprocess_mode="livesum",
+)
+
+PASSWORD_HASH_SECONDS = Histogram(
+    "password_hash_seconds",
+    "bcrypt time, including the wait for a hashing process",
+    ["operation"],
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+)
+PASSWORD_HASHES_IN_FLIGHT = Gauge(
+    "password_hashes_in_flight",
+    "Password hashes and checks queued or running",
+    multiprocess_mode="livesum",
+)
+PASSWORD_REHASHES = Counter(
+    "password_rehashes", "Password hashes upgraded to the current bcrypt cost on login"
+)
+LOGINS = Counter("logins", "Password logins", ["result"])
+
+
+def cache_lookup(cache: str, hit: bool) -> None:
+    CACHE_LOOKUPS.labels(cache, "hit" if hit else "miss").inc()
+
+
+@contextmanager
+def timed(histogram: Histogram) -> Iterator[None]:
+    """Observe the duration of the block, also when it raises."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.observe(time.perf_counter() - started)
+
+
+def route_template(scope: Scope) -> str:
+    # Newer FastAPI versions keep included routes unprefixed and record the
+    # effective (prefixed) route separately
+    effective = scope.get("fastapi", {}).get("effective_route_context")
+    route = effective or scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+
+class MetricsMiddleware:
+    """Request latency and in-flight requests per route template (pure ASGI, so streaming is unaffected)."""
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        HTTP_REQUESTS_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_REQUESTS_IN_FLIGHT.dec()
+            HTTP_REQUEST_SECONDS.labels(
+                scope["method"], route_template(scope), str(status)
+            ).observe(time.perf_counter() - started)
+
+
+def metrics_endpoint(_request: Request) -> Response:
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)  # type: ignore[no-untyped-call]
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,246 @@
+"""
+In-situ profiling of a running worker.
+
+``sample_cpu`` takes a statistical CPU profile: a sampler thread records the
+Python stack of every other thread at a fixed interval, or py-spy samples the
+process from outside (which also sees native frames, but needs py-spy
+installed and ptrace permission). Both return collapsed stacks, one
+``frame;frame;frame count`` line per distinct stack, root first, which
+flamegraph.pl, speedscope and inferno read directly.
+
+``MemoryTracker`` wraps tracemalloc: start tracing, then take snapshots;
+each snapshot is compared with the previous one, so growth between two
+calls shows up as the top size differences by source line.
+
+``memory_usage`` reads a process's RSS, PSS and USS from
+``/proc/<pid>/smaps_rollup``. Pages shared copy-on-write with the pre-fork
+master count fully in every worker's RSS but only proportionally in its PSS,
+and not at all in its USS, the memory that exiting the worker would free.
+"""
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from dataclasses import dataclass
+from pathlib import Path
+from types import FrameType
+from typing import Any
+
+
+class ProfilerBusy(RuntimeError):
+    pass
+
+
+class ProfilerUnavailable(RuntimeError):
+    pass
+
+
+# One CPU profile at a time per worker: samples of two would mix
+_cpu_lock = threading.Lock()
+
+
+def _frame_label(frame: FrameType) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({Path(code.co_filename).name}:{frame.f_lineno})"
+
+
+def _collapse(frame: FrameType | None, thread_name: str) -> str:
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    labels.append(thread_name)
+    return ";".join(reversed(labels))
+
+
+def _sample_threads(duration: float, interval: float) -> Counter[str]:
+    me = threading.get_ident()
+    stacks: Counter[str] = Counter()
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident != me:
+                stacks[_collapse(frame, names.get(ident, f"thread-{ident}"))] += 1
+        time.sleep(interval)
+    return stacks
+
+
+def _sample_py_spy(duration: float, interval: float) -> Counter[str]:
+    py_spy = shutil.which("py-spy")
+    if py_spy is None:
+        raise ProfilerUnavailable("py-spy is not installed")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        out = Path(tmpdir) / "profile.txt"
+        cp = subprocess.run(
+            [
+                py_spy,
+                "record",
+                "--pid",
+                str(os.getpid()),
+                "--duration",
+                str(max(int(duration), 1)),
+                "--rate",
+                str(max(int(1 / interval), 1)),
+                "--format",
+                "raw",
+                "--threads",
+                "--nonblocking",
+                "--output",
+                str(out),
+            ],
+            capture_output=True,
+            text=True,
+            timeout=duration + 30,
+        )
+        if cp.returncode != 0 or not out.exists():
+            raise ProfilerUnavailable(f"py-spy failed: {cp.stderr.strip()}")
+        stacks: Counter[str] = Counter()
+        for line in out.read_text().splitlines():
+            stack, _, count = line.rpartition(" ")
+            if stack and count.isdigit():
+                stacks[stack] += int(count)
+        return stacks
+
+
+def sample_cpu(
+    duration: float, interval: float = 0.005, mode: str = "thread"
+) -> Counter[str]:
+    """Collapsed stacks with sample counts over ``duration`` seconds."""
+    if not _cpu_lock.acquire(blocking=False):
+        raise ProfilerBusy("A CPU profile is already running in this worker")
+    try:
+        if mode == "py-spy":
+            return _sample_py_spy(duration, interval)
+        return _sample_threads(duration, interval)
+    finally:
+        _cpu_lock.release()
+
+
+def collapsed(stacks: Counter[str]) -> str:
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+@dataclass
+class MemoryUsage:
+    pid: int
+    rss: int
+    pss: int
+    uss: int
+
+
+def memory_usage(pid: int) -> MemoryUsage | None:
+    """RSS, PSS and USS of a process in bytes (Linux 4.14+ only)."""
+    fields = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                name, _, value = line.partition(":")
+                if value.strip().endswith("kB"):
+                    fields[name] = int(value.split()[0]) * 1024
+    except (OSError, ValueError):
+        return None
+    if "Rss" not in fields:
+        return None
+    return MemoryUsage(
+        pid,
+        rss=fields["Rss"],
+        pss=fields.get("Pss", 0),
+        uss=fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0),
+    )
+
+
+def child_pids(pid: int) -> list[int]:
+    """Direct children of a process, e.g. the workers of a server master."""
+    children = []
+    for entry in Path("/proc").iterdir():
+        if not entry.name.isdigit():
+            continue
+        try:
+            stat = (entry / "stat").read_text()
+        except OSError:
+            continue
+        # The command name in parentheses may contain spaces
+        if int(stat.rpartition(")")[2].split()[1]) == pid:
+            children.append(int(entry.name))
+    return sorted(children)
+
+
+def rss_bytes() -> int | None:
+    """Resident set size of this process (Linux only)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+@dataclass
+class AllocationStat:
+    location: str
+    size: int
+    size_diff: int
+    count: int
+    count_diff: int
+
+
+class MemoryTracker:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._previous: tracemalloc.Snapshot | None = None
+
+    def start(self, frames: int = 1) -> None:
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(frames)
+            self._previous = None
+
+    def stop(self) -> None:
+        with self._lock:
+            tracemalloc.stop()
+            self._previous = None
+
+    def snapshot(self, limit: int = 25) -> dict[str, Any]:
+        """
+        Top allocation sites, ordered by growth since the previous snapshot
+        (by size on the first one). Tracing must have been started.
+        """
+        if not tracemalloc.is_tracing():
+            raise ProfilerUnavailable("tracemalloc is not tracing; start it first")
+        snapshot = tracemalloc.take_snapshot().filter_traces(
+            [
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            ]
+        )
+        with self._lock:
+            previous, self._previous = self._previous, snapshot
+        if previous is None:
+            stats = [
+                AllocationStat(str(s.traceback), s.size, s.size, s.count, s.count)
+                for s in snapshot.statistics("lineno")[:limit]
+            ]
+        else:
+            stats = [
+                AllocationStat(
+                    str(s.traceback), s.size, s.size_diff, s.count, s.count_diff
+                )
+                for s in snapshot.compare_to(previous, "lineno")[:limit]
+            ]
+        current, peak = tracemalloc.get_traced_memory()
+        return {
+            "compared_to_previous": previous is not None,
+            "traced_bytes": current,
+            "traced_peak_bytes": peak,
+            "rss_bytes": rss_bytes(),
+            "top": stats,
+        }
+
+
+memory_tracker = MemoryTracker()
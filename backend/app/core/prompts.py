@@ -0,0 +1,301 @@
+"""
+Prompt assembly.
+
+Providers cache prompt prefixes (OpenAI does so automatically for prompts over
+1024 tokens), but only for byte-identical prefixes. So every prompt here
+starts with a static system prompt defined once at import time, followed by
+content that rarely changes (chat history), with the per-request content
+(code, editor state) last. Never format variable content into the system
+prompts.
+
+``prompt_cache`` collects the cached prompt token counts that providers
+report, to check that the layout actually hits the cache.
+"""
+
+import threading
+from string import Template
+from typing import Any
+
+from app.core import metrics
+
+COMPLETION_SYSTEM_PROMPT = """You are a Verilog code completion assistant. Complete the code naturally and concisely.
+Only return the completion code, no explanations or markdown.
+Focus on syntactically correct Verilog that fits the context.
+Always close blocks properly (endmodule, endfunction, endtask, end)."""
+
+CHAT_SYSTEM_PROMPT = "You are an expert Verilog hardware engineering assistant. You help users write, debug, and simulate Verilog code.\n"
+
+AGENTIC_SYSTEM_PROMPT = """You are an expert Verilog code editor assistant. When the user requests code changes, you should:
+
+1. Provide a brief description of what you're changing and why (2-4 sentences)
+2. Then provide the complete modified code in a verilog code block
+
+FORMATTING GUIDELINES:
+- Use markdown formatting for emphasis (bold, italic, bullet points, etc.)
+- Keep the description concise and focused on WHAT changed and WHY
+- Use bullet points (•) to list multiple changes clearly
+- Then provide the full modified code in a ```verilog code block
+
+Example response format:
+"I've added an **active-low reset signal** to your module. The reset will asynchronously clear the output when asserted low.
+
+Key changes:
+• Added `rst_n` input port
+• Modified assign statement with ternary operator
+• Output clears to 0 on reset
+
+```verilog
+[full code here]
+```"
+
+Keep descriptions clear and professional. Use markdown to highlight important terms.
+"""
+
+SUMMARY_SYSTEM_PROMPT = """Summarize the following conversation between a user and a Verilog assistant so it can continue without the full transcript.
+Keep requirements, decisions, module, port and signal names, errors that came up and open questions.
+Leave out code unless a short snippet is essential. Be concise."""
+
+TESTBENCH_SYSTEM_PROMPT = """You are VerilogAI-TB, an expert hardware verification assistant.
+
+## Your Task:
+Generate a simple, high-quality Verilog testbench for the provided module.
+
+## Requirements:
+1. **Module instantiation**: Correctly instantiate the DUT with all ports
+2. **Clock generator**: If clock port detected (clk, clock), generate a clock signal (#5 toggle)
+3. **Reset generator**: If reset detected (rst, reset, rst_n, reset_n), generate proper reset sequence
+4. **VCD dumping**: MUST include these exact lines in initial block:
+   ```
+   $dumpfile("test.vcd");
+   $dumpvars(0, tb);
+   ```
+5. **Test naming**: Module must be named `tb` or `<module_name>_tb`
+6. **Stimulus**: Generate simple smoke test with basic input patterns
+7. **Finish**: End simulation with `$finish;` after reasonable delay
+8. **Display**: Use `$display()` to show test progress
+
+## Code Format:
+- Return ONLY pure Verilog code
+- NO markdown formatting, NO triple backticks, NO comments outside code
+- Start directly with `module tb;` or similar
+- Keep it simple but complete
+
+## Example Structure:
+```
+module <name>_tb;
+  // Signal declarations
+  reg clk, rst;
+  reg [7:0] input_signal;
+  wire [7:0] output_signal;
+
+  // Clock generator (if needed)
+  initial begin
+    clk = 0;
+    forever #5 clk = ~clk;
+  end
+
+  // DUT instantiation
+  <module_name> dut (
+    .clk(clk),
+    .rst(rst),
+    .input_signal(input_signal),
+    .output_signal(output_signal)
+  );
+
+  // Test stimulus
+  initial begin
+    $dumpfile("test.vcd");
+    $dumpvars(0, tb);
+
+    // Reset sequence
+    rst = 1;
+    #20;
+    rst = 0;
+
+    // Test cases
+    input_signal = 8'd10;
+    #10;
+    $display("Test 1: input=%d, output=%d", input_signal, output_signal);
+
+    input_signal = 8'd20;
+    #10;
+    $display("Test 2: input=%d, output=%d", input_signal, output_signal);
+
+    #50;
+    $finish;
+  end
+endmodule
+```
+
+Now generate a testbench for this module:
+"""
+
+TESTBENCH_STIMULUS_SYSTEM_PROMPT = """You are VerilogAI-TB, an expert hardware verification assistant.
+
+You are given a Verilog module and a testbench skeleton for it. The skeleton already declares every
+signal, instantiates the DUT, generates the clock, applies the reset, dumps waveforms and calls
+$finish. Write ONLY the stimulus statements that replace the `// STIMULUS` line.
+
+## Requirements:
+- Statements only: no module, no declarations, no DUT instance, no $dumpfile/$dumpvars/$finish
+- Only drive the input signals declared in the skeleton; the reset has already been released
+- Use delays (#10) or clock edges (@(posedge clk)) between input changes
+- Use `$display()` to show inputs and outputs after each test case
+- Cover a basic smoke test plus a few corner values
+- Return pure Verilog, NO markdown formatting, NO triple backticks
+"""
+
+# Variable parts, compiled once. Template (not str.format) so that braces in
+# Verilog code need no escaping.
+_COMPLETION_USER = Template("Complete this Verilog code:\n\n$prefix")
+_COMPLETION_FIM_USER = Template(
+    "Complete the Verilog code at <CURSOR>. Only return the code to insert.\n\n"
+    "$prefix<CURSOR>$suffix"
+)
+_TESTBENCH_USER = Template("Generate testbench for:\n\n$code")
+_STIMULUS_USER = Template("Module:\n\n$code\n\nTestbench skeleton:\n\n$skeleton")
+_REPAIR_USER = Template(
+    "The resulting testbench:\n\n$testbench\n\nfailed to compile with iverilog:\n\n$errors\n\n"
+    "Fix the errors and return the corrected $part only, in the same format as before."
+)
+_EDITOR_FILE = Template("Context:\nFile: $file_path\n")
+_EDITOR_CURSOR = Template("Cursor Line: $line\n")
+_EDITOR_DOCUMENT = Template("\nCurrent Code Content:\n```verilog\n$code\n```\n")
+_EDITOR_SELECTION = Template("\nSelected Code:\n```verilog\n$code\n```\n")
+
+
+def completion_messages(prefix: str, suffix: str) -> list[dict[str, str]]:
+    if suffix.strip():
+        user = _COMPLETION_FIM_USER.substitute(prefix=prefix, suffix=suffix)
+    else:
+        user = _COMPLETION_USER.substitute(prefix=prefix)
+    return [
+        {"role": "system", "content": COMPLETION_SYSTEM_PROMPT},
+        {"role": "user", "content": user},
+    ]
+
+
+def testbench_messages(code: str) -> list[dict[str, str]]:
+    return [
+        {"role": "system", "content": TESTBENCH_SYSTEM_PROMPT},
+        {"role": "user", "content": _TESTBENCH_USER.substitute(code=code)},
+    ]
+
+
+def stimulus_messages(code: str, skeleton: str) -> list[dict[str, str]]:
+    return [
+        {"role": "system", "content": TESTBENCH_STIMULUS_SYSTEM_PROMPT},
+        {
+            "role": "user",
+            "content": _STIMULUS_USER.substitute(code=code, skeleton=skeleton),
+        },
+    ]
+
+
+def repair_messages(
+    messages: list[dict[str, str]],
+    output: str,
+    testbench: str,
+    errors: str,
+    stimulus_only: bool,
+) -> list[dict[str, str]]:
+    """Follow-up turn asking the model to fix a testbench that did not compile."""
+    part = "stimulus statements" if stimulus_only else "testbench"
+    return [
+        *messages,
+        {"role": "assistant", "content": output},
+        {
+            "role": "user",
+            "content": _REPAIR_USER.substitute(
+                testbench=testbench, errors=errors, part=part
+            ),
+        },
+    ]
+
+
+def summary_messages(messages: list[dict[str, str]]) -> list[dict[str, str]]:
+    transcript = "\n\n".join(f"{m['role']}: {m['content']}" for m in messages)
+    return [
+        {"role": "system", "content": SUMMARY_SYSTEM_PROMPT},
+        {"role": "user", "content": transcript},
+    ]
+
+
+def editor_context(
+    file_path: str | None = None,
+    cursor_line: int | None = None,
+    document: str | None = None,
+    selection: str | None = None,
+) -> str:
+    content = _EDITOR_FILE.substitute(file_path=file_path or "Unknown")
+    if cursor_line is not None:
+        content += _EDITOR_CURSOR.substitute(line=cursor_line)
+    if document is not None:
+        content += _EDITOR_DOCUMENT.substitute(code=document)
+    if selection:
+        content += _EDITOR_SELECTION.substitute(code=selection)
+    return content
+
+
+def chat_messages(
+    agentic: bool,
+    history: list[dict[str, str]],
+    new_messages: list[dict[str, str]],
+    context: str | None = None,
+) -> list[dict[str, str]]:
+    """
+    System prompt, then the history (which only grows between turns), then
+    this turn's editor context and the new messages.
+    """
+    messages = [
+        {
+            "role": "system",
+            "content": AGENTIC_SYSTEM_PROMPT if agentic else CHAT_SYSTEM_PROMPT,
+        },
+        *history,
+    ]
+    if context is not None:
+        messages.append({"role": "system", "content": context})
+    messages.extend(new_messages)
+    return messages
+
+
+class PromptCacheStats:
+    """Prompt and cached prompt tokens reported by providers, per provider and request class."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._totals: dict[str, dict[str, int]] = {}
+
+    def record(
+        self, provider: str, request_class: str, prompt_tokens: int, cached_tokens: int
+    ) -> None:
+        with self._lock:
+            totals = self._totals.setdefault(
+                f"{provider}:{request_class}",
+                {"requests": 0, "prompt_tokens": 0, "cached_tokens": 0},
+            )
+            totals["requests"] += 1
+            totals["prompt_tokens"] += prompt_tokens
+            totals["cached_tokens"] += cached_tokens
+        metrics.LLM_PROMPT_TOKENS.labels(provider, request_class).inc(prompt_tokens)
+        metrics.LLM_CACHED_PROMPT_TOKENS.labels(provider, request_class).inc(
+            cached_tokens
+        )
+
+    def snapshot(self) -> dict[str, dict[str, Any]]:
+        with self._lock:
+            return {
+                key: {
+                    **totals,
+                    "hit_ratio": (
+                        totals["cached_tokens"] / totals["prompt_tokens"]
+                        if totals["prompt_tokens"]
+                        else 0.0
+                    ),
+                }
+                for key, totals in self._totals.items()
+            }
+
+
+prompt_cache = PromptCacheStats()
@@ -0,0 +1,169 @@
+"""
+Token-bucket rate limiting for the LLM routes.
+
+Every caller gets two buckets: requests per minute and (estimated) LLM tokens
+per minute. Authenticated callers are keyed by user id, anonymous callers by
+client IP, each with their own budgets. Bucket state lives in process by
+default; set ``RATE_LIMIT_REDIS_URL`` to share it between workers and boxes
+(requires the ``redis`` extra).
+"""
+
+import math
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Protocol
+
+from fastapi import HTTPException, Request
+
+from app.core.config import settings
+
+# Refill tokens for the time elapsed since the last update, then take `cost`
+# if available. Returns the seconds until `cost` would be available (0 on
+# success). A negative cost refunds tokens.
+_REDIS_TAKE = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local now = tonumber(ARGV[4])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(now - ts, 0) * rate)
+local retry = 0
+if tokens >= cost then
+  tokens = math.min(capacity, tokens - cost)
+else
+  retry = (cost - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return tostring(retry)
+"""
+
+
+class RateLimitBackend(Protocol):
+    def take(self, key: str, cost: float, capacity: float, rate: float) -> float:
+        """Take ``cost`` tokens; return 0 on success or seconds until possible."""
+        ...
+
+
+class InMemoryBackend:
+    def __init__(self, max_keys: int = 100_000) -> None:
+        self._lock = threading.Lock()
+        self._max_keys = max_keys
+        # key -> (tokens, last refill timestamp)
+        self._buckets: OrderedDict[str, tuple[float, float]] = OrderedDict()
+
+    def take(self, key: str, cost: float, capacity: float, rate: float) -> float:
+        now = time.monotonic()
+        with self._lock:
+            tokens, ts = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - ts) * rate)
+            retry = 0.0
+            if tokens >= cost:
+                tokens = min(capacity, tokens - cost)
+            else:
+                retry = (cost - tokens) / rate
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self._max_keys:
+                self._buckets.popitem(last=False)
+        return retry
+
+
+class RedisBackend:
+    def __init__(self, url: str) -> None:
+        import redis
+
+        self._client = redis.Redis.from_url(url)
+        self._take = self._client.register_script(_REDIS_TAKE)
+
+    def take(self, key: str, cost: float, capacity: float, rate: float) -> float:
+        retry = self._take(
+            keys=[f"ratelimit:{key}"], args=[capacity, rate, cost, time.time()]
+        )
+        return float(retry)
+
+
+class RateLimiter:
+    def __init__(self, backend: RateLimitBackend) -> None:
+        self.backend = backend
+
+    def _take(self, key: str, cost: float, per_minute: int) -> float:
+        capacity = float(per_minute)
+        # A single request larger than the whole budget drains the bucket
+        # instead of being rejected forever
+        return self.backend.take(key, min(cost, capacity), capacity, capacity / 60)
+
+    def check_request(self, identity: str, rpm: int) -> None:
+        retry = self._take(f"{identity}:rpm", 1, rpm)
+        if retry > 0:
+            raise_rate_limited(retry, "Too many requests")
+
+    def take_tokens(self, identity: str, tokens: int, tpm: int) -> int:
+        """Take ``tokens`` from the budget; returns how many were actually taken."""
+        retry = self._take(f"{identity}:tpm", tokens, tpm)
+        if retry > 0:
+            raise_rate_limited(retry, "LLM token budget exhausted")
+        return min(tokens, tpm)
+
+    def refund_tokens(self, identity: str, tokens: int, tpm: int) -> None:
+        if tokens > 0:
+            self._take(f"{identity}:tpm", -tokens, tpm)
+
+
+def raise_rate_limited(retry_after: float, detail: str) -> None:
+    raise HTTPException(
+        status_code=429,
+        detail=f"{detail}, retry in {math.ceil(retry_after)}s",
+        headers={"Retry-After": str(math.ceil(retry_after))},
+    )
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap upfront estimate (about four characters per token)."""
+    return len(text) // 4 + 1
+
+
+def client_ip(request: Request) -> str:
+    if settings.RATE_LIMIT_TRUST_PROXY_HEADERS:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return request.client.host if request.client else "unknown"
+
+
+class LLMBudget:
+    """
+    Per-request handle on the caller's token budget. Routes charge the
+    prompt plus the maximum completion up front and refund what the model
+    did not use.
+    """
+
+    def __init__(self, limiter: RateLimiter, identity: str, tpm: int) -> None:
+        self.limiter = limiter
+        self.identity = identity
+        self.tpm = tpm
+        self.charged = 0
+
+    def charge(self, prompt: str, max_tokens: int) -> None:
+        tokens = estimate_tokens(prompt) + max_tokens
+        self.charged += self.limiter.take_tokens(self.identity, tokens, self.tpm)
+
+    def settle(self, prompt: str, completion: Any) -> None:
+        """Refund what was charged beyond the tokens actually used (never more)."""
+        used = estimate_tokens(prompt) + estimate_tokens(str(completion))
+        refund = self.charged - used
+        if refund > 0:
+            self.limiter.refund_tokens(self.identity, refund, self.tpm)
+            self.charged = used
+
+
+def _backend() -> RateLimitBackend:
+    if settings.RATE_LIMIT_REDIS_URL:
+        return RedisBackend(settings.RATE_LIMIT_REDIS_URL)
+    return InMemoryBackend()
+
+
+limiter = RateLimiter(_backend())
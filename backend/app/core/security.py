@@ -1,27 +1,107 @@
+import multiprocessing
+import os
+import threading
+from collections.abc import Callable
+from concurrent.futures import Executor, ProcessPoolExecutor
 from datetime import datetime, timedelta, timezone
-from typing import Any
+from functools import lru_cache
+from typing import Any, TypeVar
 
 import jwt
 from passlib.context import CryptContext
 
+from app.core import metrics
 from app.core.config import settings
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+T = TypeVar("T")
 
 
 ALGORITHM = "HS256"
 
 
-def create_access_token(subject: str | Any, expires_delta: timedelta) -> str:
+@lru_cache
+def crypt_context(rounds: int) -> CryptContext:
+    return CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=rounds)
+
+
+def _hash(password: str, rounds: int) -> str:
+    return crypt_context(rounds).hash(password)
+
+
+def _verify_and_update(
+    password: str, hashed: str, rounds: int
+) -> tuple[bool, str | None]:
+    valid, new_hash = crypt_context(rounds).verify_and_update(password, hashed)
+    return bool(valid), new_hash
+
+
+# bcrypt runs in a few dedicated processes (PASSWORD_HASH_WORKERS), so a
+# burst of logins queues there instead of taking every CPU from the workers
+_pool: Executor | None = None
+_pool_lock = threading.Lock()
+
+
+def _hash_pool() -> Executor | None:
+    global _pool
+    if settings.PASSWORD_HASH_WORKERS <= 0:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            # spawn: forking a worker that already runs threads is unsafe
+            _pool = ProcessPoolExecutor(
+                settings.PASSWORD_HASH_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _pool
+
+
+def _forget_pool() -> None:
+    # A forked worker must start its own pool, not use the master's
+    global _pool
+    _pool = None
+
+
+os.register_at_fork(after_in_child=_forget_pool)
+
+
+def _run(operation: str, fn: Callable[..., T], *args: Any) -> T:
+    pool = _hash_pool()
+    metrics.PASSWORD_HASHES_IN_FLIGHT.inc()
+    try:
+        with metrics.timed(metrics.PASSWORD_HASH_SECONDS.labels(operation)):
+            return fn(*args) if pool is None else pool.submit(fn, *args).result()
+    finally:
+        metrics.PASSWORD_HASHES_IN_FLIGHT.dec()
+
+
+def create_access_token(
+    subject: str | Any, expires_delta: timedelta, claims: dict[str, Any] | None = None
+) -> str:
     expire = datetime.now(timezone.utc) + expires_delta
-    to_encode = {"exp": expire, "sub": str(subject)}
+    to_encode = {**(claims or {}), "exp": expire, "sub": str(subject)}
     encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
 
+def verify_password_and_update(
+    plain_password: str, hashed_password: str
+) -> tuple[bool, str | None]:
+    """
+    Check a password and, when its hash was made with a different cost than
+    BCRYPT_ROUNDS, also return a new hash to store (None otherwise).
+    """
+    return _run(
+        "verify",
+        _verify_and_update,
+        plain_password,
+        hashed_password,
+        settings.BCRYPT_ROUNDS,
+    )
+
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+    return verify_password_and_update(plain_password, hashed_password)[0]
 
 
 def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
+    return _run("hash", _hash, password, settings.BCRYPT_ROUNDS)
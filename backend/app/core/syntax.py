@@ -0,0 +1,198 @@
+"""
+Fast in-process sanity checks for Verilog snippets.
+
+These are not a parser. They tokenize the code (skipping comments and
+strings), track the nesting of block keywords and brackets, and count the
+kinds of mistakes completion models make: unbalanced or mismatched blocks,
+stray closers, unterminated strings, prose or markdown instead of code.
+That is enough to rank completion candidates in microseconds; results are
+memoized because the same candidate text comes back often.
+"""
+
+import re
+from collections import Counter
+from dataclasses import dataclass, field
+from functools import lru_cache
+
+# Opening keyword -> closing keyword
+BLOCKS = {
+    "begin": "end",
+    "case": "endcase",
+    "casex": "endcase",
+    "casez": "endcase",
+    "module": "endmodule",
+    "function": "endfunction",
+    "task": "endtask",
+    "fork": "join",
+    "generate": "endgenerate",
+    "specify": "endspecify",
+}
+CLOSERS = {
+    "end",
+    "endcase",
+    "endmodule",
+    "endfunction",
+    "endtask",
+    "join",
+    "join_any",
+    "join_none",
+    "endgenerate",
+    "endspecify",
+}
+BRACKETS = {"(": ")", "[": "]", "{": "}"}
+
+_TOKEN = re.compile(
+    r'//[^\n]*|/\*.*?(?:\*/|$)|"(?:\\.|[^"\\\n])*"?|`?\w+|[()\[\]{};]',
+    re.DOTALL,
+)
+_PROSE = re.compile(
+    r"^\s*(?:here(?:'s| is)|this (?:code|completion)|note:|explanation)",
+    re.IGNORECASE | re.MULTILINE,
+)
+
+
+@dataclass
+class Scan:
+    # Unclosed block keywords and brackets, innermost last
+    open: list[str] = field(default_factory=list)
+    # Closers without a matching opener (a completion may close what the
+    # prefix opened, so these are only problems in a whole document)
+    stray: list[str] = field(default_factory=list)
+    # Openers implicitly closed by the closer of an outer block, outermost first
+    unclosed: list[str] = field(default_factory=list)
+    mismatched: int = 0
+    unterminated_strings: int = 0
+
+
+def _closes(opener: str, closer: str) -> bool:
+    if opener in BRACKETS:
+        return BRACKETS[opener] == closer
+    expected = BLOCKS[opener]
+    return closer == expected or (expected == "join" and closer.startswith("join"))
+
+
+def scan(code: str, state: Scan | None = None) -> Scan:
+    """Track nesting through ``code``, continuing from ``state`` if given."""
+    result = Scan(open=list(state.open) if state else [])
+    previous = ""
+    for m in _TOKEN.finditer(code):
+        token = m.group()
+        if token.startswith(("//", "/*")):
+            continue
+        if token.startswith('"'):
+            if len(token) < 2 or not token.endswith('"') or token.endswith('\\"'):
+                result.unterminated_strings += 1
+            continue
+        # "wait fork" / "disable fork" are statements, not blocks
+        if token in BLOCKS and not (
+            token == "fork" and previous in {"wait", "disable"}
+        ):
+            result.open.append(token)
+        elif token in BRACKETS:
+            result.open.append(token)
+        elif token in CLOSERS or token in BRACKETS.values():
+            if result.open and _closes(result.open[-1], token):
+                result.open.pop()
+            elif any(_closes(o, token) for o in result.open):
+                # Closes an outer block, so the inner ones were never closed
+                result.mismatched += 1
+                skipped: list[str] = []
+                while not _closes(result.open[-1], token):
+                    skipped.insert(0, result.open.pop())
+                result.open.pop()
+                result.unclosed.extend(skipped)
+            else:
+                result.stray.append(token)
+        previous = token
+    return result
+
+
+def closing_for(opener: str) -> str:
+    return BRACKETS.get(opener) or BLOCKS[opener]
+
+
+def missing_closers(prefix: str, completion: str, suffix: str = "") -> list[str]:
+    """
+    Block closers to append to ``completion``, innermost first. Without code
+    after the cursor everything still open is closed; otherwise only blocks
+    the suffix leaves open because of the completion.
+    """
+    before = scan(prefix)
+    after = scan(completion, before)
+    if not suffix.strip():
+        return [closing_for(o) for o in reversed(after.open) if o not in BRACKETS]
+    remaining = scan(suffix, after)
+    baseline = scan(suffix, before)
+    missing = Counter(remaining.open + remaining.unclosed) - Counter(
+        baseline.open + baseline.unclosed
+    )
+    closers = []
+    for opener in reversed(after.open):
+        if opener not in BRACKETS and missing[opener] > 0:
+            missing[opener] -= 1
+            closers.append(closing_for(opener))
+    return closers
+
+
+@dataclass(frozen=True)
+class Score:
+    issues: int
+    details: tuple[str, ...] = ()
+
+
+@lru_cache(maxsize=4096)
+def check_completion(prefix: str, completion: str, suffix: str = "") -> Score:
+    """
+    Problems a completion introduces at the end of ``prefix``. Blocks it
+    leaves open are fine as long as ``suffix`` closes them.
+    """
+    details = []
+    if not completion.strip():
+        return Score(1, ("empty",))
+    if "```" in completion or _PROSE.search(completion):
+        details.append("prose or markdown")
+
+    before = scan(prefix)
+    after = scan(completion, before)
+    if after.mismatched:
+        details.append(f"{after.mismatched} mismatched block(s)")
+    if after.unterminated_strings:
+        details.append("unterminated string")
+    if after.stray:
+        details.append(f"stray {', '.join(after.stray)}")
+
+    # What is still open must be closed by the code after the cursor
+    remaining = scan(suffix, after)
+    unclosed = [o for o in remaining.open[len(before.open) :] if o not in BRACKETS]
+    if unclosed:
+        details.append(f"unclosed {', '.join(unclosed)}")
+    elif remaining.mismatched:
+        # The suffix closes an outer block over one the completion opened
+        details.append("unclosed block")
+    brackets = [o for o in after.open[len(before.open) :] if o in BRACKETS]
+    if brackets and not suffix.strip():
+        details.append("unbalanced brackets")
+    return Score(len(details), tuple(details))
+
+
+def rank_completions(prefix: str, candidates: list[str], suffix: str = "") -> list[str]:
+    """
+    Distinct candidates, best first: fewest issues, then the most votes
+    (identical candidates), then the original order.
+    """
+    # stripped text -> (candidate, first index, votes)
+    distinct: dict[str, tuple[str, int, int]] = {}
+    for i, candidate in enumerate(candidates):
+        key = candidate.strip()
+        if not key:
+            continue
+        if key in distinct:
+            text, first, votes = distinct[key]
+            distinct[key] = (text, first, votes + 1)
+        else:
+            distinct[key] = (candidate, i, 1)
+    ranked = sorted(
+        distinct.values(),
+        key=lambda e: (check_completion(prefix, e[0], suffix).issues, -e[2], e[1]),
+    )
+    return [text for text, _, _ in ranked]
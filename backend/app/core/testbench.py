@@ -0,0 +1,178 @@
+"""
+Deterministic testbench skeletons.
+
+Most of a testbench follows from the DUT's port list: signal declarations,
+the DUT instantiation, a clock generator, the reset sequence, waveform
+dumping and ``$finish``. ``build_skeleton`` writes all of that from the
+parsed module in well under a millisecond, so the LLM only has to write the
+stimulus that goes at ``STIMULUS_MARKER``.
+"""
+
+import re
+from dataclasses import dataclass
+
+from app.core import verilog
+
+STIMULUS_MARKER = "// STIMULUS"
+INDENT = "    "
+# rst_n, rst_ni, resetn, nrst, n_reset; not reset_in or rst_sync_en
+_ACTIVE_LOW_RESET = re.compile(r"(?:_n|_ni|rstn|resetn)$|^n_?(?:rst|reset)")
+
+
+@dataclass
+class Skeleton:
+    module: verilog.Module
+    tb_name: str
+    text: str
+    clock: str | None
+    reset: str | None
+
+    @property
+    def head(self) -> str:
+        """Everything before the stimulus."""
+        return self.text[: self.text.index(STIMULUS_MARKER)]
+
+    @property
+    def tail(self) -> str:
+        """Everything after the stimulus."""
+        return self.text[self.text.index(STIMULUS_MARKER) + len(STIMULUS_MARKER) :]
+
+    def fill(self, stimulus: str) -> str:
+        return self.head + indent_stimulus(stimulus.strip()) + self.tail
+
+
+def is_clock(port: verilog.Port) -> bool:
+    name = port.name.lower()
+    return (
+        port.direction == "input"
+        and not port.width
+        and (
+            name in {"clk", "clock"} or name.startswith("clk_") or name.endswith("_clk")
+        )
+    )
+
+
+def is_reset(port: verilog.Port) -> bool:
+    name = port.name.lower()
+    return (
+        port.direction == "input"
+        and not port.width
+        and ("rst" in name or "reset" in name)
+    )
+
+
+def reset_active_low(name: str) -> bool:
+    return _ACTIVE_LOW_RESET.search(name.lower()) is not None
+
+
+def top_module(modules: list[verilog.Module], code: str) -> verilog.Module | None:
+    """The module no other module instantiates (the last such one if several)."""
+    stripped = verilog.strip_comments(code)
+    bodies = {m.name: stripped[m.header.end : m.span.end] for m in modules}
+    candidates = [
+        m
+        for m in modules
+        if not any(
+            name != m.name and re.search(rf"\b{m.name}\b", body)
+            for name, body in bodies.items()
+        )
+    ]
+    if candidates:
+        return candidates[-1]
+    return modules[-1] if modules else None
+
+
+def indent_stimulus(text: str) -> str:
+    return "".join(
+        INDENT + line if line.strip() else line for line in text.splitlines(True)
+    )
+
+
+class StimulusIndenter:
+    """Incremental ``indent_stimulus`` for streamed text."""
+
+    def __init__(self) -> None:
+        self._line_start = True
+
+    def feed(self, chunk: str) -> str:
+        out = []
+        for piece in chunk.splitlines(True):
+            # A chunk may end in the leading whitespace of a line
+            if self._line_start and (piece.strip() or not piece.endswith("\n")):
+                out.append(INDENT)
+            out.append(piece)
+            self._line_start = piece.endswith("\n")
+        return "".join(out)
+
+
+def build_skeleton(code: str) -> Skeleton | None:
+    """Skeleton for the top module in ``code``, or None if it has no ports."""
+    module = top_module(verilog.parse_modules(code), code)
+    if module is None or not module.ports:
+        return None
+
+    tb_name = f"{module.name}_tb"
+    clock = next((p.name for p in module.ports if is_clock(p)), None)
+    reset = next((p.name for p in module.ports if is_reset(p)), None)
+
+    lines = [f"module {tb_name};"]
+    if module.parameters:
+        lines += [f"  localparam {p.name} = {p.value};" for p in module.parameters]
+        lines.append("")
+    for port in module.ports:
+        kind = "reg" if port.direction == "input" else "wire"
+        width = f" {port.width}" if port.width else ""
+        lines.append(f"  {kind}{width} {port.name};")
+    lines.append("")
+
+    overrides = ""
+    if module.parameters:
+        overrides = (
+            " #(" + ", ".join(f".{p.name}({p.name})" for p in module.parameters) + ")"
+        )
+    lines.append(f"  {module.name}{overrides} dut (")
+    connections = [f"    .{p.name}({p.name})" for p in module.ports]
+    lines.append(",\n".join(connections))
+    lines += ["  );", ""]
+
+    if clock:
+        lines += [
+            "  initial begin",
+            f"    {clock} = 0;",
+            f"    forever #5 {clock} = ~{clock};",
+            "  end",
+            "",
+        ]
+
+    lines += [
+        "  initial begin",
+        '    $dumpfile("test.vcd");',
+        f"    $dumpvars(0, {tb_name});",
+        "",
+    ]
+    for port in module.ports:
+        if port.direction == "input" and port.name not in (clock, reset):
+            lines.append(f"    {port.name} = 0;")
+    if reset:
+        active, inactive = ("0", "1") if reset_active_low(reset) else ("1", "0")
+        wait = f"repeat (2) @(posedge {clock});" if clock else "#20;"
+        lines += [
+            f"    {reset} = {active};",
+            f"    {wait}",
+            f"    {reset} = {inactive};",
+        ]
+    else:
+        lines.append("    #10;")
+    lines += [
+        "",
+        STIMULUS_MARKER,
+        "",
+        "    #50;",
+        "    $finish;",
+        "  end",
+        "endmodule",
+        "",
+    ]
+    return Skeleton(
+        module=module, tb_name=tb_name, text="\n".join(lines), clock=clock, reset=reset
+    )
@@ -0,0 +1,209 @@
+"""
+OpenTelemetry tracing.
+
+Optional: needs the ``tracing`` extra (the OpenTelemetry SDK and OTLP/HTTP
+exporter) and ``OTEL_EXPORTER_OTLP_ENDPOINT`` pointing at a collector. Until
+``configure_tracing`` runs every helper here is a no-op, so instrumented code
+calls them unconditionally.
+
+Spans cover each request (``TracingMiddleware``), the stages of a simulation
+or lint run and every upstream LLM stream, with the W3C ``traceparent``
+header injected into the provider HTTP calls. Streams get a span that is only
+made current while the stream is being advanced, never across a ``yield``:
+Starlette advances a streaming body from different threads, where a context
+attached in one step cannot be detached in the next.
+"""
+
+import contextvars
+import logging
+from collections.abc import Callable, Generator, Iterable, Iterator
+from contextlib import contextmanager
+from typing import Any, TypeVar
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.core.config import settings
+from app.core.metrics import route_template
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+_provider: Any = None
+_tracer: Any = None
+
+
+def configure_tracing(exporter: Any = None) -> bool:
+    """
+    Start exporting spans, by default in batches over OTLP/HTTP to the
+    configured collector; an explicit ``exporter`` (e.g. an in-memory one in
+    tests) gets every span as soon as it ends. Returns False if the SDK is
+    not installed.
+    """
+    global _provider, _tracer
+    try:
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import SpanProcessor, TracerProvider
+        from opentelemetry.sdk.trace.export import (
+            BatchSpanProcessor,
+            SimpleSpanProcessor,
+        )
+        from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+    except ImportError:
+        logger.warning(
+            "OpenTelemetry SDK is not installed (tracing extra); tracing is disabled"
+        )
+        return False
+
+    processor: SpanProcessor
+    if exporter is None:
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import (
+            OTLPSpanExporter,
+        )
+
+        endpoint = (settings.OTEL_EXPORTER_OTLP_ENDPOINT or "").rstrip("/")
+        processor = BatchSpanProcessor(
+            OTLPSpanExporter(endpoint=f"{endpoint}/v1/traces")
+        )
+    else:
+        processor = SimpleSpanProcessor(exporter)
+
+    _provider = TracerProvider(
+        resource=Resource.create({"service.name": settings.OTEL_SERVICE_NAME}),
+        sampler=ParentBased(TraceIdRatioBased(settings.OTEL_TRACES_SAMPLE_RATIO)),
+    )
+    _provider.add_span_processor(processor)
+    _tracer = _provider.get_tracer("app")
+    return True
+
+
+def shutdown_tracing() -> None:
+    """Flush pending spans."""
+    global _provider, _tracer
+    if _provider is not None:
+        _provider.shutdown()
+    _provider = _tracer = None
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Any]:
+    """A child span of the current span around the block (None if tracing is off)."""
+    if _tracer is None:
+        yield None
+        return
+    with _tracer.start_as_current_span(name, attributes=attributes) as current:
+        yield current
+
+
+def event(name: str, **attributes: Any) -> None:
+    """Add an event to the current span."""
+    if _tracer is None:
+        return
+    from opentelemetry import trace
+
+    trace.get_current_span().add_event(name, attributes=attributes)
+
+
+def inject(headers: dict[str, str]) -> dict[str, str]:
+    """Add the trace context headers (``traceparent``) to outgoing HTTP headers."""
+    if _tracer is not None:
+        from opentelemetry import propagate
+
+        propagate.inject(headers)
+    return headers
+
+
+def traced_stream(
+    name: str, start: Callable[[], Iterable[T]], **attributes: Any
+) -> Generator[T, None, None]:
+    """
+    Iterate ``start()`` inside a span that ends with the stream. The first
+    item is recorded as a ``first_item`` event and the item count as the
+    ``stream.items`` attribute.
+    """
+    if _tracer is None:
+        yield from start()
+        return
+    from opentelemetry import context, trace
+    from opentelemetry.trace import Status, StatusCode
+
+    current = _tracer.start_span(name, attributes=attributes)
+    ctx = trace.set_span_in_context(current)
+    iterator = None
+    items = 0
+    try:
+        while True:
+            token = context.attach(ctx)
+            try:
+                if iterator is None:
+                    iterator = iter(start())
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                context.detach(token)
+            if items == 0:
+                current.add_event("first_item")
+            items += 1
+            yield item
+    except BaseException as e:
+        if not isinstance(e, GeneratorExit):
+            current.record_exception(e)
+            current.set_status(Status(StatusCode.ERROR, str(e)))
+        raise
+    finally:
+        close = getattr(iterator, "close", None)
+        if close is not None:
+            close()
+        current.set_attribute("stream.items", items)
+        current.end()
+
+
+def in_current_context(fn: Callable[..., T]) -> Callable[..., T]:
+    """``fn`` bound to the current context, so spans it starts on another thread keep their parent."""
+    ctx = contextvars.copy_context()
+    return lambda *args, **kwargs: ctx.run(fn, *args, **kwargs)
+
+
+class TracingMiddleware:
+    """A server span per HTTP request, continuing the caller's trace if it sent ``traceparent``."""
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or _tracer is None:
+            await self.app(scope, receive, send)
+            return
+        from opentelemetry import propagate
+        from opentelemetry.trace import SpanKind, Status, StatusCode
+
+        headers = {
+            k.decode("latin-1"): v.decode("latin-1") for k, v in scope["headers"]
+        }
+        status = 500
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        with _tracer.start_as_current_span(
+            scope["method"],
+            context=propagate.extract(headers),
+            kind=SpanKind.SERVER,
+            attributes={
+                "http.request.method": scope["method"],
+                "url.path": scope["path"],
+            },
+        ) as current:
+            try:
+                await self.app(scope, receive, send_wrapper)
+            finally:
+                route = route_template(scope)
+                current.update_name(f"{scope['method']} {route}")
+                current.set_attribute("http.route", route)
+                current.set_attribute("http.response.status_code", status)
+                if status >= 500:
+                    current.set_status(Status(StatusCode.ERROR))
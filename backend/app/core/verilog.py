@@ -0,0 +1,206 @@
+"""
+Lightweight structural parsing of Verilog source.
+
+This is not a full parser: it finds modules, their headers, ports,
+parameters, signal declarations and always/initial blocks with regular
+expressions over comment-stripped text, which is enough to pick prompt
+context and to build testbench skeletons. Offsets always refer to the
+original text.
+"""
+
+import re
+from dataclasses import dataclass, field
+
+_COMMENT = re.compile(r"//[^\n]*|/\*.*?\*/", re.DOTALL)
+_STRING = re.compile(r'"(?:\\.|[^"\\\n])*"')
+# At the start of a line, so prose like "starting from module and ..." is not a module
+_MODULE = re.compile(r"^[ \t]*module\s+(\w+)", re.MULTILINE)
+_ENDMODULE = re.compile(r"\bendmodule\b")
+_DECLARATION = re.compile(
+    r"^[ \t]*(?:reg|wire|logic|integer|real|parameter|localparam|genvar|input|output|inout)\b[^;]*;",
+    re.MULTILINE,
+)
+_BLOCK = re.compile(r"\b(?:always(?:_ff|_comb|_latch)?|initial)\b")
+_BEGIN_END = re.compile(r"\b(begin|end)\b")
+_DIRECTION = re.compile(r"\b(input|output|inout)\b")
+_PORT_DECL = re.compile(
+    r"\s*(wire|reg|logic)?\s*(?:signed\s*)?(\[[^\]]+\])?\s*(.*)", re.DOTALL
+)
+_SUBROUTINE = re.compile(r"\b(function|task)\b.*?\bend(?:function|task)\b", re.DOTALL)
+_PARAMETER = re.compile(
+    r"\bparameter\b\s*(?:integer\s+)?(\[[^\]]+\])?\s*(\w+)\s*=\s*([^,;)]+)"
+)
+
+
+@dataclass
+class Span:
+    start: int
+    end: int
+
+    def text(self, code: str) -> str:
+        return code[self.start : self.end]
+
+
+@dataclass
+class Port:
+    name: str
+    direction: str  # "input", "output" or "inout"
+    width: str = ""  # e.g. "[7:0]", empty for single-bit ports
+    kind: str = ""  # "wire", "reg", "logic" or empty
+
+
+@dataclass
+class Parameter:
+    name: str
+    value: str
+
+
+@dataclass
+class Module:
+    name: str
+    span: Span
+    header: Span
+    ports: list[Port] = field(default_factory=list)
+    parameters: list[Parameter] = field(default_factory=list)
+    declarations: list[Span] = field(default_factory=list)
+    blocks: list[Span] = field(default_factory=list)
+
+
+def strip_comments(code: str) -> str:
+    """Blank out comments, keeping offsets and line numbers unchanged."""
+    return _COMMENT.sub(lambda m: re.sub(r"[^\n]", " ", m.group()), code)
+
+
+def strip_strings(code: str) -> str:
+    """Blank out the contents of string literals, keeping offsets unchanged."""
+    return _STRING.sub(lambda m: '"' + " " * (len(m.group()) - 2) + '"', code)
+
+
+def _header_end(stripped: str, start: int) -> int:
+    """Offset just past the ``;`` that ends a module header."""
+    depth = 0
+    for i in range(start, len(stripped)):
+        c = stripped[i]
+        if c == "(":
+            depth += 1
+        elif c == ")":
+            depth -= 1
+        elif c == ";" and depth <= 0:
+            return i + 1
+    return len(stripped)
+
+
+def _block_end(stripped: str, start: int, limit: int) -> int:
+    """End offset of the always/initial statement starting at ``start``."""
+    i = start
+    # Skip an event control like @(posedge clk) or @*
+    at = stripped.find("@", i, limit)
+    semi = stripped.find(";", i, limit)
+    begin = re.compile(r"\bbegin\b").search(stripped, i, limit)
+    if at != -1 and (semi == -1 or at < semi) and (begin is None or at < begin.start()):
+        i = at + 1
+        while i < limit and stripped[i].isspace():
+            i += 1
+        if i < limit and stripped[i] == "(":
+            depth = 0
+            while i < limit:
+                if stripped[i] == "(":
+                    depth += 1
+                elif stripped[i] == ")":
+                    depth -= 1
+                    if depth == 0:
+                        i += 1
+                        break
+                i += 1
+        semi = stripped.find(";", i, limit)
+        begin = re.compile(r"\bbegin\b").search(stripped, i, limit)
+
+    if begin is not None and (semi == -1 or begin.start() < semi):
+        depth = 0
+        for m in _BEGIN_END.finditer(stripped, begin.start(), limit):
+            depth += 1 if m.group(1) == "begin" else -1
+            if depth == 0:
+                return m.end()
+        return limit
+    return semi + 1 if semi != -1 else limit
+
+
+def _split_names(rest: str) -> list[str]:
+    names = []
+    for part in rest.split(","):
+        m = re.match(r"\s*(\w+)", part)
+        if m:
+            names.append(m.group(1))
+    return names
+
+
+def parse_ports(module_text: str) -> list[Port]:
+    """
+    Ports from ANSI headers (``input wire [7:0] a, b,``) and non-ANSI body
+    declarations (``input [7:0] a;``). Names following a declaration without
+    their own direction share its direction, type and width.
+    """
+    # Function and task arguments are not module ports, and neither are
+    # words in strings like $display("input ...")
+    text = _SUBROUTINE.sub(lambda m: " " * len(m.group()), strip_strings(module_text))
+    keywords = list(_DIRECTION.finditer(text))
+    ports: list[Port] = []
+    seen: set[str] = set()
+    for i, m in enumerate(keywords):
+        stop = keywords[i + 1].start() if i + 1 < len(keywords) else len(text)
+        decl = text[m.end() : stop].split(";")[0]
+        d = _PORT_DECL.match(decl)
+        if d is None:
+            continue
+        kind, width, rest = d.groups()
+        for name in _split_names(rest):
+            if name not in seen:
+                seen.add(name)
+                ports.append(
+                    Port(name, m.group(1), (width or "").replace(" ", ""), kind or "")
+                )
+    return ports
+
+
+def parse_modules(code: str) -> list[Module]:
+    stripped = strip_comments(code)
+    modules = []
+    for m in _MODULE.finditer(stripped):
+        end_match = _ENDMODULE.search(stripped, m.end())
+        end = end_match.end() if end_match else len(stripped)
+        header_end = _header_end(stripped, m.end())
+        body = stripped[m.start() : end]
+
+        module = Module(
+            name=m.group(1),
+            span=Span(m.start(), end),
+            header=Span(m.start(), header_end),
+            ports=parse_ports(body),
+            parameters=[
+                Parameter(p.group(2), p.group(3).strip())
+                for p in _PARAMETER.finditer(body)
+            ],
+        )
+        for d in _DECLARATION.finditer(stripped, header_end, end):
+            module.declarations.append(Span(d.start(), d.end()))
+        for b in _BLOCK.finditer(stripped, header_end, end):
+            module.blocks.append(Span(b.start(), _block_end(stripped, b.end(), end)))
+        modules.append(module)
+    return modules
+
+
+def module_source(code: str) -> str:
+    """The modules in ``code``, without any prose around them."""
+    modules = parse_modules(code)
+    if not modules:
+        return code
+    return code[modules[0].span.start : modules[-1].span.end] + "\n"
+
+
+def enclosing_module(modules: list[Module], offset: int) -> Module | None:
+    for module in modules:
+        if module.span.start <= offset <= module.span.end:
+            return module
+    # While typing a module its endmodule may not exist yet
+    before = [m for m in modules if m.span.start <= offset]
+    return before[-1] if before else None
@@ -3,7 +3,8 @@ from typing import Any
 
 from sqlmodel import Session, select
 
-from app.core.security import get_password_hash, verify_password
+from app.core import metrics
+from app.core.security import get_password_hash, verify_password_and_update
 from app.models import Item, ItemCreate, User, UserCreate, UserUpdate
 
 
@@ -41,8 +42,16 @@ def authenticate(*, session: Session, email: str, password: str) -> User | None:
     db_user = get_user_by_email(session=session, email=email)
     if not db_user:
         return None
-    if not verify_password(password, db_user.hashed_password):
+    verified, new_hash = verify_password_and_update(password, db_user.hashed_password)
+    if not verified:
         return None
+    if new_hash:
+        # Made with an older BCRYPT_ROUNDS
+        db_user.hashed_password = new_hash
+        session.add(db_user)
+        session.commit()
+        session.refresh(db_user)
+        metrics.PASSWORD_REHASHES.inc()
     return db_user
 
 
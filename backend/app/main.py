@@ -1,4 +1,6 @@
-import sentry_sdk
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI, Request
 from fastapi.routing import APIRoute
 from fastapi.responses import JSONResponse
@@ -8,6 +10,10 @@ from starlette.exceptions import HTTPException as StarletteHTTPException
 
 from app.api.main import api_router
 from app.core.config import settings
+from app.core.llm import local_llm
+from app.core.local_engine import spawn_local_engine, stop_local_engine
+from app.core.metrics import MetricsMiddleware, metrics_endpoint
+from app.core.tracing import TracingMiddleware, configure_tracing, shutdown_tracing
 
 
 def custom_generate_unique_id(route: APIRoute) -> str:
@@ -15,12 +21,31 @@ def custom_generate_unique_id(route: APIRoute) -> str:
 
 
 if settings.SENTRY_DSN and settings.ENVIRONMENT != "local":
+    import sentry_sdk
+
     sentry_sdk.init(dsn=str(settings.SENTRY_DSN), enable_tracing=True)
 
+@asynccontextmanager
+async def lifespan(_app: FastAPI) -> AsyncIterator[None]:
+    # One CPU inference engine process per box, shared by all workers; under
+    # app.prefork the master owns it and this is a no-op
+    engine = spawn_local_engine()
+    # Keep the local model resident so completions never pay its load time
+    local_llm.start_keepalive(settings.LOCAL_LLM_KEEPALIVE_INTERVAL_SECONDS)
+    # Per worker, so the exporter thread lives in the process that records
+    if settings.OTEL_EXPORTER_OTLP_ENDPOINT:
+        configure_tracing()
+    yield
+    local_llm.stop_keepalive()
+    shutdown_tracing()
+    stop_local_engine(engine)
+
+
 app = FastAPI(
     title=settings.PROJECT_NAME,
     openapi_url=f"{settings.API_V1_STR}/openapi.json",
     generate_unique_id_function=custom_generate_unique_id,
+    lifespan=lifespan,
 )
 
 # Set all CORS enabled origins
@@ -55,7 +80,8 @@ app.add_middleware(
 async def http_exception_handler(request: Request, exc: StarletteHTTPException):
     response = JSONResponse(
         status_code=exc.status_code,
-        content={"detail": exc.detail}
+        content={"detail": exc.detail},
+        headers=exc.headers,  # e.g. Retry-After on 429
     )
     # Ensure CORS headers are added
     origin = request.headers.get("origin")
@@ -78,3 +104,11 @@ async def general_exception_handler(request: Request, exc: Exception):
     return response
 
 app.include_router(api_router, prefix=settings.API_V1_STR)
+
+if settings.OTEL_EXPORTER_OTLP_ENDPOINT:
+    app.add_middleware(TracingMiddleware)
+
+if settings.METRICS_ENABLED:
+    # Outermost, so the latency includes the other middleware
+    app.add_middleware(MetricsMiddleware)
+    app.add_route("/metrics", metrics_endpoint, include_in_schema=False)
@@ -0,0 +1,326 @@
+"""
+Measure model load time, memory and throughput to size inference boxes.
+
+Profiles either a local transformers checkpoint or a GGUF model served by
+Ollama and prints one JSON document (or writes it to ``--output``) so runs can
+be compared across commits and machines:
+
+    python -m app.model_profile hf ./Qwen --dtypes float32 bfloat16 int8 --batch-sizes 1 4 8
+    python -m app.model_profile ollama codeqwen --batch-sizes 1 4 --output ollama.json
+"""
+
+import argparse
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any
+
+import requests
+
+# Representative completion context, repeated to reach the requested length
+SAMPLE_VERILOG = """module counter #(parameter WIDTH = 8) (
+    input  wire             clk,
+    input  wire             rst_n,
+    input  wire             en,
+    output reg [WIDTH-1:0]  count
+);
+    always @(posedge clk or negedge rst_n) begin
+        if (!rst_n)
+            count <= {WIDTH{1'b0}};
+        else if (en)
+            count <= count + 1'b1;
+    end
+endmodule
+"""
+
+
+def rss_bytes() -> int:
+    """Resident set size of this process."""
+    try:
+        for line in Path("/proc/self/status").read_text().splitlines():
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    import resource
+
+    # ru_maxrss is the peak, in KiB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def weight_stats(state: Any) -> tuple[int, int]:
+    """
+    Element count and bytes of the tensors in a ``state_dict()``. Unlike
+    ``model.parameters()`` this includes the packed int8 weights that
+    dynamic quantization moves out of the parameters. Tensors shared by
+    several entries (tied embeddings) count once.
+    """
+    seen: set[tuple[int, int]] = set()
+    count = size = 0
+
+    def visit(value: Any) -> None:
+        nonlocal count, size
+        if isinstance(value, dict):
+            for item in value.values():
+                visit(item)
+        elif isinstance(value, (list, tuple)):
+            for item in value:
+                visit(item)
+        elif hasattr(value, "numel") and hasattr(value, "element_size"):
+            key = (value.data_ptr(), value.numel())
+            if key in seen:
+                return
+            seen.add(key)
+            count += value.numel()
+            size += value.numel() * value.element_size()
+
+    visit(state)
+    return count, size
+
+
+def profile_hf(
+    model_path: str,
+    dtypes: list[str],
+    batch_sizes: list[int],
+    prompt_tokens: int,
+    decode_tokens: int,
+) -> list[dict[str, Any]]:
+    try:
+        import torch
+        from transformers import AutoModelForCausalLM, AutoTokenizer
+    except ImportError as e:
+        raise SystemExit(
+            f"{e.name} is not installed; install the ml extra (uv sync --extra ml)"
+        )
+
+    tokenizer = AutoTokenizer.from_pretrained(model_path)
+    tokenizer.padding_side = "left"
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    sample_ids = tokenizer(SAMPLE_VERILOG)["input_ids"]
+    ids = (sample_ids * (prompt_tokens // len(sample_ids) + 1))[:prompt_tokens]
+
+    results = []
+    for dtype in dtypes:
+        gc.collect()
+        rss_before = rss_bytes()
+        started = time.perf_counter()
+        torch_dtype = torch.float32 if dtype == "int8" else getattr(torch, dtype)
+        model = AutoModelForCausalLM.from_pretrained(
+            model_path, torch_dtype=torch_dtype
+        )
+        if dtype == "int8":
+            model = torch.ao.quantization.quantize_dynamic(
+                model, {torch.nn.Linear}, dtype=torch.qint8
+            )
+        model.eval()
+        load_seconds = time.perf_counter() - started
+        rss_after = rss_bytes()
+
+        parameters, parameter_bytes = weight_stats(model.state_dict())
+        entry: dict[str, Any] = {
+            "backend": "hf",
+            "model": model_path,
+            "dtype": dtype,
+            "load_seconds": round(load_seconds, 3),
+            "rss_bytes": rss_after,
+            "rss_delta_bytes": rss_after - rss_before,
+            "parameters": parameters,
+            "parameter_bytes": parameter_bytes,
+            "batches": [],
+        }
+
+        for batch_size in batch_sizes:
+            input_ids = torch.tensor([ids] * batch_size)
+            with torch.inference_mode():
+                started = time.perf_counter()
+                model(input_ids=input_ids, use_cache=True)
+                prefill_seconds = time.perf_counter() - started
+
+                started = time.perf_counter()
+                model.generate(
+                    input_ids=input_ids,
+                    attention_mask=torch.ones_like(input_ids),
+                    max_new_tokens=decode_tokens,
+                    min_new_tokens=decode_tokens,
+                    do_sample=False,
+                    pad_token_id=tokenizer.pad_token_id,
+                )
+                generate_seconds = time.perf_counter() - started
+
+            decode_seconds = max(generate_seconds - prefill_seconds, 1e-9)
+            entry["batches"].append(
+                {
+                    "batch_size": batch_size,
+                    "prompt_tokens": prompt_tokens,
+                    "decode_tokens": decode_tokens,
+                    "prefill_seconds": round(prefill_seconds, 4),
+                    "prefill_tokens_per_second": round(
+                        batch_size * prompt_tokens / prefill_seconds, 2
+                    ),
+                    "decode_seconds": round(decode_seconds, 4),
+                    "decode_tokens_per_second": round(
+                        batch_size * decode_tokens / decode_seconds, 2
+                    ),
+                    "peak_rss_bytes": rss_bytes(),
+                }
+            )
+        results.append(entry)
+        del model
+    return results
+
+
+def profile_ollama(
+    base_url: str,
+    model: str,
+    batch_sizes: list[int],
+    prompt_tokens: int,
+    decode_tokens: int,
+) -> list[dict[str, Any]]:
+    base_url = base_url.rstrip("/")
+    # Roughly four characters per token
+    prompt = (SAMPLE_VERILOG * (prompt_tokens * 4 // len(SAMPLE_VERILOG) + 1))[
+        : prompt_tokens * 4
+    ]
+
+    def run(keep_alive: str | int) -> dict[str, Any]:
+        r = requests.post(
+            f"{base_url}/api/generate",
+            json={
+                "model": model,
+                "prompt": prompt,
+                "stream": False,
+                "raw": True,
+                "keep_alive": keep_alive,
+                "options": {"num_predict": decode_tokens, "temperature": 0},
+            },
+            timeout=600,
+        )
+        r.raise_for_status()
+        result: dict[str, Any] = r.json()
+        return result
+
+    # Unload the model so the first request measures a cold load
+    requests.post(
+        f"{base_url}/api/generate", json={"model": model, "keep_alive": 0}, timeout=60
+    ).raise_for_status()
+    cold = run("5m")
+
+    loaded = requests.get(f"{base_url}/api/ps", timeout=10).json().get("models", [])
+    info: dict[str, Any] = next(
+        (m for m in loaded if m.get("name", "").split(":")[0] == model.split(":")[0]),
+        {},
+    )
+
+    entry: dict[str, Any] = {
+        "backend": "ollama",
+        "model": model,
+        "load_seconds": round(cold.get("load_duration", 0) / 1e9, 3),
+        "model_bytes": info.get("size"),
+        "model_vram_bytes": info.get("size_vram"),
+        "batches": [],
+    }
+
+    for batch_size in batch_sizes:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=batch_size) as pool:
+            responses = list(pool.map(lambda _: run("5m"), range(batch_size)))
+        wall_seconds = time.perf_counter() - started
+
+        prompt_count = sum(r.get("prompt_eval_count", 0) for r in responses)
+        prompt_ns = max(r.get("prompt_eval_duration", 0) for r in responses) or 1
+        eval_count = sum(r.get("eval_count", 0) for r in responses)
+        eval_ns = max(r.get("eval_duration", 0) for r in responses) or 1
+        entry["batches"].append(
+            {
+                "batch_size": batch_size,
+                "prompt_tokens": prompt_count // batch_size,
+                "decode_tokens": eval_count // batch_size,
+                "prefill_tokens_per_second": round(prompt_count / (prompt_ns / 1e9), 2),
+                "decode_tokens_per_second": round(eval_count / (eval_ns / 1e9), 2),
+                "wall_seconds": round(wall_seconds, 4),
+            }
+        )
+    return [entry]
+
+
+def build_report(results: list[dict[str, Any]]) -> dict[str, Any]:
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "git_commit": git_commit(),
+        "host": {
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "cpu_count": os.cpu_count(),
+        },
+        "results": results,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n\n")[0])
+    sub = parser.add_subparsers(dest="backend", required=True)
+
+    hf = sub.add_parser("hf", help="local transformers checkpoint")
+    hf.add_argument("model_path")
+    hf.add_argument(
+        "--dtypes",
+        nargs="+",
+        default=["float32", "bfloat16"],
+        choices=["float32", "bfloat16", "float16", "int8"],
+    )
+
+    ollama = sub.add_parser("ollama", help="GGUF model served by Ollama")
+    ollama.add_argument("model")
+    ollama.add_argument("--base-url", default="http://localhost:11434")
+
+    for p in (hf, ollama):
+        p.add_argument("--batch-sizes", nargs="+", type=int, default=[1, 4])
+        p.add_argument("--prompt-tokens", type=int, default=256)
+        p.add_argument("--decode-tokens", type=int, default=64)
+        p.add_argument("--output", help="write JSON here instead of stdout")
+
+    args = parser.parse_args()
+    if args.backend == "hf":
+        results = profile_hf(
+            args.model_path,
+            args.dtypes,
+            args.batch_sizes,
+            args.prompt_tokens,
+            args.decode_tokens,
+        )
+    else:
+        results = profile_ollama(
+            args.base_url,
+            args.model,
+            args.batch_sizes,
+            args.prompt_tokens,
+            args.decode_tokens,
+        )
+
+    text = json.dumps(build_report(results), indent=2)
+    if args.output:
+        Path(args.output).write_text(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -106,6 +106,8 @@ class Token(SQLModel):
 # Contents of JWT token
 class TokenPayload(SQLModel):
     sub: str | None = None
+    # Only in tokens issued with AUTH_TOKEN_CLAIMS
+    active: bool | None = None
 
 
 class NewPassword(SQLModel):
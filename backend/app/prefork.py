@@ -0,0 +1,279 @@
+"""
+Pre-fork server.
+
+Like ``fastapi run --workers N``, but the master imports the app and warms
+its shared state (route and schema construction, the OpenAPI document,
+compiled email templates, tool version probes, the tokenizer) once and then
+forks the workers, which inherit it copy-on-write instead of each building
+their own. ``gc.freeze()`` before forking keeps the collector from writing
+to, and so un-sharing, the inherited objects. The master only supervises:
+it restarts workers that die and forwards SIGTERM/SIGINT for a graceful
+shutdown.
+
+Per-worker memory is logged on SIGUSR1 (and every
+``--memory-report-interval`` seconds): RSS, PSS and USS, where USS is what a
+worker does not share with anyone and PSS splits shared pages between the
+processes sharing them. ``GET /api/v1/profile/memory/workers/`` returns the
+same numbers.
+
+The local model weights are not loaded here: when ``LOCAL_ENGINE_MODEL_PATH``
+is set the master starts the CPU engine (``app.core.local_engine``) as one
+separate process shared by all workers, and stops it on shutdown.
+
+    python -m app.prefork --workers 4 --port 8000
+"""
+
+import argparse
+import gc
+import logging
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any
+
+from app.core.local_engine import SUPERVISED_ENV, spawn_local_engine, stop_local_engine
+from app.core.profiler import MemoryUsage, memory_usage
+
+logger = logging.getLogger("app.prefork")
+
+# A worker that dies this soon after being forked would only crash again
+BOOT_GRACE_SECONDS = 5.0
+GRACEFUL_TIMEOUT_SECONDS = 30.0
+
+
+def warm() -> Any:
+    """Import the app and build everything workers would otherwise each build on first use."""
+    from app import utils
+    from app.core import context, iverilog
+    from app.main import app
+
+    app.openapi()
+    for template in utils.EMAIL_TEMPLATES.glob("*.html"):
+        utils.email_template(template.name)
+    iverilog.version()
+    # Loads the tokenizer's BPE ranks when tiktoken is installed
+    context.count_tokens("module")
+
+    gc.collect()
+    gc.freeze()
+    return app
+
+
+def bind(host: str, port: int) -> socket.socket:
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _mb(n: int) -> str:
+    return f"{n / 2**20:.1f} MiB"
+
+
+def log_memory(master: MemoryUsage | None, workers: list[MemoryUsage]) -> None:
+    for role, usage in [("master", master), *(("worker", w) for w in workers)]:
+        if usage is not None:
+            logger.info(
+                "%s %d: rss %s, pss %s, uss %s",
+                role,
+                usage.pid,
+                _mb(usage.rss),
+                _mb(usage.pss),
+                _mb(usage.uss),
+            )
+    total = sum(u.pss for u in [master, *workers] if u is not None)
+    logger.info("total pss %s", _mb(total))
+
+
+class Master:
+    def __init__(
+        self,
+        app: Any,
+        sock: socket.socket,
+        workers: int,
+        log_level: str = "info",
+        memory_report_interval: float = 0,
+        engine: subprocess.Popen[bytes] | None = None,
+    ) -> None:
+        self.app = app
+        self.sock = sock
+        self.num_workers = workers
+        self.log_level = log_level
+        self.memory_report_interval = memory_report_interval
+        self.engine = engine
+        # pid -> monotonic time it was forked
+        self.workers: dict[int, float] = {}
+        self.stopping = False
+        self.report_requested = False
+
+    def spawn(self) -> None:
+        pid = os.fork()
+        if pid == 0:
+            self._run_worker()
+        self.workers[pid] = time.monotonic()
+        logger.info("Started worker %d", pid)
+
+    def _run_worker(self) -> None:
+        # uvicorn installs its own SIGTERM/SIGINT handlers
+        for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGUSR1):
+            signal.signal(sig, signal.SIG_DFL)
+        code = 0
+        try:
+            import uvicorn
+
+            config = uvicorn.Config(self.app, log_level=self.log_level)
+            uvicorn.Server(config).run(sockets=[self.sock])
+        except BaseException:
+            logger.exception("Worker %d failed", os.getpid())
+            code = 1
+        finally:
+            os._exit(code)
+
+    def _on_stop(self, signum: int, _frame: Any) -> None:
+        logger.info("Received %s, stopping workers", signal.Signals(signum).name)
+        self.stopping = True
+
+    def _on_report(self, _signum: int, _frame: Any) -> None:
+        self.report_requested = True
+
+    def report_memory(self) -> None:
+        log_memory(
+            memory_usage(os.getpid()),
+            [u for pid in sorted(self.workers) if (u := memory_usage(pid)) is not None],
+        )
+
+    def _reap(self) -> bool:
+        """Collect exited workers; False if one died during boot."""
+        while self.workers:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if pid == 0:
+                break
+            if self.engine is not None and pid == self.engine.pid:
+                self.engine.returncode = os.waitstatus_to_exitcode(status)
+                logger.warning(
+                    "Local engine exited with status %d", self.engine.returncode
+                )
+                continue
+            started = self.workers.pop(pid, None)
+            if started is None:
+                continue
+            _mark_process_dead(pid)
+            if self.stopping:
+                continue
+            logger.warning(
+                "Worker %d exited with status %d",
+                pid,
+                os.waitstatus_to_exitcode(status),
+            )
+            if time.monotonic() - started < BOOT_GRACE_SECONDS:
+                return False
+            self.spawn()
+        return True
+
+    def run(self) -> int:
+        signal.signal(signal.SIGTERM, self._on_stop)
+        signal.signal(signal.SIGINT, self._on_stop)
+        signal.signal(signal.SIGUSR1, self._on_report)
+        for _ in range(self.num_workers):
+            self.spawn()
+
+        code = 0
+        next_report = time.monotonic() + self.memory_report_interval
+        while not self.stopping:
+            if not self._reap():
+                logger.error("A worker failed to boot, shutting down")
+                self.stopping = True
+                code = 1
+                break
+            if self.report_requested or (
+                self.memory_report_interval and time.monotonic() >= next_report
+            ):
+                self.report_requested = False
+                next_report = time.monotonic() + self.memory_report_interval
+                self.report_memory()
+            time.sleep(0.2)
+        self.stop()
+        return code
+
+    def stop(self) -> None:
+        for pid in self.workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        deadline = time.monotonic() + GRACEFUL_TIMEOUT_SECONDS
+        while self.workers and time.monotonic() < deadline:
+            self._reap()
+            time.sleep(0.1)
+        for pid in self.workers:
+            logger.warning("Killing worker %d", pid)
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        for pid in list(self.workers):
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
+        self.workers.clear()
+        stop_local_engine(self.engine)
+
+
+def _mark_process_dead(pid: int) -> None:
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+
+        multiprocess.mark_process_dead(pid)  # type: ignore[no-untyped-call]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--log-level", default="info")
+    parser.add_argument(
+        "--memory-report-interval",
+        type=float,
+        default=0,
+        help="seconds between per-worker memory reports (0: only on SIGUSR1)",
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(message)s")
+
+    # Workers' metrics are aggregated through files; must be set before
+    # prometheus_client is imported
+    if "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+        os.environ["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp(
+            prefix="verilogai-metrics-"
+        )
+
+    sock = bind(args.host, args.port)
+    # One engine for the box, before forking so workers never start their own
+    engine = spawn_local_engine()
+    os.environ[SUPERVISED_ENV] = "1"
+    started = time.monotonic()
+    app = warm()
+    logger.info(
+        "Warmed the app in %.2fs, forking %d workers on %s:%d",
+        time.monotonic() - started,
+        args.workers,
+        args.host,
+        args.port,
+    )
+    master = Master(
+        app, sock, args.workers, args.log_level, args.memory_report_interval, engine
+    )
+    return master.run()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,108 @@
+from collections.abc import Iterator
+from typing import Any
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.api import deps
+from app.api.routes import chat
+from app.core.config import settings
+from app.core.conversations import ConversationStore
+from app.core.ratelimit import InMemoryBackend, RateLimiter
+
+
+class FakeRouter:
+    def __init__(self) -> None:
+        self.requests: list[Any] = []
+
+    def stream(self, req: Any, hedge: bool = False) -> Iterator[str]:  # noqa: ARG002
+        self.requests.append(req)
+        yield "Looks fine."
+
+
+@pytest.fixture
+def fake_router(monkeypatch: pytest.MonkeyPatch) -> FakeRouter:
+    router = FakeRouter()
+    monkeypatch.setattr(chat, "llm_router", router)
+    monkeypatch.setattr(chat, "conversations", ConversationStore(backend=None))
+    monkeypatch.setattr(deps, "limiter", RateLimiter(InMemoryBackend()))
+    return router
+
+
+def post(client: TestClient, body: dict[str, Any]) -> Any:
+    return client.post(f"{settings.API_V1_STR}/chat/stream", json=body)
+
+
+def test_chat_without_conversation(client: TestClient, fake_router: FakeRouter) -> None:
+    r = post(
+        client,
+        {
+            "messages": [{"role": "user", "content": "Explain this"}],
+            "context": {"code": "module m;\nendmodule"},
+        },
+    )
+    assert r.status_code == 200
+    assert "Looks fine." in r.text
+    messages = fake_router.requests[0].messages
+    assert [m["role"] for m in messages] == ["system", "system", "user"]
+    assert "module m;" in messages[1]["content"]
+
+
+def test_chat_conversation_deltas(client: TestClient, fake_router: FakeRouter) -> None:
+    r = post(
+        client,
+        {
+            "conversation_id": "conv-1",
+            "messages": [{"role": "user", "content": "Explain this"}],
+            "context": {"code": "module m;\nendmodule\n"},
+        },
+    )
+    assert r.status_code == 200
+    v0 = int(r.headers["X-Conversation-Version"])
+
+    r = post(
+        client,
+        {
+            "conversation_id": "conv-1",
+            "messages": [{"role": "user", "content": "And now?"}],
+            "edits": [{"start": 9, "end": 9, "text": "\n  wire a;"}],
+            "base_version": v0,
+        },
+    )
+    assert r.status_code == 200
+    v1 = int(r.headers["X-Conversation-Version"])
+    assert v1 != v0
+
+    first, second = fake_router.requests
+    # The history is kept on the server and forms a stable prefix
+    assert second.messages[:3] == [
+        first.messages[0],
+        {"role": "user", "content": "Explain this"},
+        {"role": "assistant", "content": "Looks fine."},
+    ]
+    assert "module m;\n  wire a;\nendmodule" in second.messages[3]["content"]
+    assert second.messages[4] == {"role": "user", "content": "And now?"}
+
+    # Stale base version
+    r = post(
+        client,
+        {
+            "conversation_id": "conv-1",
+            "messages": [{"role": "user", "content": "?"}],
+            "edits": [{"start": 0, "end": 0, "text": "x"}],
+            "base_version": v0,
+        },
+    )
+    assert r.status_code == 409
+    assert int(r.headers["X-Conversation-Version"]) == v1
+
+
+def test_chat_unknown_conversation_needs_full_state(
+    client: TestClient, fake_router: FakeRouter
+) -> None:
+    r = post(
+        client,
+        {"conversation_id": "gone", "messages": [{"role": "user", "content": "hi"}]},
+    )
+    assert r.status_code == 412
+    assert fake_router.requests == []
@@ -0,0 +1,218 @@
+from collections.abc import Iterator
+from typing import Any
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.api import deps
+from app.api.routes import generate
+from app.core.cache import Cache
+from app.core.config import settings
+from app.core.context import DocumentStore
+from app.core.llm import CompletionSessions
+from app.core.ratelimit import InMemoryBackend, RateLimiter
+
+
+class FakeRouter:
+    def __init__(self) -> None:
+        self.requests: list[Any] = []
+
+    def stream(self, req: Any, hedge: bool = False) -> Iterator[str]:  # noqa: ARG002
+        self.requests.append(req)
+        yield "assign y = a & b;"
+
+    def complete_n(self, req: Any, n: int, cancel: Any = None) -> list[str]:  # noqa: ARG002
+        self.requests.append(req)
+        return [
+            "always @(posedge clk) begin\n    q <= d;\n  end",
+            "Here is the code:",
+            "always @(posedge clk) begin\n    q <= d;",
+            "always @(posedge clk) begin\n    q <= d;\n  end",
+        ][:n]
+
+
+@pytest.fixture
+def fake_router(monkeypatch: pytest.MonkeyPatch) -> FakeRouter:
+    router = FakeRouter()
+    monkeypatch.setattr(generate, "llm_router", router)
+    monkeypatch.setattr(deps, "limiter", RateLimiter(InMemoryBackend()))
+    # Nothing cached or shared between test runs unless a test enables it
+    monkeypatch.setattr(
+        generate,
+        "completion_cache",
+        Cache("completions", ttl_seconds=60, max_bytes=0, backend=None),
+    )
+    monkeypatch.setattr(
+        generate, "completion_sessions", CompletionSessions(backend=None)
+    )
+    monkeypatch.setattr(generate, "documents", DocumentStore(backend=None))
+    return router
+
+
+def test_generate(client: TestClient, fake_router: FakeRouter) -> None:
+    r = client.post(
+        f"{settings.API_V1_STR}/generate/",
+        json={
+            "prompt": "module and2(input a, b, output y);\n",
+            "suffix": "\nendmodule",
+        },
+    )
+    assert r.status_code == 200
+    assert r.json()["text"].startswith("assign y = a & b;")
+    assert fake_router.requests[0].suffix == "\nendmodule"
+
+
+def test_generate_rate_limited_per_ip(
+    client: TestClient, fake_router: FakeRouter, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(settings, "RATE_LIMIT_IP_RPM", 2)
+    for _ in range(2):
+        r = client.post(
+            f"{settings.API_V1_STR}/generate/", json={"prompt": "module m("}
+        )
+        assert r.status_code == 200
+
+    r = client.post(f"{settings.API_V1_STR}/generate/", json={"prompt": "module m("})
+    assert r.status_code == 429
+    assert int(r.headers["Retry-After"]) > 0
+    assert len(fake_router.requests) == 2
+
+
+def test_generate_authenticated_users_have_own_budget(
+    client: TestClient,
+    fake_router: FakeRouter,
+    normal_user_token_headers: dict[str, str],
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setattr(settings, "RATE_LIMIT_IP_RPM", 1)
+    client.post(f"{settings.API_V1_STR}/generate/", json={"prompt": "module m("})
+    r = client.post(
+        f"{settings.API_V1_STR}/generate/",
+        json={"prompt": "module m("},
+        headers=normal_user_token_headers,
+    )
+    assert r.status_code == 200
+
+
+def test_generate_refunds_failed_requests(
+    client: TestClient, fake_router: FakeRouter, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    def fail(*_args: Any, **_kwargs: Any) -> Any:
+        raise RuntimeError("upstream down")
+
+    monkeypatch.setattr(fake_router, "stream", fail)
+    monkeypatch.setattr(fake_router, "complete_n", fail)
+    # Room for one upfront charge of n=3 (3 * (prompt + 2 * max_tokens)) at a time
+    monkeypatch.setattr(settings, "RATE_LIMIT_IP_TPM", 1000)
+    for n in (3, 3, 1, 1, 1, 1):
+        r = client.post(
+            f"{settings.API_V1_STR}/generate/", json={"prompt": "module m(", "n": n}
+        )
+        assert r.status_code == 500
+
+
+def test_generate_with_document(client: TestClient, fake_router: FakeRouter) -> None:
+    document = "module and2(input a, b, output y);\n  \nendmodule\n"
+    cursor = document.index("  \n") + 2
+    body = {"document": document, "cursor": cursor, "session_id": "doc-1", "seq": 1}
+    r = client.post(f"{settings.API_V1_STR}/generate/", json=body)
+    assert r.status_code == 200
+    assert fake_router.requests[0].prompt == document[:cursor].strip()
+    assert fake_router.requests[0].suffix == "\nendmodule\n"
+    assert "<CURSOR>" in fake_router.requests[0].messages[1]["content"]
+
+    # The document is kept per session and can be omitted while unchanged
+    del body["document"]
+    body["seq"] = 2
+    r = client.post(f"{settings.API_V1_STR}/generate/", json=body)
+    assert r.status_code == 200
+    assert fake_router.requests[1].suffix == "\nendmodule\n"
+
+    r = client.post(
+        f"{settings.API_V1_STR}/generate/",
+        json={"cursor": 3, "session_id": "unknown", "seq": 1},
+    )
+    assert r.status_code == 412
+
+
+def test_generate_rejects_stale_document(
+    client: TestClient, fake_router: FakeRouter
+) -> None:
+    document = "module and2(input a, b, output y);\n  \nendmodule\n"
+    body = {
+        "document": document,
+        "document_version": 1,
+        "cursor": document.index("  \n") + 2,
+        "session_id": "doc-2",
+        "seq": 1,
+    }
+    assert client.post(f"{settings.API_V1_STR}/generate/", json=body).status_code == 200
+
+    del body["document"]
+    body.update(seq=2)
+    assert client.post(f"{settings.API_V1_STR}/generate/", json=body).status_code == 200
+    # The editor changed the document since; the server must not use its copy
+    body.update(seq=3, document_version=2)
+    r = client.post(f"{settings.API_V1_STR}/generate/", json=body)
+    assert r.status_code == 412
+    assert len(fake_router.requests) == 2
+
+
+def test_generate_ranked_candidates(
+    client: TestClient, fake_router: FakeRouter
+) -> None:
+    r = client.post(
+        f"{settings.API_V1_STR}/generate/",
+        json={"prompt": "module dff(input clk, d, output reg q);\n  ", "n": 4},
+    )
+    assert r.status_code == 200
+    candidates = r.json()["candidates"]
+    # Duplicates collapse and win the vote, prose is dropped, and the
+    # truncated candidate gets its missing closers
+    assert len(candidates) == 2
+    assert candidates[0].endswith("  end\nendmodule")
+    assert candidates[1].endswith("    end\nendmodule")
+    assert r.json()["text"] == candidates[0]
+
+    r = client.post(
+        f"{settings.API_V1_STR}/generate/", json={"prompt": "module m(", "n": 9}
+    )
+    assert r.status_code == 422
+
+
+def test_generate_replays_cached_completion(
+    client: TestClient, fake_router: FakeRouter, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(
+        generate, "completion_cache", Cache("completions", ttl_seconds=60, backend=None)
+    )
+    body = {"prompt": "module and2(input a, b, output y);\n", "suffix": "\nendmodule"}
+    first = client.post(f"{settings.API_V1_STR}/generate/", json=body)
+    second = client.post(f"{settings.API_V1_STR}/generate/", json=body)
+    assert first.json() == second.json()
+    assert len(fake_router.requests) == 1
+
+    r = client.post(f"{settings.API_V1_STR}/generate/stream", json=body)
+    # The streaming request differs upstream (max_tokens, stop) so is not a hit
+    assert len(fake_router.requests) == 2
+    r = client.post(f"{settings.API_V1_STR}/generate/stream", json=body)
+    assert "assign y = a & b;" in r.text
+    assert len(fake_router.requests) == 2
+
+
+def test_generate_replays_cached_candidates(
+    client: TestClient, fake_router: FakeRouter, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(
+        generate, "completion_cache", Cache("completions", ttl_seconds=60, backend=None)
+    )
+    body = {"prompt": "module dff(input clk, d, output reg q);\n  ", "n": 3}
+    first = client.post(f"{settings.API_V1_STR}/generate/", json=body)
+    second = client.post(f"{settings.API_V1_STR}/generate/", json=body)
+    assert first.status_code == 200
+    assert first.json() == second.json()
+    assert len(fake_router.requests) == 1
+
+    # Cached per n
+    client.post(f"{settings.API_V1_STR}/generate/", json={**body, "n": 2})
+    assert len(fake_router.requests) == 2
@@ -0,0 +1,85 @@
+import os
+import threading
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.core.config import settings
+
+
+def spin(stop: threading.Event) -> None:
+    while not stop.is_set():
+        sum(range(1000))
+
+
+def test_cpu_profile(
+    client: TestClient, superuser_token_headers: dict[str, str]
+) -> None:
+    stop = threading.Event()
+    thread = threading.Thread(target=spin, args=(stop,), name="spinner")
+    thread.start()
+    try:
+        r = client.get(
+            f"{settings.API_V1_STR}/profile/cpu/",
+            params={"seconds": 0.2, "interval_ms": 2},
+            headers=superuser_token_headers,
+        )
+    finally:
+        stop.set()
+        thread.join()
+    assert r.status_code == 200
+    assert int(r.headers["X-Profile-Samples"]) > 0
+    lines = r.text.splitlines()
+    spinner = [line for line in lines if line.startswith("spinner;")]
+    assert spinner and "spin (test_profile.py:" in spinner[0]
+    assert all(line.rsplit(" ", 1)[1].isdigit() for line in lines)
+
+
+def test_profile_requires_superuser(
+    client: TestClient, normal_user_token_headers: dict[str, str]
+) -> None:
+    r = client.get(
+        f"{settings.API_V1_STR}/profile/cpu/",
+        params={"seconds": 0.1},
+        headers=normal_user_token_headers,
+    )
+    assert r.status_code == 403
+
+
+def test_memory_snapshot_diff(
+    client: TestClient, superuser_token_headers: dict[str, str]
+) -> None:
+    url = f"{settings.API_V1_STR}/profile/memory"
+    r = client.get(f"{url}/snapshot/", headers=superuser_token_headers)
+    assert r.status_code == 409
+
+    client.post(f"{url}/start/", headers=superuser_token_headers)
+    try:
+        first = client.get(f"{url}/snapshot/", headers=superuser_token_headers).json()
+        assert not first["compared_to_previous"]
+        leak = [bytearray(1024) for _ in range(2000)]
+        second = client.get(f"{url}/snapshot/", headers=superuser_token_headers).json()
+        assert second["compared_to_previous"]
+        top = second["top"][0]
+        assert "test_profile.py" in top["location"]
+        assert top["size_diff"] >= 2000 * 1024
+        del leak
+    finally:
+        client.post(f"{url}/stop/", headers=superuser_token_headers)
+
+
+def test_worker_memory(
+    client: TestClient, superuser_token_headers: dict[str, str]
+) -> None:
+    r = client.get(
+        f"{settings.API_V1_STR}/profile/memory/workers/",
+        headers=superuser_token_headers,
+    )
+    if r.status_code == 501:
+        pytest.skip("smaps_rollup is not available")
+    assert r.status_code == 200
+    body = r.json()
+    assert body["master"]["pid"] == os.getppid()
+    # The test process is one of its parent's children
+    me = next(w for w in body["workers"] if w["pid"] == os.getpid())
+    assert 0 < me["uss"] <= me["pss"] <= me["rss"]
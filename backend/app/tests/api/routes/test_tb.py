@@ -0,0 +1,240 @@
+import json
+from collections.abc import Iterator
+from typing import Any
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.api import deps
+from app.api.routes import tb
+from app.core import iverilog
+from app.core.config import settings
+from app.core.ratelimit import InMemoryBackend, RateLimiter
+
+RESPONSE = (
+    "```verilog\nmodule and2_tb;\n  reg a, b;\n  initial $finish;\nendmodule\n```"
+)
+
+
+class FakeRouter:
+    def __init__(self) -> None:
+        self.requests: list[Any] = []
+        # Split at awkward places, including inside the fences
+        self.chunks = [
+            "``",
+            "`veri",
+            "log\nmodule and2_tb;\n  reg",
+            " a, b;\n",
+            "  initial $finish;\nendmodule\n`",
+            "``",
+        ]
+
+    def stream(self, req: Any, hedge: bool = False) -> Iterator[str]:  # noqa: ARG002
+        self.requests.append(req)
+        yield from self.chunks
+
+
+def sse_events(text: str) -> list[dict[str, Any]]:
+    return [
+        json.loads(line[len("data: ") :])
+        for line in text.split("\n\n")
+        if line.startswith("data: ")
+    ]
+
+
+@pytest.fixture
+def fake_router(monkeypatch: pytest.MonkeyPatch) -> FakeRouter:
+    router = FakeRouter()
+    monkeypatch.setattr(tb, "llm_router", router)
+    monkeypatch.setattr(deps, "limiter", RateLimiter(InMemoryBackend()))
+    return router
+
+
+def test_code_fence_stripper_matches_strip_code_fences() -> None:
+    for size in range(1, len(RESPONSE) + 1):
+        stripper = tb.CodeFenceStripper()
+        pieces = [RESPONSE[i : i + size] for i in range(0, len(RESPONSE), size)]
+        out = "".join(stripper.feed(p) for p in pieces) + stripper.close()
+        assert out.strip() == tb.strip_code_fences(RESPONSE)
+
+
+def test_code_fence_stripper_passes_code_through_immediately() -> None:
+    stripper = tb.CodeFenceStripper()
+    assert stripper.feed("module tb") == "module tb"
+    assert stripper.feed(";\n``") == ";\n"
+    assert stripper.feed("`\n") == ""
+    assert stripper.feed("`a` is") == "`a` is"
+
+
+def test_tb_stream_without_ports(client: TestClient, fake_router: FakeRouter) -> None:
+    r = client.post(
+        f"{settings.API_V1_STR}/tb/stream",
+        json={"prompt": "module and2;\nendmodule"},
+    )
+    assert r.status_code == 200
+    events = sse_events(r.text)
+    assert events[0] == {"module_name": "and2"}
+    assert events[-1] == {"done": True}
+    text = "".join(e.get("text", "") for e in events)
+    assert text == "module and2_tb;\n  reg a, b;\n  initial $finish;\nendmodule\n"
+
+
+def test_tb_stream_fills_skeleton(client: TestClient, fake_router: FakeRouter) -> None:
+    fake_router.chunks = ["```verilog\na = 1;", " b = 1;\n#10;\n", "$display(y);\n```"]
+    r = client.post(
+        f"{settings.API_V1_STR}/tb/stream",
+        json={"prompt": "module and2(input a, b, output y);\nendmodule"},
+    )
+    events = sse_events(r.text)
+    assert events[0] == {"module_name": "and2"}
+    # The skeleton head goes out before the stimulus
+    assert events[1]["text"].startswith("module and2_tb;")
+    text = "".join(e.get("text", "") for e in events)
+    assert "    a = 1; b = 1;\n    #10;\n    $display(y);\n" in text
+    assert text.endswith("$finish;\n  end\nendmodule\n")
+    # Only the stimulus is requested
+    assert fake_router.requests[0].max_tokens == 800
+    assert "skeleton" in fake_router.requests[0].messages[1]["content"]
+
+
+def test_tb_stream_whole_module_is_not_wrapped(
+    client: TestClient, fake_router: FakeRouter
+) -> None:
+    # The model ignored the skeleton and wrote a whole testbench
+    r = client.post(
+        f"{settings.API_V1_STR}/tb/stream",
+        json={"prompt": "module and2(input a, b, output y);\nendmodule"},
+    )
+    events = sse_events(r.text)
+    assert events[-1] == {"done": True}
+    text = "".join(e.get("text", "") for e in events)
+    assert text == "module and2_tb;\n  reg a, b;\n  initial $finish;\nendmodule\n"
+
+
+def test_tb_generate_fills_skeleton(
+    client: TestClient, fake_router: FakeRouter
+) -> None:
+    fake_router.chunks = ["a = 1; b = 0;\n#10;"]
+    r = client.post(
+        f"{settings.API_V1_STR}/tb/",
+        json={"prompt": "module and2(input a, b, output y);\nendmodule"},
+    )
+    assert r.status_code == 200
+    assert r.json()["module_name"] == "and2"
+    assert "    a = 1; b = 0;\n    #10;\n" in r.json()["text"]
+
+    # A model that ignores the instructions and writes a whole testbench
+    fake_router.chunks = ["module and2_tb;\nendmodule"]
+    r = client.post(
+        f"{settings.API_V1_STR}/tb/",
+        json={"prompt": "module and2(input a, b, output y);\nendmodule\n"},
+    )
+    assert r.json()["text"] == "module and2_tb;\nendmodule"
+
+
+class VerifyRouter:
+    """Stimulus that only compiles once repaired, except at temperature 0.9."""
+
+    def __init__(self) -> None:
+        self.requests: list[Any] = []
+
+    def stream(self, req: Any, hedge: bool = False) -> Iterator[str]:  # noqa: ARG002
+        self.requests.append(req)
+        repaired = "failed to compile" in req.messages[-1]["content"]
+        if req.temperature == 0.9 or repaired:
+            yield f"a = 1; // t={req.temperature}"
+        else:
+            yield "a = bad;"
+
+
+@pytest.fixture
+def fake_iverilog(monkeypatch: pytest.MonkeyPatch) -> list[str]:
+    compiled: list[str] = []
+
+    def check_testbench(dut: str, tb_code: str) -> iverilog.CompileResult:
+        compiled.append(tb_code)
+        if "bad" in tb_code:
+            return iverilog.CompileResult(
+                False, "tb.v:20: error: Unable to bind wire/reg/memory `bad'"
+            )
+        return iverilog.CompileResult(True)
+
+    monkeypatch.setattr(iverilog, "available", lambda: True)
+    monkeypatch.setattr(
+        iverilog, "check_dut", lambda code: iverilog.CompileResult("module" in code)
+    )
+    monkeypatch.setattr(iverilog, "check_testbench", check_testbench)
+    monkeypatch.setattr(deps, "limiter", RateLimiter(InMemoryBackend()))
+    return compiled
+
+
+def test_tb_verify_first_success_wins(
+    client: TestClient, fake_iverilog: list[str], monkeypatch: pytest.MonkeyPatch
+) -> None:
+    router = VerifyRouter()
+    monkeypatch.setattr(tb, "llm_router", router)
+    monkeypatch.setattr(settings, "TB_VERIFY_TEMPERATURES", [0.2, 0.9])
+    r = client.post(
+        f"{settings.API_V1_STR}/tb/",
+        json={
+            "prompt": "Testbench for:\nmodule inv(input a, output y);\nendmodule",
+            "verify": True,
+        },
+    )
+    assert r.status_code == 200
+    body = r.json()
+    assert body["verified"] is True
+    assert body["compile_errors"] is None
+    assert "    a = 1; // t=" in body["text"]
+    assert body["text"].startswith("module inv_tb;")
+
+
+def test_tb_verify_repairs_with_compiler_errors(
+    client: TestClient, fake_iverilog: list[str], monkeypatch: pytest.MonkeyPatch
+) -> None:
+    router = VerifyRouter()
+    monkeypatch.setattr(tb, "llm_router", router)
+    monkeypatch.setattr(settings, "TB_VERIFY_TEMPERATURES", [0.2])
+    r = client.post(
+        f"{settings.API_V1_STR}/tb/",
+        json={"prompt": "module inv(input a, output y);\nendmodule", "verify": True},
+    )
+    body = r.json()
+    assert body["verified"] is True
+    assert "a = 1; // t=0.2" in body["text"]
+    first, repair = router.requests
+    assert repair.messages[-2] == {"role": "assistant", "content": "a = bad;"}
+    assert "Unable to bind" in repair.messages[-1]["content"]
+    assert "stimulus statements only" in repair.messages[-1]["content"]
+    assert len(fake_iverilog) == 2
+
+
+def test_tb_verify_gives_up_after_repair_rounds(
+    client: TestClient, fake_iverilog: list[str], monkeypatch: pytest.MonkeyPatch
+) -> None:
+    class BrokenRouter(FakeRouter):
+        def stream(self, req: Any, hedge: bool = False) -> Iterator[str]:  # noqa: ARG002
+            self.requests.append(req)
+            yield "a = bad;"
+
+    router = BrokenRouter()
+    monkeypatch.setattr(tb, "llm_router", router)
+    monkeypatch.setattr(settings, "TB_VERIFY_TEMPERATURES", [0.2])
+    monkeypatch.setattr(settings, "TB_VERIFY_REPAIR_ROUNDS", 1)
+    r = client.post(
+        f"{settings.API_V1_STR}/tb/",
+        json={"prompt": "module inv(input a, output y);\nendmodule", "verify": True},
+    )
+    body = r.json()
+    assert body["verified"] is False
+    assert "Unable to bind" in body["compile_errors"]
+    assert len(router.requests) == 2
+
+
+def test_tb_verify_rejects_broken_dut(
+    client: TestClient, fake_iverilog: list[str]
+) -> None:
+    r = client.post(
+        f"{settings.API_V1_STR}/tb/", json={"prompt": "not verilog", "verify": True}
+    )
+    assert r.status_code == 422
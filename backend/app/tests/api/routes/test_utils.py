@@ -0,0 +1,42 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from app.core.config import settings
+from app.core.llm import local_llm
+
+
+def test_local_llm_health_serves_the_cached_status(
+    client: TestClient, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    forced: list[bool] = []
+    monkeypatch.setattr(local_llm, "healthy", lambda force=False: forced.append(force))
+    r = client.get(f"{settings.API_V1_STR}/utils/local-llm-health/")
+    assert r.status_code == 200
+    assert forced == [False]
+
+
+def test_forced_local_llm_probe_is_for_superusers(
+    client: TestClient,
+    normal_user_token_headers: dict[str, str],
+    superuser_token_headers: dict[str, str],
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    forced: list[bool] = []
+    monkeypatch.setattr(local_llm, "healthy", lambda force=False: forced.append(force))
+    url = f"{settings.API_V1_STR}/utils/local-llm-health/"
+    assert client.post(url).status_code == 401
+    assert client.post(url, headers=normal_user_token_headers).status_code == 403
+    assert client.post(url, headers=superuser_token_headers).status_code == 200
+    assert forced == [True]
+
+
+@pytest.mark.parametrize("path", ["llm-providers", "prompt-cache"])
+def test_llm_stats_are_for_superusers(
+    client: TestClient,
+    normal_user_token_headers: dict[str, str],
+    superuser_token_headers: dict[str, str],
+    path: str,
+) -> None:
+    url = f"{settings.API_V1_STR}/utils/{path}/"
+    assert client.get(url, headers=normal_user_token_headers).status_code == 403
+    assert client.get(url, headers=superuser_token_headers).status_code == 200
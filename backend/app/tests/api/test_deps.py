@@ -0,0 +1,122 @@
+from collections.abc import Iterator
+from datetime import timedelta
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlmodel import Session
+
+from app.api import deps
+from app.core.cache import Cache, SQLiteBackend
+from app.core.config import settings
+from app.core.security import create_access_token, get_password_hash
+from app.models import User
+from app.tests.utils.user import create_random_user, user_authentication_headers
+from app.tests.utils.utils import random_lower_string
+
+
+@pytest.fixture(autouse=True)
+def empty_user_cache() -> Iterator[None]:
+    deps.user_cache.clear()
+    yield
+    deps.user_cache.clear()
+
+
+def test_load_user_is_cached(db: Session) -> None:
+    user = create_random_user(db)
+    with patch.object(Session, "get", wraps=db.get) as get:
+        first = deps.load_user(db, user.id)
+        second = deps.load_user(db, user.id)
+    assert get.call_count == 1
+    assert first and second
+    assert second.email == user.email
+    assert second.hashed_password == user.hashed_password
+
+
+def test_cached_user_can_be_updated(db: Session) -> None:
+    user = create_random_user(db)
+    deps.load_user(db, user.id)
+    with Session(db.get_bind()) as session:
+        cached = deps.load_user(session, user.id)
+        assert cached
+        cached.full_name = "Cached"
+        session.add(cached)
+        session.commit()
+    db.refresh(user)
+    assert user.full_name == "Cached"
+
+
+def test_invalidation_reaches_other_workers(
+    db: Session, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    backend = SQLiteBackend(str(tmp_path / "cache.sqlite3"), max_bytes=10**7)
+    monkeypatch.setattr(
+        deps,
+        "user_generations",
+        Cache("user_generations", 60, max_bytes=0, backend=backend),
+    )
+    user = create_random_user(db)
+    worker_a = deps.user_cache
+    assert deps.load_user(db, user.id)
+
+    # Another worker deactivates the user and invalidates its own cache
+    worker_b = Cache("users", ttl_seconds=60, backend=None)
+    monkeypatch.setattr(deps, "user_cache", worker_b)
+    user.is_active = False
+    db.add(user)
+    db.commit()
+    deps.invalidate_user(user.id)
+
+    monkeypatch.setattr(deps, "user_cache", worker_a)
+    with patch.object(Session, "get", wraps=db.get) as get:
+        reloaded = deps.load_user(db, user.id)
+    assert get.call_count == 1
+    assert reloaded and not reloaded.is_active
+    # Only the generation token is shared, never the user's columns
+    assert backend.get(f"user_generations:{user.id}") is not None
+    assert backend.get(f"users:{user.id}") is None
+
+
+def test_update_invalidates_cached_user(client: TestClient, db: Session) -> None:
+    password = random_lower_string()
+    user = create_random_user(db)
+    user.hashed_password = get_password_hash(password)
+    db.add(user)
+    db.commit()
+    headers = user_authentication_headers(
+        client=client, email=user.email, password=password
+    )
+    r = client.get(f"{settings.API_V1_STR}/users/me", headers=headers)
+    assert r.json()["full_name"] is None
+    r = client.patch(
+        f"{settings.API_V1_STR}/users/me", headers=headers, json={"full_name": "New"}
+    )
+    assert r.status_code == 200
+    r = client.get(f"{settings.API_V1_STR}/users/me", headers=headers)
+    assert r.json()["full_name"] == "New"
+
+
+def test_optional_user_id_trusts_claims(
+    db: Session, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(settings, "AUTH_TOKEN_CLAIMS", True)
+    user = create_random_user(db)
+    active = create_access_token(user.id, timedelta(minutes=5), claims={"active": True})
+    inactive = create_access_token(
+        user.id, timedelta(minutes=5), claims={"active": False}
+    )
+    with patch.object(Session, "get", side_effect=AssertionError("no lookup")):
+        assert deps.get_optional_user_id(db, active) == str(user.id)
+        assert deps.get_optional_user_id(db, inactive) is None
+
+
+def test_optional_user_id_without_claims(db: Session) -> None:
+    user = create_random_user(db)
+    token = create_access_token(user.id, timedelta(minutes=5))
+    assert deps.get_optional_user_id(db, token) == str(user.id)
+    assert deps.get_optional_user_id(db, "garbage") is None
+    assert deps.get_optional_user_id(db, None) is None
+    unknown = create_access_token("not-a-uuid", timedelta(minutes=5))
+    assert deps.get_optional_user_id(db, unknown) is None
+    assert db.get(User, user.id)
@@ -0,0 +1,111 @@
+import time
+from pathlib import Path
+
+import pytest
+
+from app.core import metrics
+from app.core.cache import Cache, SQLiteBackend
+
+
+@pytest.fixture
+def backend(tmp_path: Path) -> SQLiteBackend:
+    return SQLiteBackend(str(tmp_path / "cache.sqlite3"), max_bytes=10_000)
+
+
+def hits(cache: str, tier: str) -> float:
+    return float(metrics.CACHE_TIER_HITS.labels(cache, tier)._value.get())
+
+
+def test_front_hit_and_lru_eviction() -> None:
+    cache = Cache("test_front", ttl_seconds=60, max_bytes=25, backend=None)
+    cache.set("a", "x" * 8)  # 10 bytes encoded
+    cache.set("b", "y" * 8)
+    assert cache.get("a") == "x" * 8
+    cache.set("c", "z" * 8)
+    # "b" was the least recently used
+    assert cache.get("b") is None
+    assert cache.get("a") == "x" * 8
+    assert cache.stats()["memory_bytes"] == 20
+
+
+def test_ttl_expiry() -> None:
+    cache = Cache("test_ttl", ttl_seconds=60, backend=None)
+    cache.set("k", {"v": 1}, ttl_seconds=0.05)
+    assert cache.get("k") == {"v": 1}
+    time.sleep(0.1)
+    assert cache.get("k") is None
+    assert cache.stats()["memory_entries"] == 0
+
+
+def test_shared_tier_between_workers(backend: SQLiteBackend) -> None:
+    # Two caches with the same name stand for the same cache in two workers
+    first = Cache("test_shared", ttl_seconds=60, backend=backend)
+    second = Cache("test_shared", ttl_seconds=60, backend=backend)
+    before = hits("test_shared", "shared")
+    first.set("k", {"diagnostics": []})
+    assert second.get("k") == {"diagnostics": []}
+    assert hits("test_shared", "shared") == before + 1
+    # Now in the second worker's front, with the shared entry's expiry
+    assert second.get("k") == {"diagnostics": []}
+    assert hits("test_shared", "memory") >= 1
+    assert 59 < second._front["k"][2] - time.time() <= 60
+    # Other caches do not see it
+    assert Cache("test_other", ttl_seconds=60, backend=backend).get("k") is None
+
+    second.delete("k")
+    assert second.get("k") is None
+    assert first.get("k") == {"diagnostics": []}  # until its own front entry goes
+    first.clear()
+    assert first.get("k") is None
+
+
+def test_shared_expiry(backend: SQLiteBackend) -> None:
+    Cache("test_expiry", ttl_seconds=0.05, backend=backend).set("k", 1)
+    time.sleep(0.1)
+    assert Cache("test_expiry", ttl_seconds=60, backend=backend).get("k") is None
+
+
+def test_sqlite_size_limit(backend: SQLiteBackend) -> None:
+    cache = Cache("test_trim", ttl_seconds=60, backend=backend)
+    for i in range(30):
+        cache.set(str(i), "x" * 998, ttl_seconds=60 + i)  # 1000 bytes each
+    assert cache.stats()["shared_bytes"] == 30_000
+    backend.trim()
+    assert cache.stats()["shared_bytes"] <= 9_000
+    # The soonest-expiring entries went first
+    assert backend.get("test_trim:0") is None
+    assert backend.get("test_trim:29") is not None
+
+
+def test_shared_tier_failure_is_a_miss() -> None:
+    class Broken:
+        def get(self, key: str) -> None:  # noqa: ARG002
+            raise ConnectionError("down")
+
+        def set(self, key: str, value: bytes, expires: float) -> None:  # noqa: ARG002
+            raise ConnectionError("down")
+
+        def delete(self, key: str) -> None:  # noqa: ARG002
+            raise ConnectionError("down")
+
+        def size(self, prefix: str) -> None:  # noqa: ARG002
+            return None
+
+    cache = Cache("test_broken", ttl_seconds=60, backend=Broken())
+    assert cache.get("k") is None
+    cache.set("k", "v")
+    assert cache.get("k") == "v"
+    assert cache.get_or_compute("other", lambda: "computed") == "computed"
+
+
+def test_shared_tier_init_failure_is_a_miss() -> None:
+    def unavailable() -> None:
+        raise ConnectionError("cannot open the shared tier")
+
+    cache = Cache("test_unavailable", ttl_seconds=60, backend=unavailable)
+    assert cache.get("k") is None
+    cache.set("k", "v")
+    assert cache.get("k") == "v"
+    cache.delete("k")
+    assert cache.get("k") is None
+    assert cache.stats()["shared_bytes"] is None
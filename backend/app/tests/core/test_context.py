@@ -0,0 +1,89 @@
+from pathlib import Path
+
+from app.core.cache import SQLiteBackend
+from app.core.context import (
+    ELISION,
+    DocumentStore,
+    build_completion_context,
+    count_tokens,
+)
+
+HEADER = """module alu #(parameter W = 8) (
+    input  wire         clk,
+    input  wire [W-1:0] a, b,
+    input  wire [1:0]   op,
+    output reg  [W-1:0] y
+);
+    reg [W-1:0] acc;
+"""
+
+FILLER = "".join(f"    always @(posedge clk) r{i} <= a + {i};\n" for i in range(200))
+
+DOCUMENT = (
+    HEADER
+    + FILLER
+    + "    always @(posedge clk) begin\n        case (op)\n"
+    + "            2'd0: y <= a + b;\n            2'd1: "
+    + "\n        endcase\n    end\n"
+    + FILLER
+    + "endmodule\n"
+)
+CURSOR = DOCUMENT.index("2'd1: ") + len("2'd1: ")
+
+
+def test_small_document_is_sent_whole() -> None:
+    code = HEADER + "    assign "
+    prefix, suffix = build_completion_context(code + "\nendmodule\n", len(code), 1024)
+    assert prefix == code
+    assert suffix == "\nendmodule\n"
+
+
+def test_context_keeps_header_and_local_code_within_budget() -> None:
+    prefix, suffix = build_completion_context(DOCUMENT, CURSOR, 400)
+
+    assert count_tokens(prefix) + count_tokens(suffix) <= 400
+    # The port list and declarations survive even though they are far away
+    assert prefix.startswith(HEADER.split("\n")[0])
+    assert "output reg  [W-1:0] y\n);" in prefix
+    assert "reg [W-1:0] acc;" in prefix
+    assert ELISION in prefix
+    # The code right around the cursor is kept verbatim
+    assert prefix.endswith("2'd0: y <= a + b;\n            2'd1: ")
+    assert suffix.startswith("\n        endcase\n    end\n")
+    # Far away blocks are dropped
+    assert "r0 <=" not in prefix
+
+
+def test_nearest_blocks_are_preferred() -> None:
+    prefix, _ = build_completion_context(DOCUMENT, CURSOR, 400)
+    assert "r199 <=" in prefix
+    assert "r100 <=" not in prefix
+
+
+def test_document_store_evicts_oldest() -> None:
+    store = DocumentStore(max_documents=2, backend=None)
+    store.put("a", "1")
+    store.put("b", "2")
+    store.get("a")
+    store.put("c", "3")
+    assert store.get("a") == "1"
+    assert store.get("b") is None
+    assert store.get("c") == "3"
+
+
+def test_document_store_serves_only_the_requested_version(tmp_path: Path) -> None:
+    backend = SQLiteBackend(str(tmp_path / "cache.sqlite3"), max_bytes=10**7)
+    a, b = DocumentStore(backend=backend), DocumentStore(backend=backend)
+    a.put("s", "module v1;", version=1)
+    assert b.get("s", version=1) == "module v1;"
+
+    # The editor moved on through worker a; b's own copy is now stale
+    a.put("s", "module v2;", version=2)
+    assert b.get("s", version=2) == "module v2;"
+    assert b.get("s", version=3) is None
+
+    # Without a shared tier a worker never answers with another version
+    local = DocumentStore(backend=None)
+    local.put("s", "module v1;", version=1)
+    assert local.get("s", version=2) is None
+    assert local.get("s") == "module v1;"
@@ -0,0 +1,209 @@
+from pathlib import Path
+
+import pytest
+
+from app.core.cache import SQLiteBackend
+from app.core.conversations import (
+    KEEP_RECENT_MESSAGES,
+    OMITTED_CODE,
+    SUMMARY_PREFIX,
+    ConversationNotFound,
+    ConversationStore,
+    TextEdit,
+    VersionMismatch,
+    apply_edits,
+    dedupe_code_blocks,
+    fit_history,
+    message_tokens,
+)
+
+
+def test_apply_edits_in_order() -> None:
+    doc = "module m;\nendmodule\n"
+    doc = apply_edits(
+        doc,
+        [TextEdit(9, 9, "\n  wire a;"), TextEdit(0, 6, "module")],
+    )
+    assert doc == "module m;\n  wire a;\nendmodule\n"
+    with pytest.raises(ValueError):
+        apply_edits(doc, [TextEdit(5, 500, "")])
+
+
+def test_sync_document_with_edits() -> None:
+    store = ConversationStore(backend=None)
+    v0 = store.create("c", document="module m;\nendmodule\n").version
+
+    conversation = store.sync_document(
+        "c", edits=[TextEdit(9, 9, "\n  wire a;")], base_version=v0
+    )
+    v1 = conversation.version
+    assert v1 != v0
+    assert conversation.document == "module m;\n  wire a;\nendmodule\n"
+
+    # Edits against an old version are rejected
+    with pytest.raises(VersionMismatch) as exc:
+        store.sync_document("c", edits=[TextEdit(0, 0, "x")], base_version=v0)
+    assert exc.value.current == v1
+
+    # A full document always resyncs; unchanged documents keep their version
+    v2 = store.sync_document("c", document="module n;\n").version
+    assert v2 not in (v0, v1)
+    assert store.sync_document("c", document="module n;\n").version == v2
+
+    with pytest.raises(ConversationNotFound):
+        store.sync_document("other", document="")
+
+
+def test_store_expires_and_evicts() -> None:
+    store = ConversationStore(max_conversations=2, ttl_seconds=0, backend=None)
+    store.create("a")
+    assert store.get("a") is None
+
+    store = ConversationStore(max_conversations=2, backend=None)
+    store.create("a", messages=[{"role": "user", "content": "hi"}])
+    store.create("b")
+    store.create("c")
+    assert store.get("a") is None
+    store.append("b", [{"role": "user", "content": "hi"}])
+    b = store.get("b")
+    assert b and b.messages == [{"role": "user", "content": "hi"}]
+
+
+def test_workers_share_conversations(tmp_path: Path) -> None:
+    backend = SQLiteBackend(str(tmp_path / "cache.sqlite3"), max_bytes=10**7)
+    a, b = ConversationStore(backend=backend), ConversationStore(backend=backend)
+    a.create(
+        "c",
+        document="module m;\nendmodule\n",
+        messages=[{"role": "user", "content": "hi"}],
+    )
+    seen_by_b = b.get("c")
+    assert seen_by_b and seen_by_b.messages == [{"role": "user", "content": "hi"}]
+
+    # Worker b now holds an older copy; a's edits and turns reach it
+    v1 = a.sync_document("c", document="module m2;\nendmodule\n").version
+    a.append("c", [{"role": "assistant", "content": "hello"}])
+    assert b.history("c", budget=10**6)[-1] == {"role": "assistant", "content": "hello"}
+
+    # An edit made against a's document applies to it on b, and a sees the result
+    edited = b.sync_document("c", edits=[TextEdit(10, 10, " // x")], base_version=v1)
+    assert edited.document == "module m2; // x\nendmodule\n"
+    synced = a.get("c")
+    assert synced and synced.version == edited.version
+
+    # Versions never repeat, so an edit against another copy's version is rejected
+    other = ConversationStore(backend=None)
+    stale = other.create("c", document="module other;\n").version
+    with pytest.raises(VersionMismatch):
+        b.sync_document("c", edits=[TextEdit(0, 0, "x")], base_version=stale)
+
+
+def reply(code: str) -> dict[str, str]:
+    return {"role": "assistant", "content": f"Updated.\n\n```verilog\n{code}\n```"}
+
+
+def test_dedupe_code_blocks_keeps_latest_version() -> None:
+    v1 = "module m(input a, output y);\n  assign y = a;\nendmodule"
+    v2 = "module m(input a, output y);\n  assign y = ~a;\nendmodule"
+    other = "module n;\nendmodule"
+    messages = [
+        {"role": "user", "content": "invert"},
+        reply(v1),
+        {"role": "user", "content": "```verilog\n" + v1 + "\n```"},
+        reply(v2 + "\n```\n\n```verilog\n" + other),
+        reply(v2),
+    ]
+    deduped = dedupe_code_blocks(messages)
+    assert deduped[1]["content"] == f"Updated.\n\n{OMITTED_CODE}"
+    # User messages are left alone
+    assert deduped[2] is messages[2]
+    assert OMITTED_CODE in deduped[3]["content"]
+    assert "module n;" in deduped[3]["content"]
+    assert deduped[4] is messages[4]
+
+    # A reply identical to the current document is redundant as well
+    assert dedupe_code_blocks(messages, document=v2)[4]["content"] == (
+        f"Updated.\n\n{OMITTED_CODE}"
+    )
+
+
+def test_fit_history_keeps_summary_and_recent() -> None:
+    summary = {"role": "system", "content": SUMMARY_PREFIX + "Earlier stuff."}
+    turns = [{"role": "user", "content": f"question {i} " * 20} for i in range(10)]
+    per_turn = message_tokens(turns[:1])
+    fitted = fit_history([summary, *turns], message_tokens([summary]) + 3 * per_turn)
+    assert fitted == [summary, *turns[-3:]]
+
+
+def test_history_prefix_is_stable_until_it_outgrows_the_budget() -> None:
+    v1 = "module m(input a, output y);\n  assign y = a;\nendmodule"
+    v2 = "module m(input a, output y);\n  assign y = ~a;\nendmodule"
+    store = ConversationStore(backend=None)
+    store.create(
+        "c", document=v1, messages=[{"role": "user", "content": "write m"}, reply(v1)]
+    )
+    first = store.history("c", budget=10**6)
+    conversation = store.get("c")
+    assert conversation and first == conversation.messages
+
+    # The document changing does not rewrite earlier turns
+    store.sync_document("c", document=v2)
+    store.append("c", [{"role": "user", "content": "invert"}, reply(v2)])
+    second = store.history("c", budget=10**6)
+    assert second[: len(first)] == first
+    assert len(second) == 4
+
+    # Outgrowing the budget rebuilds it once: the copy of the document is elided
+    budget = message_tokens(second) - 1
+    third = store.history("c", budget=budget)
+    assert third[:3] == second[:3]
+    assert third[3]["content"] == f"Updated.\n\n{OMITTED_CODE}"
+    store.append("c", [{"role": "user", "content": "thanks"}])
+    assert store.history("c", budget=budget + 10)[: len(third)] == third
+
+
+def test_compact_summarizes_old_turns_in_background() -> None:
+    store = ConversationStore(backend=None)
+    messages = [
+        {"role": "user" if i % 2 == 0 else "assistant", "content": f"turn {i} " * 50}
+        for i in range(10)
+    ]
+    store.create("c", messages=messages)
+    summarized: list[list[dict[str, str]]] = []
+
+    def summarize(old: list[dict[str, str]]) -> str:
+        summarized.append(old)
+        return "They talked about turns."
+
+    assert store.compact("c", summarize, budget=10**6) is None
+    thread = store.compact("c", summarize, budget=100)
+    assert thread is not None
+    thread.join()
+
+    assert summarized == [messages[:-KEEP_RECENT_MESSAGES]]
+    conversation = store.get("c")
+    assert conversation is not None
+    assert conversation.messages[0] == {
+        "role": "system",
+        "content": SUMMARY_PREFIX + "They talked about turns.",
+    }
+    assert conversation.messages[1:] == messages[-KEEP_RECENT_MESSAGES:]
+    assert conversation.tokens == message_tokens(conversation.messages)
+    assert not conversation.summarizing
+
+
+def test_compact_failure_keeps_history() -> None:
+    store = ConversationStore(backend=None)
+    messages = [{"role": "user", "content": "x " * 100} for _ in range(10)]
+    store.create("c", messages=messages)
+
+    def summarize(_old: list[dict[str, str]]) -> str:
+        raise RuntimeError("provider down")
+
+    thread = store.compact("c", summarize, budget=10)
+    assert thread is not None
+    thread.join()
+    conversation = store.get("c")
+    assert conversation is not None
+    assert conversation.messages == messages
+    assert not conversation.summarizing
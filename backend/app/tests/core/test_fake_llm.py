@@ -0,0 +1,153 @@
+from collections.abc import Iterator
+from typing import Any
+
+import pytest
+import requests
+
+from app.core import llm, llm_router
+from app.core.config import settings
+from app.core.llm import LocalLLM
+from app.core.llm_router import (
+    LLMRequest,
+    LocalProvider,
+    OpenAIProvider,
+    Router,
+    VertexCodestralProvider,
+)
+from app.core.prompts import PromptCacheStats
+from benchmarks.fake_llm import RESPONSES, FakeLLMConfig, FakeLLMServer
+
+
+def start(**config: Any) -> FakeLLMServer:
+    return FakeLLMServer(
+        config=FakeLLMConfig(ttft_ms=0, inter_token_ms=0, **config)
+    ).start()
+
+
+@pytest.fixture
+def fake(monkeypatch: pytest.MonkeyPatch) -> Iterator[FakeLLMServer]:
+    server = start()
+    monkeypatch.setattr(settings, "OPENAI_API_KEY", "fake")
+    monkeypatch.setattr(settings, "OPENAI_BASE_URL", f"{server.url}/v1")
+    monkeypatch.setattr(settings, "VERTEX_BASE_URL", server.url)
+    monkeypatch.setattr(settings, "VERTEX_ACCESS_TOKEN", "fake")
+    monkeypatch.setattr(llm, "_openai_client", None)
+    monkeypatch.setattr(settings, "LLM_ROUTING", "ordered")
+    yield server
+    server.stop()
+
+
+def completion() -> LLMRequest:
+    return LLMRequest(
+        request_class="completion",
+        prompt="module counter(input clk, input rst_n, input en, output reg [7:0] count);\n",
+        suffix="\nendmodule\n",
+        messages=[{"role": "user", "content": "module counter("}],
+        max_tokens=100,
+    )
+
+
+def chat() -> LLMRequest:
+    return LLMRequest(
+        request_class="chat",
+        messages=[
+            {"role": "system", "content": "You are a Verilog assistant."},
+            {"role": "user", "content": "Add an enable input"},
+        ],
+        max_tokens=500,
+    )
+
+
+def test_openai_stream(fake: FakeLLMServer) -> None:
+    assert "".join(OpenAIProvider().stream(chat())) == RESPONSES["chat"]
+    path, payload, _ = fake.requests[-1]
+    assert path == "/v1/chat/completions"
+    assert payload["stream"] and payload["model"] == settings.OPENAI_MODEL
+
+
+def test_openai_complete_n(fake: FakeLLMServer) -> None:
+    assert OpenAIProvider().complete_n(chat(), 3) == [RESPONSES["chat"]] * 3
+
+
+def test_vertex_fim_stream(
+    fake: FakeLLMServer, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    stats = PromptCacheStats()
+    monkeypatch.setattr(llm_router, "prompt_cache", stats)
+    assert (
+        "".join(VertexCodestralProvider().stream(completion()))
+        == RESPONSES["completion"]
+    )
+    usage = stats.snapshot()["vertex:completion"]
+    assert usage["requests"] == 1
+    assert usage["prompt_tokens"] > 0 and usage["cached_tokens"] == 0
+    path, payload, headers = fake.requests[-1]
+    assert path.endswith(f"/models/{settings.VERTEX_CODESTRAL_MODEL}:streamRawPredict")
+    assert payload["prompt"].startswith("<fim_prefix>")
+    assert headers["Authorization"] == "Bearer fake"
+
+
+def test_local_infill_stream(fake: FakeLLMServer) -> None:
+    local = LocalLLM(fake.url, server="llamacpp")
+    text = "".join(local.stream_fim("module m(", "endmodule", max_tokens=100))
+    assert text == RESPONSES["completion"]
+    assert fake.requests[-1][0] == "/infill"
+
+
+def test_chunk_size() -> None:
+    server = start(chunk_tokens=4)
+    try:
+        chunks = list(
+            LocalLLM(server.url, server="llamacpp").stream_fim(
+                "module m(", "", max_tokens=100
+            )
+        )
+    finally:
+        server.stop()
+    assert "".join(chunks) == RESPONSES["completion"]
+    assert len(chunks) < len(RESPONSES["completion"].split())
+
+
+def test_injected_errors_fail_over(
+    fake: FakeLLMServer, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    failing = start(error_rate=1.0, error_status=429)
+    monkeypatch.setattr(settings, "VERTEX_BASE_URL", failing.url)
+    monkeypatch.setattr(settings, "LLM_COMPLETION_PROVIDERS", ["vertex", "local"])
+    monkeypatch.setattr(
+        "app.core.llm_router.local_llm", LocalLLM(fake.url, server="llamacpp")
+    )
+    router = Router([VertexCodestralProvider(), LocalProvider()])
+    try:
+        assert "".join(router.stream(completion())) == RESPONSES["completion"]
+    finally:
+        failing.stop()
+    # Retry-After sets the cooldown
+    assert router.stats["vertex"].cooling_down()
+
+
+def test_dropped_stream_raises() -> None:
+    server = start(drop_rate=1.0, drop_after_tokens=3)
+    try:
+        with pytest.raises(requests.exceptions.ChunkedEncodingError):
+            list(
+                LocalLLM(server.url, server="llamacpp").stream_fim(
+                    "module m(", "", max_tokens=100
+                )
+            )
+    finally:
+        server.stop()
+
+
+def test_failures_are_seeded() -> None:
+    def draws(seed: int) -> list[str | None]:
+        server = FakeLLMServer(
+            config=FakeLLMConfig(error_rate=0.3, drop_rate=0.3, seed=seed)
+        )
+        try:
+            return [server.draw_failure() for _ in range(20)]
+        finally:
+            server.server_close()
+
+    assert draws(1) == draws(1)
+    assert {"error", "drop", None} <= set(draws(1))
@@ -0,0 +1,51 @@
+import subprocess
+import sys
+
+# Heavy or optional packages that must only be imported on first use, so
+# that no worker pays for them at boot
+LAZY_MODULES = [
+    "torch",
+    "transformers",
+    "accelerate",
+    "google.auth",
+    "google.cloud",
+    "openai",
+    "ollama",
+    "tiktoken",
+    "sentry_sdk",
+    "emails",
+    "opentelemetry.sdk",
+    "redis",
+]
+
+# Generous, to stay reliable on slow CI machines; it catches a new eager
+# import of something the size of torch
+IMPORT_BUDGET_SECONDS = 5.0
+
+
+def import_times(module: str) -> dict[str, int]:
+    """Cumulative import time in microseconds of every module ``import module`` loads."""
+    cp = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in cp.stderr.splitlines():
+        _, _, fields = line.partition("import time:")
+        _, cumulative, name = (f.strip() for f in fields.split("|"))
+        if cumulative.isdigit():
+            times[name] = int(cumulative)
+    return times
+
+
+def test_app_import_is_lean() -> None:
+    times = import_times("app.main")
+    eager = [
+        m
+        for m in LAZY_MODULES
+        if any(name == m or name.startswith(f"{m}.") for name in times)
+    ]
+    assert not eager, f"imported at startup: {eager}"
+    assert times["app.main"] < IMPORT_BUDGET_SECONDS * 1_000_000
@@ -0,0 +1,59 @@
+import os
+from pathlib import Path
+
+import pytest
+
+from app.core import iverilog
+
+requires_iverilog = pytest.mark.skipif(
+    not iverilog.available(), reason="iverilog is not installed"
+)
+
+DUT = "module inv(input a, output y);\n  assign y = ~a;\nendmodule\n"
+
+
+@requires_iverilog
+def test_check_testbench() -> None:
+    assert iverilog.check_dut(DUT).ok
+    ok = iverilog.check_testbench(
+        DUT, "module tb;\n  reg a; wire y;\n  inv dut(.a(a), .y(y));\nendmodule\n"
+    )
+    assert ok.ok
+
+    broken = iverilog.check_testbench(
+        DUT, "module tb;\n  inv dut(.a(nope), .y(y));\nendmodule\n"
+    )
+    assert not broken.ok
+    assert "tb.v" in broken.errors
+    assert "/tmp" not in broken.errors
+
+
+@requires_iverilog
+def test_check_dut_reports_errors() -> None:
+    result = iverilog.check_dut("module broken(\nendmodule\n")
+    assert not result.ok
+    assert "module.v" in result.errors
+
+
+def test_dut_cache_sweeps_unused_entries(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(iverilog, "_DUT_CACHE", tmp_path)
+    monkeypatch.setattr(iverilog, "_last_sweep", float("-inf"))
+    stale = iverilog._dut_path("module stale;\nendmodule\n")
+    used = iverilog._dut_path(DUT)
+    old = stale.stat().st_mtime - iverilog.DUT_CACHE_MAX_AGE_SECONDS - 1
+    os.utime(stale, (old, old))
+    os.utime(used, (old, old))
+    # A hit marks the entry as used
+    assert iverilog._dut_path(DUT) == used
+
+    # Sweeps run at most once per interval
+    iverilog._dut_path("module fresh;\nendmodule\n")
+    assert stale.exists()
+
+    monkeypatch.setattr(iverilog, "_last_sweep", float("-inf"))
+    iverilog._dut_path("module newer;\nendmodule\n")
+    assert not stale.parent.exists()
+    assert used.read_text() == DUT
+    assert len(list(tmp_path.iterdir())) == 3
@@ -0,0 +1,229 @@
+import json
+import threading
+import time
+from collections.abc import Generator, Iterator
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any
+
+import pytest
+
+from app.core.cache import SQLiteBackend
+from app.core.llm import (
+    CompletionSessions,
+    CompletionSuperseded,
+    LocalLLM,
+    SingleFlight,
+    cancellable,
+    completion_sessions,
+    request_key,
+)
+
+
+def test_request_key_ignores_key_order() -> None:
+    assert request_key({"a": 1, "b": [1, 2]}) == request_key({"b": [1, 2], "a": 1})
+    assert request_key({"a": 1}) != request_key({"a": 2})
+
+
+def test_singleflight_do_coalesces_concurrent_calls() -> None:
+    flight = SingleFlight()
+    calls = 0
+    release = threading.Event()
+
+    def upstream() -> str:
+        nonlocal calls
+        calls += 1
+        release.wait(timeout=5)
+        return "module tb; endmodule"
+
+    results: list[str] = []
+    threads = [
+        threading.Thread(target=lambda: results.append(flight.do("k", upstream)))
+        for _ in range(5)
+    ]
+    for t in threads:
+        t.start()
+    time.sleep(0.1)
+    release.set()
+    for t in threads:
+        t.join(timeout=5)
+
+    assert calls == 1
+    assert results == ["module tb; endmodule"] * 5
+    assert flight.in_flight() == 0
+
+
+def test_singleflight_do_propagates_errors() -> None:
+    flight = SingleFlight()
+
+    def upstream() -> str:
+        raise RuntimeError("429 Too Many Requests")
+
+    with pytest.raises(RuntimeError):
+        flight.do("k", upstream)
+    assert flight.in_flight() == 0
+
+
+def test_singleflight_stream_fans_out_chunks() -> None:
+    flight = SingleFlight()
+    calls = 0
+    release = threading.Event()
+
+    def upstream() -> Iterator[str]:
+        nonlocal calls
+        calls += 1
+        yield "always "
+        release.wait(timeout=5)
+        yield "@(posedge clk)"
+
+    first = flight.stream("k", upstream)
+    assert next(first) == "always "
+    # A late subscriber replays what was already produced
+    second = flight.stream("k", upstream)
+    release.set()
+
+    assert "".join(second) == "always @(posedge clk)"
+    assert "".join(first) == "@(posedge clk)"
+    assert calls == 1
+
+
+def test_completion_sessions_cancel_superseded_request() -> None:
+    sessions = CompletionSessions(backend=None)
+    first = sessions.begin("doc-1", 1)
+    assert not first.is_set()
+
+    second = sessions.begin("doc-1", 2)
+    assert first.is_set()
+    assert not second.is_set()
+
+    # A request that arrives after a newer one is rejected immediately
+    stale = sessions.begin("doc-1", 1)
+    assert stale.is_set()
+    # Other sessions are unaffected
+    assert not sessions.begin("doc-2", 1).is_set()
+
+
+def test_completion_sessions_cancel_across_workers(tmp_path: Path) -> None:
+    # Two workers sharing one cache tier
+    shared = SQLiteBackend(str(tmp_path / "cache.sqlite3"), max_bytes=2**20)
+    worker_a = CompletionSessions(backend=shared)
+    worker_b = CompletionSessions(backend=shared)
+    worker_a.CHECK_INTERVAL_SECONDS = worker_b.CHECK_INTERVAL_SECONDS = 0
+
+    first = worker_a.begin("doc-1", 1)
+    assert not first.is_set()
+    second = worker_b.begin("doc-1", 2)
+    assert not second.is_set()
+    assert first.is_set()
+    # A stale request reaching the other worker is rejected as well
+    assert worker_a.begin("doc-1", 1).is_set()
+
+
+def test_cancellable_stops_upstream_and_records_saved_tokens() -> None:
+    cancel = threading.Event()
+    closed = False
+
+    def upstream() -> Iterator[str]:
+        nonlocal closed
+        try:
+            for _ in range(100):
+                yield "x"
+        finally:
+            closed = True
+
+    before = completion_sessions.stats()["saved_tokens"]
+    received = []
+    with pytest.raises(CompletionSuperseded):
+        for chunk in cancellable(upstream(), cancel, max_tokens=100):
+            received.append(chunk)
+            if len(received) == 3:
+                cancel.set()
+
+    assert len(received) == 3
+    assert closed
+    assert completion_sessions.stats()["saved_tokens"] - before == 97
+
+
+class _FakeOllama(BaseHTTPRequestHandler):
+    requests: list[dict[str, Any]] = []
+
+    def log_message(self, *_args: object) -> None:
+        pass
+
+    def do_GET(self) -> None:
+        body = json.dumps({"models": [{"name": "codeqwen:latest"}]}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self) -> None:
+        payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        _FakeOllama.requests.append(payload)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.end_headers()
+        if "prompt" not in payload and "messages" not in payload:
+            self.wfile.write(json.dumps({"done": True}).encode() + b"\n")
+            return
+        for part in ["assign ", "y = a & b;"]:
+            self.wfile.write(
+                json.dumps({"response": part, "done": False}).encode() + b"\n"
+            )
+        self.wfile.write(json.dumps({"response": "", "done": True}).encode() + b"\n")
+
+
+@pytest.fixture
+def fake_ollama() -> Generator[str, None, None]:
+    _FakeOllama.requests = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _FakeOllama)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+
+
+def test_local_llm_health_and_fim(fake_ollama: str) -> None:
+    llm = LocalLLM(fake_ollama, model="codeqwen", keep_alive="10m")
+    assert llm.healthy()
+    assert not LocalLLM(fake_ollama, model="starcoder").healthy()
+    assert not LocalLLM(None).healthy()
+
+    text = "".join(
+        llm.stream_fim("module and2(input a, b, output y);\n", "\nendmodule")
+    )
+    assert text == "assign y = a & b;"
+
+    sent = _FakeOllama.requests[-1]
+    assert sent["suffix"] == "\nendmodule"
+    assert sent["keep_alive"] == "10m"
+
+
+def test_local_llm_health_probe_does_not_block(monkeypatch: pytest.MonkeyPatch) -> None:
+    llm = LocalLLM("http://127.0.0.1:9", model="codeqwen")
+    started, release = threading.Event(), threading.Event()
+
+    def slow_probe() -> bool:
+        started.set()
+        release.wait(5)
+        return True
+
+    monkeypatch.setattr(llm, "_probe", slow_probe)
+    prober = threading.Thread(target=llm.healthy)
+    prober.start()
+    assert started.wait(5)
+    # Probe in flight: other callers get the last result without waiting
+    assert llm.healthy() is False
+    release.set()
+    prober.join(5)
+    assert llm.healthy() is True
+
+
+def test_local_llm_keepalive_pings_server(fake_ollama: str) -> None:
+    llm = LocalLLM(fake_ollama, model="codeqwen", keep_alive="10m")
+    llm.start_keepalive(interval=60)
+    deadline = time.monotonic() + 5
+    while not _FakeOllama.requests and time.monotonic() < deadline:
+        time.sleep(0.01)
+    llm.stop_keepalive()
+
+    assert _FakeOllama.requests[0] == {"model": "codeqwen", "keep_alive": "10m"}
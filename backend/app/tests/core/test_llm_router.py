@@ -0,0 +1,190 @@
+import threading
+import time
+from collections.abc import Iterator
+
+import pytest
+import requests
+
+from app.core.config import settings
+from app.core.llm import CompletionSuperseded
+from app.core.llm_router import (
+    LLMRequest,
+    NoProviderAvailable,
+    Provider,
+    Router,
+    is_retryable,
+)
+from app.core.prompts import completion_messages
+
+
+class FakeProvider(Provider):
+    def __init__(
+        self,
+        name: str,
+        chunks: list[str],
+        fail_after: int | None = None,
+        error: Exception | None = None,
+        delay: float = 0.0,
+    ) -> None:
+        self.name = name
+        self.chunks = chunks
+        self.fail_after = fail_after
+        self.error = error or requests.ConnectionError("connection reset")
+        self.delay = delay
+        self.requests: list[LLMRequest] = []
+
+    def stream(self, req: LLMRequest) -> Iterator[str]:
+        self.requests.append(req)
+        time.sleep(self.delay)
+        for i, chunk in enumerate(self.chunks):
+            if self.fail_after is not None and i == self.fail_after:
+                raise self.error
+            yield chunk
+        if self.fail_after is not None and self.fail_after >= len(self.chunks):
+            raise self.error
+
+
+def http_error(status: int) -> requests.HTTPError:
+    response = requests.Response()
+    response.status_code = status
+    return requests.HTTPError(response=response)
+
+
+@pytest.fixture(autouse=True)
+def routing(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "LLM_ROUTING", "ordered")
+    monkeypatch.setattr(settings, "LLM_COMPLETION_PROVIDERS", ["a", "b"])
+    monkeypatch.setattr(settings, "LLM_CHAT_PROVIDERS", ["a", "b"])
+
+
+def completion(prompt: str = "module m(") -> LLMRequest:
+    return LLMRequest(request_class="completion", prompt=prompt, max_tokens=50)
+
+
+def test_is_retryable() -> None:
+    assert is_retryable(http_error(429))
+    assert is_retryable(http_error(503))
+    assert not is_retryable(http_error(400))
+    assert is_retryable(requests.Timeout())
+    assert not is_retryable(ValueError())
+
+
+def test_fails_over_before_first_token() -> None:
+    a = FakeProvider("a", ["x"], fail_after=0, error=http_error(429))
+    b = FakeProvider("b", ["input clk", ");"])
+    router = Router([a, b])
+
+    assert "".join(router.stream(completion())) == "input clk);"
+    # The 429 puts the provider into cooldown
+    assert [p.name for p in router.candidates("completion")] == ["b"]
+
+
+def test_completion_continues_on_next_provider_mid_stream() -> None:
+    a = FakeProvider("a", ["input clk", ", input rst"], fail_after=1)
+    b = FakeProvider("b", [", input rst);"])
+    router = Router([a, b])
+
+    assert "".join(router.stream(completion("module m("))) == "input clk, input rst);"
+    assert b.requests[0].prompt == "module m(input clk"
+
+
+def test_completion_continues_before_the_suffix() -> None:
+    a = FakeProvider("a", ["input clk", ", input rst"], fail_after=1)
+    b = FakeProvider("b", [", input rst);"])
+    req = LLMRequest(
+        request_class="completion",
+        messages=completion_messages("module m(", "\nendmodule"),
+        prompt="module m(",
+        suffix="\nendmodule",
+        max_tokens=50,
+    )
+
+    assert "".join(Router([a, b]).stream(req)) == "input clk, input rst);"
+    assert b.requests[0].messages == completion_messages(
+        "module m(input clk", "\nendmodule"
+    )
+    assert b.requests[0].suffix == "\nendmodule"
+
+
+def test_chat_does_not_resume_mid_stream() -> None:
+    a = FakeProvider("a", ["Hello", " world"], fail_after=1)
+    router = Router([a, FakeProvider("b", ["Hi"])])
+    req = LLMRequest(request_class="chat", messages=[{"role": "user", "content": "hi"}])
+
+    with pytest.raises(requests.ConnectionError):
+        "".join(router.stream(req))
+
+
+def test_non_retryable_errors_are_raised() -> None:
+    router = Router([FakeProvider("a", ["x"], fail_after=0, error=http_error(400))])
+
+    with pytest.raises(requests.HTTPError):
+        "".join(router.stream(completion()))
+
+
+def test_all_providers_failing_raises() -> None:
+    router = Router(
+        [FakeProvider("a", [], fail_after=0), FakeProvider("b", [], fail_after=0)]
+    )
+
+    with pytest.raises(NoProviderAvailable):
+        "".join(router.stream(completion()))
+
+
+def test_latency_routing_prefers_fastest(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "LLM_ROUTING", "latency")
+    router = Router([FakeProvider("a", ["x"]), FakeProvider("b", ["y"])])
+    for _ in range(5):
+        router.stats["a"].record_success(0.8)
+        router.stats["b"].record_success(0.1)
+
+    assert [p.name for p in router.candidates("completion")] == ["b", "a"]
+    assert router.snapshot()["b"]["ttft_p50"] == pytest.approx(0.1)
+
+
+def test_hedged_request_uses_faster_provider(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "LLM_HEDGE_DELAY_MS", 20)
+    slow = FakeProvider("a", ["slow"], delay=1.0)
+    fast = FakeProvider("b", ["fast"])
+    router = Router([slow, fast])
+
+    started = time.monotonic()
+    assert "".join(router.stream(completion(), hedge=True)) == "fast"
+    assert time.monotonic() - started < 0.9
+
+
+def test_complete_n_runs_parallel_streams() -> None:
+    a = FakeProvider("a", ["input clk", ");"])
+    router = Router([a])
+
+    assert router.complete_n(completion(), 3) == ["input clk);"] * 3
+    assert sorted(r.temperature for r in a.requests) == pytest.approx([0.6, 0.75, 0.9])
+
+
+def test_complete_n_uses_native_choices() -> None:
+    class ChoicesProvider(FakeProvider):
+        supports_n = True
+
+        def complete_n(
+            self,
+            req: LLMRequest,
+            n: int,
+            cancel: threading.Event | None = None,  # noqa: ARG002
+        ) -> list[str]:
+            self.requests.append(req)
+            return [f"choice {i}" for i in range(n)]
+
+    a = ChoicesProvider("a", [])
+    router = Router([a, FakeProvider("b", ["x"])])
+
+    assert router.complete_n(completion(), 2) == ["choice 0", "choice 1"]
+    assert len(a.requests) == 1
+
+
+def test_complete_n_stops_when_superseded() -> None:
+    a = FakeProvider("a", ["input clk", ");"])
+    cancel = threading.Event()
+    cancel.set()
+
+    with pytest.raises(CompletionSuperseded):
+        Router([a]).complete_n(completion(), 3, cancel)
@@ -0,0 +1,92 @@
+import subprocess
+import sys
+import threading
+from collections.abc import Iterator
+from http.server import ThreadingHTTPServer
+from types import SimpleNamespace
+
+import pytest
+
+from app.core.llm import LocalLLM
+from app.core.local_engine import (
+    Engine,
+    EngineConfig,
+    PrefixCache,
+    _Job,
+    _make_handler,
+    _truncate_at_stop,
+    stop_local_engine,
+)
+
+
+def test_prefix_cache_returns_longest_cached_prefix() -> None:
+    cache = PrefixCache(capacity=2)
+    cache.store([1, 2], "kv-12", "logits-12")
+    cache.store([1, 2, 3, 4], "kv-1234", "logits-1234")
+
+    assert cache.lookup([1, 2, 3, 4, 5]) == (4, "kv-1234", "logits-1234")
+    assert cache.lookup([1, 2, 9]) == (2, "kv-12", "logits-12")
+    assert cache.lookup([7]) == (0, None, None)
+
+
+def test_prefix_cache_evicts_least_recently_used() -> None:
+    cache = PrefixCache(capacity=2)
+    cache.store([1], "a", None)
+    cache.store([2], "b", None)
+    cache.lookup([1])
+    cache.store([3], "c", None)
+
+    assert cache.lookup([2])[1] is None
+    assert cache.lookup([1])[1] == "a"
+
+
+def test_next_batch_collects_requests_within_window() -> None:
+    engine = Engine(
+        EngineConfig(model_path="unused", max_batch_size=2, batch_window_ms=50)
+    )
+    for prompt in ["a", "b", "c"]:
+        engine.submit(prompt, max_tokens=8, temperature=0.0, stop=[])
+
+    assert [j.prompt for j in engine._next_batch()] == ["a", "b"]
+    assert [j.prompt for j in engine._next_batch()] == ["c"]
+
+
+def test_truncate_at_stop() -> None:
+    assert _truncate_at_stop("a <= b;\nendmodule\nfoo", ["endmodule"]) == "a <= b;\n"
+    assert _truncate_at_stop("a <= b;", ["\n\n\n"]) == "a <= b;"
+
+
+class EchoEngine(Engine):
+    """Completes every prompt with its own tail, without a model."""
+
+    def _generate_one(self, job: _Job) -> str:
+        return f"<{job.prompt[-12:]}>"
+
+    def _generate_batch(self, jobs: list[_Job]) -> list[str]:
+        return [self._generate_one(job) for job in jobs]
+
+
+@pytest.fixture
+def engine_url() -> Iterator[str]:
+    engine = EchoEngine(EngineConfig(model_path="unused", batch_window_ms=0))
+    engine.model, engine.tokenizer = object(), SimpleNamespace()
+    threading.Thread(target=engine.run_forever, daemon=True).start()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _make_handler(engine))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+
+
+def test_engine_serves_infill_and_chat(engine_url: str) -> None:
+    llm = LocalLLM(engine_url, server="llamacpp", model="unused")
+    assert llm.healthy()
+    assert "".join(llm.stream_fim("module m(", ");")) == "<<fim_middle>>"
+    messages = [{"role": "user", "content": "Explain this"}]
+    assert "".join(llm.stream_chat(messages)) == "<\nassistant: >"
+
+
+def test_stop_local_engine_reaps_the_process() -> None:
+    process = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(60)"])
+    stop_local_engine(process)
+    assert process.returncode is not None
+    stop_local_engine(None)
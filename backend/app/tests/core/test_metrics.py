@@ -0,0 +1,38 @@
+import pytest
+from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY
+
+from app.core.config import settings
+from app.core.llm_router import LLMRequest, Router
+from app.tests.core.test_llm_router import FakeProvider
+
+
+def sample(name: str, **labels: str) -> float:
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+def test_request_latency_per_route(client: TestClient) -> None:
+    labels = {
+        "method": "GET",
+        "route": f"{settings.API_V1_STR}/utils/health-check/",
+        "status": "200",
+    }
+    before = sample("http_request_duration_seconds_count", **labels)
+    client.get(f"{settings.API_V1_STR}/utils/health-check/")
+
+    assert sample("http_request_duration_seconds_count", **labels) == before + 1
+    r = client.get("/metrics")
+    assert r.status_code == 200
+    assert 'route="/api/v1/utils/health-check/"' in r.text
+
+
+def test_llm_stream_metrics(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "LLM_ROUTING", "ordered")
+    monkeypatch.setattr(settings, "LLM_CHAT_PROVIDERS", ["metered"])
+    labels = {"provider": "metered", "request_class": "chat"}
+    router = Router([FakeProvider("metered", ["hello", " world", "!"])])
+
+    assert "".join(router.stream(LLMRequest(request_class="chat"))) == "hello world!"
+    assert sample("llm_time_to_first_token_seconds_count", **labels) == 1
+    assert sample("llm_completion_tokens_total", **labels) >= 3
+    assert sample("llm_requests_in_flight", provider="metered") == 0
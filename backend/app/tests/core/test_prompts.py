@@ -0,0 +1,88 @@
+from types import SimpleNamespace
+from typing import Any
+
+import pytest
+
+from app.core import llm_router, prompts
+from app.core.prompts import (
+    AGENTIC_SYSTEM_PROMPT,
+    PromptCacheStats,
+    chat_messages,
+    completion_messages,
+    editor_context,
+)
+
+
+def test_chat_prefix_is_stable_across_turns() -> None:
+    turn1 = [{"role": "user", "content": "add a reset"}]
+    reply = [{"role": "assistant", "content": "done"}]
+    first = chat_messages(True, [], turn1, editor_context(document="module a;"))
+    second = chat_messages(
+        True,
+        turn1 + reply,
+        [{"role": "user", "content": "thanks"}],
+        editor_context(document="module b;"),
+    )
+    assert first[0] == {"role": "system", "content": AGENTIC_SYSTEM_PROMPT}
+    # Everything but the editor context and the new message is a shared prefix
+    assert second[: len(first) - 1] == [first[0], *turn1]
+    assert "module b;" in second[-2]["content"]
+
+
+def test_templates_leave_code_untouched() -> None:
+    code = "assign y = {a, b}; // $x ${y}"
+    assert prompts.testbench_messages(code)[1]["content"].endswith(code)
+    user = completion_messages(code, "\nendmodule")[1]["content"]
+    assert user.endswith(f"{code}<CURSOR>\nendmodule")
+    assert completion_messages(code, "")[1]["content"].endswith(code)
+
+
+def test_prompt_cache_stats() -> None:
+    stats = PromptCacheStats()
+    stats.record("openai", "chat", 2000, 1536)
+    stats.record("openai", "chat", 2000, 0)
+    assert stats.snapshot() == {
+        "openai:chat": {
+            "requests": 2,
+            "prompt_tokens": 4000,
+            "cached_tokens": 1536,
+            "hit_ratio": 0.384,
+        }
+    }
+
+
+def test_openai_provider_records_cached_tokens(monkeypatch: pytest.MonkeyPatch) -> None:
+    def chunk(content: str | None, usage: Any = None) -> Any:
+        choices = (
+            [SimpleNamespace(delta=SimpleNamespace(content=content))] if content else []
+        )
+        return SimpleNamespace(choices=choices, usage=usage)
+
+    class FakeStream(list):  # type: ignore[type-arg]
+        def close(self) -> None:
+            pass
+
+    created: list[dict[str, Any]] = []
+
+    def create(**params: Any) -> FakeStream:
+        created.append(params)
+        usage = SimpleNamespace(
+            prompt_tokens=1200,
+            prompt_tokens_details=SimpleNamespace(cached_tokens=1024),
+        )
+        return FakeStream([chunk("mod"), chunk("ule"), chunk(None, usage)])
+
+    client = SimpleNamespace(
+        chat=SimpleNamespace(completions=SimpleNamespace(create=create))
+    )
+    monkeypatch.setattr(llm_router, "get_openai_client", lambda: client)
+    stats = PromptCacheStats()
+    monkeypatch.setattr(llm_router, "prompt_cache", stats)
+
+    req = llm_router.LLMRequest(
+        request_class="testbench", messages=prompts.testbench_messages("x")
+    )
+    assert "".join(llm_router.OpenAIProvider().stream(req)) == "module"
+    assert created[0]["stream_options"] == {"include_usage": True}
+    assert stats.snapshot()["openai:testbench"]["cached_tokens"] == 1024
+    assert prompts.prompt_cache is not stats
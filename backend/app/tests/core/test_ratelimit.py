@@ -0,0 +1,53 @@
+import pytest
+from fastapi import HTTPException
+
+from app.core.ratelimit import InMemoryBackend, LLMBudget, RateLimiter
+
+
+def test_bucket_allows_burst_then_reports_retry_after() -> None:
+    limiter = RateLimiter(InMemoryBackend())
+    for _ in range(3):
+        limiter.check_request("ip:1.2.3.4", rpm=3)
+
+    with pytest.raises(HTTPException) as exc:
+        limiter.check_request("ip:1.2.3.4", rpm=3)
+    assert exc.value.status_code == 429
+    assert exc.value.headers is not None
+    assert 1 <= int(exc.value.headers["Retry-After"]) <= 20
+
+    # Buckets are per identity
+    limiter.check_request("ip:5.6.7.8", rpm=3)
+
+
+def test_budget_refunds_unused_tokens() -> None:
+    limiter = RateLimiter(InMemoryBackend())
+    budget = LLMBudget(limiter, "user:1", tpm=1000)
+    budget.charge("x" * 40, max_tokens=800)
+
+    with pytest.raises(HTTPException):
+        LLMBudget(limiter, "user:1", tpm=1000).charge("x" * 40, max_tokens=800)
+
+    # Only a short completion came back, so most of the charge is returned
+    budget.settle("x" * 40, "assign y = a;")
+    LLMBudget(limiter, "user:1", tpm=1000).charge("x" * 40, max_tokens=800)
+
+
+def test_oversized_request_drains_bucket_instead_of_failing_forever() -> None:
+    limiter = RateLimiter(InMemoryBackend())
+    LLMBudget(limiter, "user:1", tpm=100).charge("x" * 4000, max_tokens=2000)
+
+    with pytest.raises(HTTPException):
+        LLMBudget(limiter, "user:1", tpm=100).charge("x", max_tokens=10)
+
+
+def test_settle_refunds_only_what_was_taken() -> None:
+    limiter = RateLimiter(InMemoryBackend())
+    budget = LLMBudget(limiter, "user:1", tpm=100)
+    # Estimated far above the capacity: only the 100 tokens of the bucket are taken
+    budget.charge("x" * 4000, max_tokens=2000)
+    assert budget.charged == 100
+    budget.settle("x" * 40, "")
+    assert budget.charged == 12
+    # The refund did not refill the bucket past what it held
+    with pytest.raises(HTTPException):
+        LLMBudget(limiter, "user:1", tpm=100).charge("x" * 40, max_tokens=80)
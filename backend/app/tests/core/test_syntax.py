@@ -0,0 +1,48 @@
+from app.core.syntax import check_completion, missing_closers, rank_completions, scan
+
+PREFIX = "module m(input clk, input d, output reg q);\n  always @(posedge clk) begin\n"
+
+
+def test_scan_tracks_nesting() -> None:
+    result = scan("module m; always begin case (x) 1: y = 0; endcase")
+    assert result.open == ["module", "begin"]
+    assert not result.stray and not result.mismatched
+
+    # Comments and strings are skipped, wait fork is not a block
+    result = scan('// begin\n/* module */ $display("end"); wait fork;')
+    assert result.open == [] and result.stray == []
+
+
+def test_scan_mismatched_and_stray() -> None:
+    result = scan("module m; begin endmodule end")
+    assert result.mismatched == 1
+    assert result.unclosed == ["begin"]
+    assert result.stray == ["end"]
+
+
+def test_missing_closers() -> None:
+    assert missing_closers(PREFIX, "    q <= d;") == ["end", "endmodule"]
+    # The suffix already closes what the prefix opened
+    assert missing_closers(PREFIX, "    q <= d;", "\n  end\nendmodule") == []
+    # But not what the completion opened
+    assert missing_closers(
+        PREFIX, "    if (d) begin q <= d;", "\n  end\nendmodule"
+    ) == ["end"]
+
+
+def test_check_completion() -> None:
+    assert check_completion(PREFIX, "    q <= d;\n  end\nendmodule").issues == 0
+    assert check_completion(PREFIX, "    q <= d;", "\n  end\nendmodule").issues == 0
+    assert "unclosed begin" in check_completion(PREFIX, "    begin q <= d;").details
+    assert check_completion(PREFIX, "```verilog\nq <= d;\n```").issues > 0
+    assert check_completion(PREFIX, '    $display("q;').issues > 0
+    assert check_completion(PREFIX, "  ").details == ("empty",)
+
+
+def test_rank_completions() -> None:
+    good = "    q <= d;\n  end\nendmodule"
+    bad = "    begin q <= d;\n  end\nendmodule"
+    other = "    q <= ~d;\n  end\nendmodule"
+    ranked = rank_completions(PREFIX, [bad, other, good, good, ""])
+    # Fewest issues first, then votes, then original order
+    assert ranked == [good, other, bad]
@@ -0,0 +1,91 @@
+from app.core.testbench import (
+    STIMULUS_MARKER,
+    StimulusIndenter,
+    build_skeleton,
+    indent_stimulus,
+    reset_active_low,
+)
+
+COUNTER = """module counter #(parameter WIDTH = 8) (
+    input  wire             clk,
+    input  wire             rst_n,
+    input  wire             en,
+    output reg [WIDTH-1:0]  count
+);
+endmodule
+"""
+
+TOP = (
+    COUNTER
+    + """
+module top(input clock, input reset, output [7:0] q);
+    counter #(.WIDTH(8)) u0 (.clk(clock), .rst_n(~reset), .en(1'b1), .count(q));
+endmodule
+"""
+)
+
+
+def test_skeleton_for_clocked_module() -> None:
+    skeleton = build_skeleton(COUNTER)
+    assert skeleton is not None
+    assert skeleton.tb_name == "counter_tb"
+    assert (skeleton.clock, skeleton.reset) == ("clk", "rst_n")
+    text = skeleton.text
+    assert "  localparam WIDTH = 8;" in text
+    assert "  reg clk;" in text
+    assert "  wire [WIDTH-1:0] count;" in text
+    assert "  counter #(.WIDTH(WIDTH)) dut (" in text
+    assert ".count(count)\n  );" in text
+    assert "forever #5 clk = ~clk;" in text
+    assert "$dumpvars(0, counter_tb);" in text
+    assert (
+        "    en = 0;\n    rst_n = 0;\n    repeat (2) @(posedge clk);\n    rst_n = 1;"
+        in text
+    )
+    assert text.index(STIMULUS_MARKER) < text.index("$finish;")
+
+
+def test_skeleton_picks_top_module() -> None:
+    skeleton = build_skeleton(TOP)
+    assert skeleton is not None
+    assert skeleton.module.name == "top"
+    assert (skeleton.clock, skeleton.reset) == ("clock", "reset")
+    assert (
+        "    reset = 1;\n    repeat (2) @(posedge clock);\n    reset = 0;"
+        in skeleton.text
+    )
+
+
+def test_skeleton_without_ports() -> None:
+    assert build_skeleton("module empty;\nendmodule") is None
+    assert build_skeleton("no verilog here") is None
+
+
+def test_fill_indents_stimulus() -> None:
+    skeleton = build_skeleton("module inv(input a, output y);\nendmodule")
+    assert skeleton is not None
+    filled = skeleton.fill("a = 1;\n#10;\n")
+    assert STIMULUS_MARKER not in filled
+    assert "    a = 1;\n    #10;\n\n    #50;" in filled
+
+
+def test_stimulus_indenter_matches_indent_stimulus() -> None:
+    text = "a = 1;\n\n  #10;\n$display(y);"
+    for size in range(1, len(text) + 1):
+        indenter = StimulusIndenter()
+        out = "".join(
+            indenter.feed(text[i : i + size]) for i in range(0, len(text), size)
+        )
+        assert out == indent_stimulus(text)
+
+
+def test_reset_polarity() -> None:
+    assert reset_active_low("rst_n")
+    assert reset_active_low("resetn")
+    assert reset_active_low("nrst")
+    assert reset_active_low("rst_ni")
+    assert reset_active_low("n_reset")
+    assert not reset_active_low("rst")
+    assert not reset_active_low("reset")
+    assert not reset_active_low("reset_in")
+    assert not reset_active_low("rst_sync_en")
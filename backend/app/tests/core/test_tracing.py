@@ -0,0 +1,105 @@
+from collections.abc import Generator, Iterator
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.core import tracing
+from app.core.config import settings
+from app.core.llm_router import LLMRequest, Provider, Router
+from app.main import app
+
+pytest.importorskip("opentelemetry.sdk")
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import (  # noqa: E402
+    InMemorySpanExporter,
+)
+
+
+@pytest.fixture
+def exporter(
+    monkeypatch: pytest.MonkeyPatch,
+) -> Generator[InMemorySpanExporter, None, None]:
+    monkeypatch.setattr(tracing, "_provider", None)
+    monkeypatch.setattr(tracing, "_tracer", None)
+    exporter = InMemorySpanExporter()
+    assert tracing.configure_tracing(exporter)
+    yield exporter
+    tracing.shutdown_tracing()
+
+
+class HeaderProvider(Provider):
+    """Records the trace headers it would send upstream."""
+
+    name = "traced"
+
+    def __init__(self) -> None:
+        self.headers: list[dict[str, str]] = []
+
+    def stream(self, req: LLMRequest) -> Iterator[str]:  # noqa: ARG002
+        with tracing.span("token"):
+            pass
+        self.headers.append(tracing.inject({}))
+        yield "module"
+        yield " m;"
+
+
+def names(exporter: InMemorySpanExporter) -> list[str]:
+    return [s.name for s in exporter.get_finished_spans()]
+
+
+def test_disabled_tracing_is_a_no_op() -> None:
+    with tracing.span("nothing") as span:
+        assert span is None
+    assert tracing.inject({}) == {}
+    assert list(tracing.traced_stream("s", lambda: iter("ab"))) == ["a", "b"]
+
+
+def test_llm_stream_span(
+    exporter: InMemorySpanExporter, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(settings, "LLM_CHAT_PROVIDERS", ["traced"])
+    provider = HeaderProvider()
+    router = Router([provider])
+
+    with tracing.span("request") as parent:
+        assert "".join(router.stream(LLMRequest(request_class="chat"))) == "module m;"
+
+    spans = {s.name: s for s in exporter.get_finished_spans()}
+    stream, token = spans["llm.stream"], spans["token"]
+    assert stream.parent is not None and token.parent is not None
+    assert stream.attributes is not None
+    assert stream.parent.span_id == parent.get_span_context().span_id
+    assert token.parent.span_id == stream.context.span_id
+    assert stream.attributes["llm.provider"] == "traced"
+    assert stream.attributes["stream.items"] == 2
+    assert [e.name for e in stream.events] == ["first_item"]
+    # The upstream call continues the stream's trace
+    trace_id = f"{stream.context.trace_id:032x}"
+    assert provider.headers[0]["traceparent"].split("-")[1] == trace_id
+
+
+def test_request_span_continues_caller_trace(exporter: InMemorySpanExporter) -> None:
+    client = TestClient(tracing.TracingMiddleware(app))
+    trace_id = "4bf92f3577b34da6a3ce929d0e0e4736"
+    r = client.get(
+        f"{settings.API_V1_STR}/utils/health-check/",
+        headers={"traceparent": f"00-{trace_id}-00f067aa0ba902b7-01"},
+    )
+    assert r.status_code == 200
+
+    (span,) = [s for s in exporter.get_finished_spans() if s.name.startswith("GET")]
+    assert span.name == f"GET {settings.API_V1_STR}/utils/health-check/"
+    assert f"{span.context.trace_id:032x}" == trace_id
+    assert span.attributes is not None
+    assert span.attributes["http.response.status_code"] == 200
+
+
+def test_stream_error_is_recorded(exporter: InMemorySpanExporter) -> None:
+    def failing() -> Iterator[str]:
+        yield "a"
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError):
+        list(tracing.traced_stream("failing", failing))
+    (span,) = exporter.get_finished_spans()
+    assert not span.status.is_ok
+    assert [e.name for e in span.events] == ["first_item", "exception"]
@@ -0,0 +1,74 @@
+from app.core.verilog import enclosing_module, parse_modules, strip_comments
+
+CODE = """// counter with enable
+module counter #(parameter WIDTH = 8) (
+    input  wire             clk,
+    input  wire             rst_n, en,
+    output reg [WIDTH-1:0]  count
+);
+    wire tick; /* unused */
+    function [3:0] inc; input [3:0] v; inc = v + 1; endfunction
+    always @(posedge clk or negedge rst_n) begin
+        if (!rst_n) begin
+            count <= 0;
+        end else if (en)
+            count <= count + 1'b1;
+    end
+    assign tick = en;
+endmodule
+
+module legacy(a, y);
+  input [1:0] a;
+  output y;
+  always @* y = a[0];
+endmodule
+"""
+
+
+def test_strip_comments_keeps_offsets() -> None:
+    stripped = strip_comments(CODE)
+    assert len(stripped) == len(CODE)
+    assert "counter with enable" not in stripped
+    assert stripped.index("module counter") == CODE.index("module counter")
+
+
+def test_parse_ansi_module() -> None:
+    counter = parse_modules(CODE)[0]
+    assert counter.name == "counter"
+    assert [(p.name, p.direction, p.width, p.kind) for p in counter.ports] == [
+        ("clk", "input", "", "wire"),
+        ("rst_n", "input", "", "wire"),
+        ("en", "input", "", "wire"),
+        ("count", "output", "[WIDTH-1:0]", "reg"),
+    ]
+    assert [(p.name, p.value) for p in counter.parameters] == [("WIDTH", "8")]
+    assert counter.header.text(CODE).endswith("count\n);")
+    assert [d.text(CODE).strip() for d in counter.declarations] == ["wire tick;"]
+    (block,) = counter.blocks
+    assert block.text(CODE).startswith("always @(posedge clk")
+    assert block.text(CODE).endswith("count + 1'b1;\n    end")
+
+
+def test_parse_non_ansi_module() -> None:
+    legacy = parse_modules(CODE)[1]
+    assert [(p.name, p.direction, p.width) for p in legacy.ports] == [
+        ("a", "input", "[1:0]"),
+        ("y", "output", ""),
+    ]
+    assert [b.text(CODE) for b in legacy.blocks] == ["always @* y = a[0];"]
+
+
+def test_ports_ignore_string_literals() -> None:
+    code = 'module m(input a);\n  initial $display("output y, z");\nendmodule\n'
+    (module,) = parse_modules(code)
+    assert [(p.name, p.direction) for p in module.ports] == [("a", "input")]
+
+
+def test_enclosing_module_while_typing() -> None:
+    code = CODE + "module wip(input a);\n  assign "
+    modules = parse_modules(code)
+    counter = enclosing_module(modules, CODE.index("assign tick"))
+    wip = enclosing_module(modules, len(code))
+    assert counter is not None and counter.name == "counter"
+    assert wip is not None and wip.name == "wip"
+    assert enclosing_module(modules, 0) is None
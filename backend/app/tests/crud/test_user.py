@@ -1,8 +1,10 @@
+import pytest
 from fastapi.encoders import jsonable_encoder
 from sqlmodel import Session
 
 from app import crud
-from app.core.security import verify_password
+from app.core.config import settings
+from app.core.security import get_password_hash, verify_password
 from app.models import User, UserCreate, UserUpdate
 from app.tests.utils.utils import random_email, random_lower_string
 
@@ -26,6 +28,32 @@ def test_authenticate_user(db: Session) -> None:
     assert user.email == authenticated_user.email
 
 
+def test_authenticate_rehashes_with_new_cost(
+    db: Session, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(settings, "BCRYPT_ROUNDS", 4)
+    email = random_email()
+    password = random_lower_string()
+    user = crud.create_user(
+        session=db, user_create=UserCreate(email=email, password=password)
+    )
+    assert user.hashed_password.startswith("$2b$04$")
+    monkeypatch.setattr(settings, "BCRYPT_ROUNDS", 5)
+    authenticated_user = crud.authenticate(session=db, email=email, password=password)
+    assert authenticated_user
+    assert authenticated_user.hashed_password.startswith("$2b$05$")
+    assert verify_password(password, authenticated_user.hashed_password)
+    assert not crud.authenticate(session=db, email=email, password="wrong")
+
+
+def test_password_hashing_without_pool(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "PASSWORD_HASH_WORKERS", 0)
+    monkeypatch.setattr(settings, "BCRYPT_ROUNDS", 4)
+    hashed = get_password_hash("secret")
+    assert verify_password("secret", hashed)
+    assert not verify_password("other", hashed)
+
+
 def test_not_authenticate_user(db: Session) -> None:
     email = random_email()
     password = random_lower_string()
@@ -0,0 +1,100 @@
+import json
+import threading
+from collections.abc import Generator
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any
+
+import pytest
+
+from app.model_profile import build_report, profile_ollama, weight_stats
+
+
+class FakeTensor:
+    def __init__(self, ptr: int, numel: int, element_size: int) -> None:
+        self.ptr = ptr
+        self.count = numel
+        self.size = element_size
+
+    def data_ptr(self) -> int:
+        return self.ptr
+
+    def numel(self) -> int:
+        return self.count
+
+    def element_size(self) -> int:
+        return self.size
+
+
+def test_weight_stats_counts_packed_int8_weights() -> None:
+    embed = FakeTensor(1, 100, 4)
+    state = {
+        "embed.weight": embed,
+        # Tied output head shares the embedding
+        "lm_head.weight": embed,
+        # Dynamic quantization packs (qweight, bias) next to non-tensors
+        "fc._packed_params.dtype": "qint8",
+        "fc._packed_params._packed_params": (FakeTensor(2, 64, 1), FakeTensor(3, 8, 4)),
+        "fc.scale": 0.5,
+    }
+    assert weight_stats(state) == (172, 400 + 64 + 32)
+
+
+class _FakeOllama(BaseHTTPRequestHandler):
+    def log_message(self, *_args: object) -> None:
+        pass
+
+    def reply(self, payload: dict[str, Any]) -> None:
+        body = json.dumps(payload).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self) -> None:
+        self.reply({"models": [{"name": "codeqwen:7b", "size": 4000, "size_vram": 0}]})
+
+    def do_POST(self) -> None:
+        json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.reply(
+            {
+                "load_duration": 2_000_000_000,
+                "prompt_eval_count": 64,
+                "prompt_eval_duration": 500_000_000,
+                "eval_count": 16,
+                "eval_duration": 1_000_000_000,
+            }
+        )
+
+
+@pytest.fixture
+def fake_ollama() -> Generator[str, None, None]:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _FakeOllama)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+
+
+def test_report_shape(fake_ollama: str) -> None:
+    results = profile_ollama(
+        fake_ollama, "codeqwen", [1, 2], prompt_tokens=64, decode_tokens=16
+    )
+    report = json.loads(json.dumps(build_report(results)))
+    assert set(report) == {"timestamp", "git_commit", "host", "results"}
+    assert set(report["host"]) == {"platform", "python", "cpu_count"}
+
+    [entry] = report["results"]
+    assert entry["backend"] == "ollama"
+    assert entry["load_seconds"] == 2.0
+    assert entry["model_bytes"] == 4000
+    assert [b["batch_size"] for b in entry["batches"]] == [1, 2]
+    batch = entry["batches"][1]
+    assert set(batch) == {
+        "batch_size",
+        "prompt_tokens",
+        "decode_tokens",
+        "prefill_tokens_per_second",
+        "decode_tokens_per_second",
+        "wall_seconds",
+    }
+    assert batch["decode_tokens"] == 16
+    assert batch["decode_tokens_per_second"] == 32.0
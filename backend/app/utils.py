@@ -1,10 +1,10 @@
 import logging
 from dataclasses import dataclass
 from datetime import datetime, timedelta, timezone
+from functools import lru_cache
 from pathlib import Path
 from typing import Any
 
-import emails  # type: ignore
 import jwt
 from jinja2 import Template
 from jwt.exceptions import InvalidTokenError
@@ -22,11 +22,17 @@ class EmailData:
     subject: str
 
 
+EMAIL_TEMPLATES = Path(__file__).parent / "email-templates" / "build"
+
+
+@lru_cache
+def email_template(template_name: str) -> Template:
+    template: Template = Template((EMAIL_TEMPLATES / template_name).read_text())
+    return template
+
+
 def render_email_template(*, template_name: str, context: dict[str, Any]) -> str:
-    template_str = (
-        Path(__file__).parent / "email-templates" / "build" / template_name
-    ).read_text()
-    html_content = Template(template_str).render(context)
+    html_content = email_template(template_name).render(context)
     return html_content
 
 
@@ -37,6 +43,8 @@ def send_email(
     html_content: str = "",
 ) -> None:
     assert settings.emails_enabled, "no provided configuration for email variables"
+    import emails  # type: ignore
+
     message = emails.Message(
         subject=subject,
         html=html_content,
@@ -0,0 +1,26 @@
+module alu (
+    input [3:0] op,
+    input [15:0] a,
+    input [15:0] b,
+    output reg [15:0] y,
+    output zero,
+    output reg carry
+);
+    always @(*) begin
+        carry = 1'b0;
+        case (op)
+            4'd0: {carry, y} = a + b;
+            4'd1: {carry, y} = a - b;
+            4'd2: y = a & b;
+            4'd3: y = a | b;
+            4'd4: y = a ^ b;
+            4'd5: y = ~a;
+            4'd6: y = a << b[3:0];
+            4'd7: y = a >> b[3:0];
+            4'd8: y = ($signed(a) < $signed(b)) ? 16'd1 : 16'd0;
+            default: y = 16'd0;
+        endcase
+    end
+
+    assign zero = (y == 16'd0);
+endmodule
@@ -0,0 +1,22 @@
+module alu_tb;
+    reg [3:0] op;
+    reg [15:0] a, b;
+    wire [15:0] y;
+    wire zero, carry;
+    integer i;
+
+    alu dut (.op(op), .a(a), .b(b), .y(y), .zero(zero), .carry(carry));
+
+    initial begin
+        $dumpfile("test.vcd");
+        $dumpvars(0, alu_tb);
+        for (i = 0; i < 512; i = i + 1) begin
+            op = i % 10;
+            a = i * 37;
+            b = i * 11 + 3;
+            #5;
+        end
+        $display("last y=%h zero=%b carry=%b", y, zero, carry);
+        $finish;
+    end
+endmodule
@@ -0,0 +1,13 @@
+module counter #(parameter WIDTH = 8) (
+    input clk,
+    input rst_n,
+    input en,
+    output reg [WIDTH-1:0] count
+);
+    always @(posedge clk or negedge rst_n) begin
+        if (!rst_n)
+            count <= {WIDTH{1'b0}};
+        else if (en)
+            count <= count + 1'b1;
+    end
+endmodule
@@ -0,0 +1,18 @@
+module counter_tb;
+    reg clk = 0, rst_n = 0, en = 0;
+    wire [7:0] count;
+
+    counter dut (.clk(clk), .rst_n(rst_n), .en(en), .count(count));
+
+    always #5 clk = ~clk;
+
+    initial begin
+        $dumpfile("test.vcd");
+        $dumpvars(0, counter_tb);
+        #12 rst_n = 1;
+        en = 1;
+        repeat (300) @(posedge clk);
+        $display("count=%d", count);
+        $finish;
+    end
+endmodule
@@ -0,0 +1,36 @@
+module fifo #(
+    parameter WIDTH = 8,
+    parameter DEPTH = 16,
+    parameter ADDR = 4
+) (
+    input clk,
+    input rst,
+    input wr_en,
+    input rd_en,
+    input [WIDTH-1:0] din,
+    output reg [WIDTH-1:0] dout,
+    output full,
+    output empty
+);
+    reg [WIDTH-1:0] mem [0:DEPTH-1];
+    reg [ADDR:0] wr_ptr, rd_ptr;
+
+    assign empty = (wr_ptr == rd_ptr);
+    assign full = (wr_ptr[ADDR] != rd_ptr[ADDR]) && (wr_ptr[ADDR-1:0] == rd_ptr[ADDR-1:0]);
+
+    always @(posedge clk) begin
+        if (rst) begin
+            wr_ptr <= 0;
+            rd_ptr <= 0;
+        end else begin
+            if (wr_en && !full) begin
+                mem[wr_ptr[ADDR-1:0]] <= din;
+                wr_ptr <= wr_ptr + 1'b1;
+            end
+            if (rd_en && !empty) begin
+                dout <= mem[rd_ptr[ADDR-1:0]];
+                rd_ptr <= rd_ptr + 1'b1;
+            end
+        end
+    end
+endmodule
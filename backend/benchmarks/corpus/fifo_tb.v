@@ -0,0 +1,28 @@
+module fifo_tb;
+    reg clk = 0, rst = 1, wr_en = 0, rd_en = 0;
+    reg [7:0] din = 0;
+    wire [7:0] dout;
+    wire full, empty;
+
+    fifo dut (
+        .clk(clk), .rst(rst), .wr_en(wr_en), .rd_en(rd_en),
+        .din(din), .dout(dout), .full(full), .empty(empty)
+    );
+
+    always #5 clk = ~clk;
+
+    initial begin
+        $dumpfile("test.vcd");
+        $dumpvars(0, fifo_tb);
+        repeat (2) @(posedge clk);
+        rst = 0;
+        repeat (200) begin
+            @(negedge clk);
+            wr_en = $random;
+            rd_en = $random;
+            din = $random;
+        end
+        $display("full=%b empty=%b", full, empty);
+        $finish;
+    end
+endmodule
@@ -0,0 +1,65 @@
+module uart_tx #(parameter CLKS_PER_BIT = 16) (
+    input clk,
+    input rst_n,
+    input start,
+    input [7:0] data,
+    output reg tx,
+    output reg busy
+);
+    localparam IDLE = 2'd0, START = 2'd1, DATA = 2'd2, STOP = 2'd3;
+
+    reg [1:0] state;
+    reg [7:0] shift;
+    reg [2:0] bit_idx;
+    reg [$clog2(CLKS_PER_BIT)-1:0] clk_cnt;
+
+    always @(posedge clk or negedge rst_n) begin
+        if (!rst_n) begin
+            state <= IDLE;
+            tx <= 1'b1;
+            busy <= 1'b0;
+            clk_cnt <= 0;
+            bit_idx <= 0;
+        end else begin
+            case (state)
+                IDLE: begin
+                    tx <= 1'b1;
+                    busy <= 1'b0;
+                    if (start) begin
+                        shift <= data;
+                        busy <= 1'b1;
+                        state <= START;
+                    end
+                end
+                START: begin
+                    tx <= 1'b0;
+                    if (clk_cnt == CLKS_PER_BIT - 1) begin
+                        clk_cnt <= 0;
+                        state <= DATA;
+                    end else
+                        clk_cnt <= clk_cnt + 1'b1;
+                end
+                DATA: begin
+                    tx <= shift[bit_idx];
+                    if (clk_cnt == CLKS_PER_BIT - 1) begin
+                        clk_cnt <= 0;
+                        if (bit_idx == 3'd7) begin
+                            bit_idx <= 0;
+                            state <= STOP;
+                        end else
+                            bit_idx <= bit_idx + 1'b1;
+                    end else
+                        clk_cnt <= clk_cnt + 1'b1;
+                end
+                STOP: begin
+                    tx <= 1'b1;
+                    if (clk_cnt == CLKS_PER_BIT - 1) begin
+                        clk_cnt <= 0;
+                        state <= IDLE;
+                    end else
+                        clk_cnt <= clk_cnt + 1'b1;
+                end
+            endcase
+        end
+    end
+endmodule
@@ -0,0 +1,26 @@
+module uart_tx_tb;
+    reg clk = 0, rst_n = 0, start = 0;
+    reg [7:0] data = 8'h00;
+    wire tx, busy;
+    integer n;
+
+    uart_tx dut (.clk(clk), .rst_n(rst_n), .start(start), .data(data), .tx(tx), .busy(busy));
+
+    always #5 clk = ~clk;
+
+    initial begin
+        $dumpfile("test.vcd");
+        $dumpvars(0, uart_tx_tb);
+        #20 rst_n = 1;
+        for (n = 0; n < 8; n = n + 1) begin
+            @(negedge clk);
+            data = 8'hA5 ^ n;
+            start = 1;
+            @(negedge clk);
+            start = 0;
+            wait (!busy);
+        end
+        $display("sent %0d bytes", n);
+        $finish;
+    end
+endmodule
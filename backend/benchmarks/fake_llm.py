@@ -0,0 +1,373 @@
+"""
+Fake LLM server for offline tests and benchmarks.
+
+Streams canned Verilog over the protocols of every provider the backend
+routes to, with a configurable time to first token, inter-token delay,
+chunk size and injected failures, so runs measure the backend rather than a
+model and need no network access or credentials:
+
+- OpenAI chat completions (``POST /v1/chat/completions``): SSE chunks, the
+  final usage chunk when ``stream_options.include_usage`` is set, and
+  non-streaming responses with ``n`` choices. Point ``OPENAI_BASE_URL`` at
+  ``<url>/v1`` (any ``OPENAI_API_KEY`` works).
+- Vertex AI ``streamRawPredict`` for Codestral (``POST
+  /v1/projects/.../models/<model>:streamRawPredict``): SSE chunks in the
+  Mistral format, usage on the final one, for both FIM prompts and chat
+  messages. Set
+  ``VERTEX_BASE_URL`` to ``<url>`` and ``VERTEX_ACCESS_TOKEN`` to anything.
+- The llama.cpp server API of the local provider (``GET /health``,
+  ``POST /infill``; chat shares the OpenAI route). Set ``LOCAL_LLM_BASE_URL``
+  to ``<url>`` and ``LOCAL_LLM_SERVER=llamacpp``.
+
+Failures are drawn from a seeded generator, so a run is reproducible:
+``error_rate`` of the requests are rejected with ``error_status`` (429s carry
+``Retry-After``) and ``drop_rate`` of the streams are cut off after
+``drop_after_tokens`` tokens.
+
+    python -m benchmarks.fake_llm --port 8090 --ttft-ms 150 --inter-token-ms 15
+"""
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from collections.abc import Iterator
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any
+
+RESPONSES = {
+    # Code completions (FIM and plain prompts)
+    "completion": """always @(posedge clk or negedge rst_n) begin
+        if (!rst_n)
+            count <= 0;
+        else if (en)
+            count <= count + 1'b1;
+    end""",
+    # Testbench stimulus (the backend builds the rest of the testbench)
+    "testbench": """@(posedge clk);
+en = 1;
+repeat (20) @(posedge clk);
+$display("count=%d", count);
+en = 0;
+#20;
+$display("count=%d", count);""",
+    # Conversation summaries
+    "summary": "The user is building an 8-bit counter with an active-low reset and an enable input.",
+    "chat": """I've added an **enable input** so the counter only advances when `en` is high.
+
+```verilog
+module counter #(parameter WIDTH = 8) (
+    input clk,
+    input rst_n,
+    input en,
+    output reg [WIDTH-1:0] count
+);
+    always @(posedge clk or negedge rst_n) begin
+        if (!rst_n)
+            count <= {WIDTH{1'b0}};
+        else if (en)
+            count <= count + 1'b1;
+    end
+endmodule
+```""",
+}
+
+# Roughly one token per word piece, as BPE tokenizers split code
+_TOKEN = re.compile(r"\s*\S{1,4}|\s+")
+
+_VERTEX_PATH = re.compile(
+    r"^/v1/projects/[^/]+/locations/[^/]+/publishers/[^/]+/models/([^/:]+):streamRawPredict$"
+)
+
+
+def tokens(text: str) -> list[str]:
+    return _TOKEN.findall(text)
+
+
+@dataclass
+class FakeLLMConfig:
+    ttft_ms: float = 150.0
+    inter_token_ms: float = 15.0
+    # Tokens per streamed chunk
+    chunk_tokens: int = 1
+    error_rate: float = 0.0
+    error_status: int = 503
+    drop_rate: float = 0.0
+    drop_after_tokens: int = 5
+    seed: int = 0
+    responses: dict[str, str] = field(default_factory=lambda: dict(RESPONSES))
+
+
+def response_kind(messages: list[dict[str, str]]) -> str:
+    system = next(
+        (m["content"] for m in messages if m.get("role") == "system"), ""
+    ).lower()
+    if "testbench" in system:
+        return "testbench"
+    if system.startswith("summarize"):
+        return "summary"
+    if "completion" in system:
+        return "completion"
+    return "chat"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: "FakeLLMServer"
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format: str, *args: Any) -> None:  # noqa: A002
+        pass
+
+    def _json_body(self) -> dict[str, Any]:
+        length = int(self.headers.get("Content-Length") or 0)
+        body: dict[str, Any] = json.loads(self.rfile.read(length) or b"{}")
+        return body
+
+    def _send_json(
+        self, status: int, body: Any, headers: dict[str, str] | None = None
+    ) -> None:
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self) -> None:
+        if self.path == "/health":
+            self._send_json(200, {"status": "ok"})
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self) -> None:
+        payload = self._json_body()
+        self.server.record(self.path, payload, dict(self.headers))
+
+        vertex = _VERTEX_PATH.match(self.path)
+        if self.path == "/infill":
+            kind, limit = "completion", payload.get("n_predict", 150)
+        elif self.path == "/v1/chat/completions" or vertex:
+            if "messages" in payload:
+                kind = response_kind(payload["messages"])
+            else:
+                # Codestral FIM prompt
+                kind = "completion"
+            limit = payload.get("max_tokens") or 1000
+        else:
+            self._send_json(404, {"error": "not found"})
+            return
+
+        failure = self.server.draw_failure()
+        if failure == "error":
+            status = self.server.config.error_status
+            headers = {"Retry-After": "1"} if status == 429 else {}
+            self._send_json(
+                status,
+                {"error": {"message": "injected failure", "code": status}},
+                headers,
+            )
+            return
+
+        pieces = tokens(self.server.config.responses[kind])[:limit]
+        if self.path == "/infill":
+            self._stream(
+                ({"content": p, "stop": False} for p in self._chunks(pieces)), failure
+            )
+        elif not payload.get("stream"):
+            self._complete(payload, pieces)
+        else:
+            self._stream(
+                self._openai_chunks(payload, pieces, vertex is not None), failure
+            )
+
+    def _chunks(self, pieces: list[str]) -> Iterator[str]:
+        size = max(self.server.config.chunk_tokens, 1)
+        for i in range(0, len(pieces), size):
+            yield "".join(pieces[i : i + size])
+
+    def _openai_chunks(
+        self, payload: dict[str, Any], pieces: list[str], vertex: bool
+    ) -> Iterator[dict[str, Any]]:
+        base = {
+            "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": payload.get("model", "fake"),
+        }
+        n = payload.get("n") or 1
+        for text in self._chunks(pieces):
+            for i in range(n):
+                choice = {"index": i, "delta": {"content": text}, "finish_reason": None}
+                yield {**base, "choices": [choice]}
+        stops = [{"index": i, "delta": {}, "finish_reason": "stop"} for i in range(n)]
+        last = {**base, "choices": stops}
+        if vertex:
+            # Mistral reports usage on the last chunk, without cache details
+            usage = self._usage(payload, len(pieces))
+            del usage["prompt_tokens_details"]
+            last["usage"] = usage
+        yield last
+        if not vertex and payload.get("stream_options", {}).get("include_usage"):
+            yield {
+                **base,
+                "choices": [],
+                "usage": self._usage(payload, len(pieces) * n),
+            }
+
+    def _usage(self, payload: dict[str, Any], completion_tokens: int) -> dict[str, Any]:
+        prompt = json.dumps(payload.get("messages") or payload.get("prompt", ""))
+        prompt_tokens = len(tokens(prompt))
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "prompt_tokens_details": {"cached_tokens": 0},
+        }
+
+    def _complete(self, payload: dict[str, Any], pieces: list[str]) -> None:
+        time.sleep(self.server.config.ttft_ms / 1000)
+        text = "".join(pieces)
+        n = payload.get("n") or 1
+        self._send_json(
+            200,
+            {
+                "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": payload.get("model", "fake"),
+                "choices": [
+                    {
+                        "index": i,
+                        "message": {"role": "assistant", "content": text},
+                        "finish_reason": "stop",
+                    }
+                    for i in range(n)
+                ],
+                "usage": self._usage(payload, len(pieces) * n),
+            },
+        )
+
+    def _stream(self, events: Iterator[dict[str, Any]], failure: str | None) -> None:
+        config = self.server.config
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        # Chunked, so a dropped stream is an incomplete body rather than a short one
+        self.send_header("Transfer-Encoding", "chunked")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        time.sleep(config.ttft_ms / 1000)
+        sent = 0
+        try:
+            for i, event in enumerate(events):
+                if i:
+                    time.sleep(config.inter_token_ms / 1000)
+                if failure == "drop" and sent >= config.drop_after_tokens:
+                    # Cut the connection mid-stream, without the last chunk
+                    return
+                self._write_chunk(f"data: {json.dumps(event)}\n\n".encode())
+                sent += max(config.chunk_tokens, 1)
+            self._write_chunk(b"data: [DONE]\n\n")
+            self._write_chunk(b"")
+        except (BrokenPipeError, ConnectionResetError):
+            # The backend cancelled the stream
+            pass
+
+    def _write_chunk(self, data: bytes) -> None:
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+
+class FakeLLMServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port: int = 0, config: FakeLLMConfig | None = None) -> None:
+        super().__init__(("127.0.0.1", port), _Handler)
+        self.config = config or FakeLLMConfig()
+        self._lock = threading.Lock()
+        self._random = random.Random(self.config.seed)
+        # (path, payload, headers) of every POST, for assertions in tests
+        self.requests: list[tuple[str, dict[str, Any], dict[str, str]]] = []
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def record(
+        self, path: str, payload: dict[str, Any], headers: dict[str, str]
+    ) -> None:
+        with self._lock:
+            self.requests.append((path, payload, headers))
+
+    def draw_failure(self) -> str | None:
+        with self._lock:
+            draw = self._random.random()
+        if draw < self.config.error_rate:
+            return "error"
+        if draw < self.config.error_rate + self.config.drop_rate:
+            return "drop"
+        return None
+
+    def start(self) -> "FakeLLMServer":
+        threading.Thread(
+            target=self.serve_forever, name="fake-llm", daemon=True
+        ).start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--ttft-ms", type=float, default=150.0)
+    parser.add_argument("--inter-token-ms", type=float, default=15.0)
+    parser.add_argument("--chunk-tokens", type=int, default=1)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--drop-rate", type=float, default=0.0)
+    parser.add_argument("--drop-after-tokens", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--responses",
+        type=Path,
+        help="JSON object overriding the canned responses (completion, testbench, summary, chat)",
+    )
+
+
+def config_from_args(args: argparse.Namespace) -> FakeLLMConfig:
+    responses = dict(RESPONSES)
+    if args.responses:
+        responses.update(json.loads(args.responses.read_text()))
+    return FakeLLMConfig(
+        ttft_ms=args.ttft_ms,
+        inter_token_ms=args.inter_token_ms,
+        chunk_tokens=args.chunk_tokens,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        drop_rate=args.drop_rate,
+        drop_after_tokens=args.drop_after_tokens,
+        seed=args.seed,
+        responses=responses,
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--port", type=int, default=8090)
+    add_arguments(parser)
+    args = parser.parse_args()
+    server = FakeLLMServer(args.port, config_from_args(args))
+    print(f"Fake LLM listening on {server.url}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,426 @@
+"""
+Load test for the Verilog endpoints.
+
+Starts the fake LLM server and a backend (uvicorn) wired to it, then drives
+each scenario with the designs in ``benchmarks/corpus`` at a fixed
+concurrency and prints a JSON report: throughput, latency percentiles, time
+to first event for streaming endpoints and the error rate. iverilog and
+verilator are real; scenarios whose tool is not installed are reported as
+skipped.
+
+    python -m benchmarks.run --concurrency 8 --requests 200 --output bench.json
+    python -m benchmarks.run --baseline bench.json   # exit 1 on a regression
+
+Use ``--target`` to benchmark an already running backend instead; its LLM
+providers must then point at a fake server started separately
+(``python -m benchmarks.fake_llm``).
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import time
+from collections.abc import Callable
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any
+
+import httpx
+
+from benchmarks.fake_llm import FakeLLMServer, add_arguments, config_from_args
+
+CORPUS = Path(__file__).parent / "corpus"
+API = "/api/v1"
+
+
+@dataclass(frozen=True)
+class Design:
+    name: str
+    code: str
+    testbench: str
+
+    @property
+    def prefix(self) -> str:
+        """The code up to the middle of the module, as if the user were typing there."""
+        lines = self.code.splitlines(True)
+        return "".join(lines[: max(len(lines) // 2, 1)])
+
+
+def load_corpus() -> list[Design]:
+    return [
+        Design(path.stem, path.read_text(), (CORPUS / f"{path.stem}_tb.v").read_text())
+        for path in sorted(CORPUS.glob("*.v"))
+        if not path.stem.endswith("_tb")
+    ]
+
+
+@dataclass(frozen=True)
+class Scenario:
+    name: str
+    path: str
+    body: Callable[[Design, int], dict[str, Any]]
+    stream: bool = False
+    # Send the body as a form instead of JSON
+    form: bool = False
+    # Executable the endpoint needs on the backend host
+    requires: str | None = None
+
+
+def login_form(_design: Design, _i: int) -> dict[str, Any]:
+    """The first superuser's credentials, from the same settings the backend reads."""
+    from app.core.config import settings
+
+    return {
+        "username": settings.FIRST_SUPERUSER,
+        "password": settings.FIRST_SUPERUSER_PASSWORD,
+    }
+
+
+SCENARIOS = [
+    Scenario(
+        "lint", f"{API}/lint/", lambda d, _: {"code": d.code}, requires="verilator"
+    ),
+    Scenario(
+        "simulate",
+        f"{API}/simulate/",
+        lambda d, _: {"code": d.code, "testbench": d.testbench},
+        requires="iverilog",
+    ),
+    Scenario("generate", f"{API}/generate/", lambda d, _: {"prompt": d.prefix}),
+    Scenario(
+        "generate_stream",
+        f"{API}/generate/stream",
+        lambda d, _: {"prompt": d.prefix},
+        stream=True,
+    ),
+    Scenario(
+        "chat_stream",
+        f"{API}/chat/stream",
+        lambda d, i: {
+            "messages": [{"role": "user", "content": f"Add an enable input ({i})"}],
+            "context": {"code": d.code, "file_path": f"{d.name}.v"},
+        },
+        stream=True,
+    ),
+    Scenario("tb", f"{API}/tb/", lambda d, _: {"prompt": d.code}),
+    # A burst of logins: bcrypt-bound, needs the backend's database
+    Scenario("login", f"{API}/login/access-token", login_form, form=True),
+]
+
+
+@dataclass
+class Result:
+    latencies: list[float] = field(default_factory=list)
+    first_event: list[float] = field(default_factory=list)
+    errors: dict[str, int] = field(default_factory=dict)
+
+    def error(self, kind: str) -> None:
+        self.errors[kind] = self.errors.get(kind, 0) + 1
+
+
+def percentile(values: list[float], q: float) -> float | None:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+def summary(values: list[float]) -> dict[str, float | None]:
+    return {
+        f"p{int(q * 100)}": round(v * 1000, 2)
+        if (v := percentile(values, q)) is not None
+        else None
+        for q in (0.5, 0.95, 0.99)
+    }
+
+
+async def _request(
+    client: httpx.AsyncClient, scenario: Scenario, body: dict[str, Any], result: Result
+) -> None:
+    started = time.perf_counter()
+    try:
+        if scenario.stream:
+            async with client.stream("POST", scenario.path, json=body) as response:
+                if response.status_code >= 400:
+                    result.error(str(response.status_code))
+                    return
+                first = True
+                async for line in response.aiter_lines():
+                    if not line.startswith("data: "):
+                        continue
+                    if first:
+                        result.first_event.append(time.perf_counter() - started)
+                        first = False
+                    if '"error"' in line:
+                        result.error("stream error")
+                        return
+        else:
+            if scenario.form:
+                response = await client.post(scenario.path, data=body)
+            else:
+                response = await client.post(scenario.path, json=body)
+            if response.status_code >= 400:
+                result.error(str(response.status_code))
+                return
+    except httpx.HTTPError as e:
+        result.error(type(e).__name__)
+        return
+    result.latencies.append(time.perf_counter() - started)
+
+
+async def run_scenario(
+    base_url: str,
+    scenario: Scenario,
+    corpus: list[Design],
+    concurrency: int,
+    requests: int,
+    warmup: int,
+) -> dict[str, Any]:
+    limits = httpx.Limits(
+        max_connections=concurrency, max_keepalive_connections=concurrency
+    )
+    async with httpx.AsyncClient(
+        base_url=base_url, timeout=120, limits=limits
+    ) as client:
+
+        async def worker(indices: "asyncio.Queue[int]", result: Result) -> None:
+            while True:
+                try:
+                    i = indices.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                design = corpus[i % len(corpus)]
+                await _request(client, scenario, scenario.body(design, i), result)
+
+        async def phase(count: int) -> tuple[Result, float]:
+            indices: asyncio.Queue[int] = asyncio.Queue()
+            for i in range(count):
+                indices.put_nowait(i)
+            result = Result()
+            started = time.perf_counter()
+            await asyncio.gather(*(worker(indices, result) for _ in range(concurrency)))
+            return result, time.perf_counter() - started
+
+        await phase(warmup)
+        result, elapsed = await phase(requests)
+
+    failed = sum(result.errors.values())
+    report: dict[str, Any] = {
+        "requests": requests,
+        "errors": failed,
+        "error_rate": round(failed / requests, 4) if requests else 0.0,
+        "error_kinds": result.errors,
+        "throughput_rps": round(len(result.latencies) / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": summary(result.latencies),
+    }
+    if scenario.stream:
+        report["first_event_ms"] = summary(result.first_event)
+    return report
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port: int = s.getsockname()[1]
+        return port
+
+
+def provider_env(fake_llm_url: str, provider: str) -> dict[str, str]:
+    """Settings that send every LLM request class to ``provider``, served by the fake server."""
+    providers = json.dumps([provider])
+    return {
+        "LOCAL_LLM_BASE_URL": fake_llm_url,
+        "LOCAL_LLM_SERVER": "llamacpp",
+        "OPENAI_BASE_URL": f"{fake_llm_url}/v1",
+        "OPENAI_API_KEY": "fake",
+        "VERTEX_BASE_URL": fake_llm_url,
+        "VERTEX_ACCESS_TOKEN": "fake",
+        "LLM_ROUTING": "ordered",
+        "LLM_COMPLETION_PROVIDERS": providers,
+        "LLM_CHAT_PROVIDERS": providers,
+        "LLM_TESTBENCH_PROVIDERS": providers,
+    }
+
+
+def start_backend(
+    fake_llm_url: str, workers: int, provider: str = "local", cache: bool = False
+) -> tuple[subprocess.Popen[bytes], str]:
+    """uvicorn serving app.main with every LLM request class routed to the fake server."""
+    port = free_port()
+    # The scenarios repeat the same few designs, which would all be cache hits
+    no_cache = (
+        {}
+        if cache
+        else {
+            "CACHE_LINT_TTL_SECONDS": "0",
+            "CACHE_SIMULATE_TTL_SECONDS": "0",
+            "CACHE_COMPLETION_TTL_SECONDS": "0",
+        }
+    )
+    env = {
+        **os.environ,
+        **provider_env(fake_llm_url, provider),
+        **no_cache,
+        # The benchmark is a single client IP
+        "RATE_LIMIT_IP_RPM": "1000000000",
+        "RATE_LIMIT_IP_TPM": "1000000000000",
+    }
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "app.main:app",
+            "--host",
+            "127.0.0.1",
+            "--port",
+            str(port),
+            "--workers",
+            str(workers),
+            "--log-level",
+            "warning",
+        ],
+        cwd=Path(__file__).parent.parent,
+        env=env,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Backend exited with {process.returncode}")
+        try:
+            if (
+                httpx.get(f"{base_url}{API}/utils/health-check/", timeout=1).status_code
+                == 200
+            ):
+                return process, base_url
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("Backend did not become healthy within 60s")
+
+
+def regressions(
+    report: dict[str, Any], baseline: dict[str, Any], tolerance: float
+) -> list[str]:
+    """Scenarios whose p95 latency or error rate got worse than the baseline allows."""
+    found = []
+    for name, current in report["scenarios"].items():
+        previous = baseline.get("scenarios", {}).get(name)
+        if not previous or "skipped" in current or "skipped" in previous:
+            continue
+        p95, old_p95 = current["latency_ms"]["p95"], previous["latency_ms"]["p95"]
+        if p95 is not None and old_p95 and p95 > old_p95 * (1 + tolerance):
+            found.append(f"{name}: p95 {old_p95}ms -> {p95}ms")
+        if current["error_rate"] > previous["error_rate"] + 0.01:
+            found.append(
+                f"{name}: error rate {previous['error_rate']} -> {current['error_rate']}"
+            )
+    return found
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--scenarios", nargs="*", default=[s.name for s in SCENARIOS])
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=100, help="per scenario")
+    parser.add_argument(
+        "--warmup", type=int, default=None, help="default: --concurrency"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=1, help="backend worker processes"
+    )
+    parser.add_argument(
+        "--provider",
+        choices=["local", "openai", "vertex"],
+        default="local",
+        help="provider protocol the backend uses to reach the fake server",
+    )
+    parser.add_argument(
+        "--cache",
+        action="store_true",
+        help="keep the result caches on (repeated designs hit them)",
+    )
+    add_arguments(parser)
+    parser.add_argument("--target", help="base URL of a running backend")
+    parser.add_argument("--output", type=Path)
+    parser.add_argument("--baseline", type=Path, help="report to compare against")
+    parser.add_argument(
+        "--tolerance", type=float, default=0.2, help="allowed p95 increase"
+    )
+    args = parser.parse_args()
+
+    corpus = load_corpus()
+    warmup = args.concurrency if args.warmup is None else args.warmup
+    fake_config = config_from_args(args)
+    fake = backend = None
+    if args.target:
+        base_url = args.target.rstrip("/")
+    else:
+        fake = FakeLLMServer(config=fake_config).start()
+        backend, base_url = start_backend(
+            fake.url, args.workers, args.provider, args.cache
+        )
+
+    report: dict[str, Any] = {
+        "config": {
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "workers": args.workers,
+            "provider": args.provider,
+            "cache": args.cache,
+            "fake_llm": {
+                k: v for k, v in vars(fake_config).items() if k != "responses"
+            },
+            "corpus": [d.name for d in corpus],
+        },
+        "scenarios": {},
+    }
+    try:
+        for scenario in SCENARIOS:
+            if scenario.name not in args.scenarios:
+                continue
+            if (
+                scenario.requires
+                and not args.target
+                and shutil.which(scenario.requires) is None
+            ):
+                report["scenarios"][scenario.name] = {
+                    "skipped": f"{scenario.requires} not installed"
+                }
+                continue
+            report["scenarios"][scenario.name] = asyncio.run(
+                run_scenario(
+                    base_url, scenario, corpus, args.concurrency, args.requests, warmup
+                )
+            )
+    finally:
+        if backend is not None:
+            backend.terminate()
+            backend.wait()
+        if fake is not None:
+            fake.stop()
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        args.output.write_text(output + "\n")
+    print(output)
+
+    if args.baseline:
+        found = regressions(
+            report, json.loads(args.baseline.read_text()), args.tolerance
+        )
+        for line in found:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        return 1 if found else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -46,19 +46,49 @@ const App: React.FC = () => {
   const handleTestbench = () => {
     setLoadingTestbench(true);
     setErrorTestbench(null);
-    const tbprompt = `
-You are a Verilog verification expert. Given this module, generate a complete testbench. Only return the testbench,starting from module and ending with endmodule, No explanations, just code:
-${codeValue}
-`;
-    axios
-      .post("https://api.34-83-146-113.nip.io/api/v1/tb/", { prompt: tbprompt })
-      .then((resp) => setTestbenchValue(resp.data.text || ""))
-      .catch((err) =>
-        setErrorTestbench(err.response?.data?.detail || err.message)
-      )
+    setTestbenchValue("");
+    // The backend builds the testbench prompt around the module itself
+    streamTestbench(codeValue)
+      .catch((err) => setErrorTestbench(err.message))
       .finally(() => setLoadingTestbench(false));
   };
 
+  // The testbench streams in as server-sent events so it renders while it
+  // is being generated
+  const streamTestbench = async (prompt: string) => {
+    const token = localStorage.getItem("access_token");
+    const resp = await fetch("https://api.34-83-146-113.nip.io/api/v1/tb/stream", {
+      method: "POST",
+      headers: {
+        "Content-Type": "application/json",
+        ...(token ? { Authorization: `Bearer ${token}` } : {}),
+      },
+      body: JSON.stringify({ prompt }),
+    });
+    if (!resp.ok || !resp.body) {
+      const body = await resp.json().catch(() => null);
+      throw new Error(body?.detail || `HTTP ${resp.status}`);
+    }
+
+    const reader = resp.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = "";
+    while (true) {
+      const { done, value } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+      const events = buffer.split("\n\n");
+      buffer = events.pop() ?? "";
+      for (const event of events) {
+        if (!event.startsWith("data: ")) continue;
+        const data = JSON.parse(event.slice(6));
+        if (data.error) throw new Error(data.error);
+        if (data.module_name) setActiveTab("testbench");
+        if (data.text) setTestbenchValue((prev) => prev + data.text);
+      }
+    }
+  };
+
   return (
     <Box minH="100vh" bg="#282c34" px={6} py={8} fontFamily="Inter, sans-serif">
       <Heading
@@ -48,6 +48,16 @@ const EditBox: React.FC<TextEditorProps> = ({
   const [markers, setMarkers] = useState<monacoEditor.editor.IMarkerData[]>([]);
   const [isLoadingCompletion, setIsLoadingCompletion] = useState(false);
 
+  // Completion session: the backend cancels older in-flight requests of the
+  // same session as soon as a request with a higher sequence number arrives
+  const completionSessionRef = useRef<string>(crypto.randomUUID());
+  const completionSeqRef = useRef(0);
+  const completionAbortRef = useRef<AbortController | null>(null);
+  // Model version of the document the server last received
+  const sentVersionRef = useRef<number | null>(null);
+  // Candidates in the latest completion response
+  const candidateCountRef = useRef(0);
+
   // Keep latest aiEnabled in a ref
   const aiRef = useRef(aiEnabled);
   useEffect(() => { aiRef.current = aiEnabled }, [aiEnabled]);
@@ -110,7 +120,10 @@ const EditBox: React.FC<TextEditorProps> = ({
   }, []);
 
   // AI SUGGESTIONS with streaming
-  const fetchAICmds = useCallback(() => {
+  // Each candidate is a separate upstream call (and budget charge) unless
+  // the provider returns several choices at once, so typing asks for one
+  // and Alt+] asks for alternatives
+  const fetchAICmds = useCallback((n: number = 1) => {
     const ed = editorRef.current;
     if (suppressRef.current || !ed) return;
     if (!shouldTriggerAI()) return;
@@ -120,71 +133,94 @@ const EditBox: React.FC<TextEditorProps> = ({
     if (!model || !pos) return;
     
     const offset = model.getOffsetAt(pos);
-    const fullText = model.getValue();
-    const ctx = fullText.slice(0, offset);
-    const suffix = fullText.slice(offset);
-    
-    // Get more context (last 500 chars before cursor)
-    const contextWindow = 500;
-    const contextStart = Math.max(0, ctx.length - contextWindow);
-    const contextPrompt = ctx.slice(contextStart);
-    
-    // Get suffix context (next 200 chars)
-    const suffixWindow = 200;
-    const suffixContext = suffix.slice(0, suffixWindow);
-    
-    if (!contextPrompt.trim()) return;
+    if (!model.getValue().slice(0, offset).trim()) return;
 
     setIsLoadingCompletion(true);
+
+    // Abort the previous request; the server stops generating it as well
+    completionAbortRef.current?.abort();
+    const abort = new AbortController();
+    completionAbortRef.current = abort;
+    completionSeqRef.current += 1;
     
-    // Use streaming endpoint for better UX
-    axios.post(`${API_URL}/api/v1/generate/`, { 
-      prompt: contextPrompt, 
-      suffix: suffixContext,
-      max_tokens: 150,
-      temperature: 0.3  // Lower temperature for more deterministic completions
-    })
+    // The server picks the context around the cursor from the whole
+    // document; it keeps the document per session, so only send it when it
+    // changed (or when the server asks for it again)
+    const version = model.getAlternativeVersionId();
+    const request = (withDocument: boolean) => {
+      const body: Record<string, unknown> = {
+        cursor: offset,
+        max_tokens: 150,
+        temperature: 0.3,  // Lower temperature for more deterministic completions
+        n,  // Alternatives, ranked by the server's syntax check
+        session_id: completionSessionRef.current,
+        seq: completionSeqRef.current,
+        // Lets the server tell whether the document it holds is this one
+        document_version: version,
+      };
+      if (withDocument) body.document = model.getValue();
+      // Signed-in users get their own budget instead of sharing their
+      // network address's with everyone behind the same NAT
+      const token = localStorage.getItem("access_token");
+      const headers = token ? { Authorization: `Bearer ${token}` } : {};
+      return axios.post(`${API_URL}/api/v1/generate/`, body, { signal: abort.signal, headers })
+        .then(res => {
+          if (withDocument) sentVersionRef.current = version;
+          return res;
+        });
+    };
+
+    request(sentVersionRef.current !== version)
+      .catch(err => {
+        if (err?.response?.status !== 412) throw err;
+        return request(true);
+      })
       .then(res => {
-        let txt = res.data.text as string;
-        
-        // Additional cleanup
-        txt = txt
-          .replace(/^```(?:verilog)?\s*/, "")
-          .replace(/```$/, "")
-          .replace(/^[\s\n]+/, "")
-          .trimEnd();
-        
-        if (!txt || txt.length < 2) return;
-        
-        // Split by newlines and limit to reasonable length
-        const lines = txt.split('\n');
+        // Ranked alternatives, best first; Monaco shows the first one and
+        // cycles through the rest with Alt+] / Alt+[
+        const candidates = (res.data.candidates?.length ? res.data.candidates : [res.data.text]) as string[];
+        candidateCountRef.current = candidates.length;
         const maxLines = 15;  // Limit to 15 lines for readability
-        const limitedText = lines.slice(0, maxLines).join('\n');
-        
-        const item = {
-          insertText: limitedText,
-          range: {
-            startLineNumber: pos.lineNumber,
-            startColumn: pos.column,
-            endLineNumber: pos.lineNumber,
-            endColumn: pos.column,
-          },
-          label: "✨ AI Suggestion",
-          detail: "Press Tab to accept, Esc to dismiss",
-        };
-        
+        const items = candidates
+          .map(candidate => candidate
+            // Additional cleanup
+            .replace(/^```(?:verilog)?\s*/, "")
+            .replace(/```$/, "")
+            .replace(/^[\s\n]+/, "")
+            .trimEnd())
+          .filter(txt => txt.length >= 2)
+          .map((txt, i) => ({
+            insertText: txt.split('\n').slice(0, maxLines).join('\n'),
+            range: {
+              startLineNumber: pos.lineNumber,
+              startColumn: pos.column,
+              endLineNumber: pos.lineNumber,
+              endColumn: pos.column,
+            },
+            label: "✨ AI Suggestion",
+            detail: candidates.length > 1
+              ? `Suggestion ${i + 1} of ${candidates.length}: Tab to accept, Alt+] for the next one`
+              : "Press Tab to accept, Alt+] for alternatives, Esc to dismiss",
+          }));
+
+        if (!items.length) return;
+
         setCachedSuggestions(prev => {
-          const next = [...prev, item].slice(-cacheSize);
+          const next = [...items, ...prev].slice(0, cacheSize);
           suggestionsRef.current = next;
           return next;
         });
       })
       .catch(err => {
+        // Superseded by a newer request (aborted locally or cancelled server-side)
+        if (axios.isCancel(err) || err?.response?.status === 409) return;
         console.error("AI completion error:", err);
         // Don't show error to user, just silently fail
       })
       .finally(() => {
-        setIsLoadingCompletion(false);
+        if (completionAbortRef.current === abort) {
+          setIsLoadingCompletion(false);
+        }
       });
   }, [cacheSize, shouldTriggerAI]);
 
@@ -289,6 +325,7 @@ const EditBox: React.FC<TextEditorProps> = ({
     editor.onDidChangeModelContent(() => {
       onValueChange?.(editor.getValue());
       triggerLint();
+      candidateCountRef.current = 0;
       if (aiRef.current) {
         suppressRef.current = false;
         suggestionsRef.current = [];
@@ -297,7 +334,19 @@ const EditBox: React.FC<TextEditorProps> = ({
       }
     });
 
+    // Alt+] cycles through the alternatives, fetching them the first time
+    editor.addCommand(monacoEditor.KeyMod.Alt | monacoEditor.KeyCode.BracketRight, () => {
+      if (candidateCountRef.current > 1) {
+        editor.trigger("keyboard", "editor.action.inlineSuggest.showNext", {});
+      } else if (aiRef.current) {
+        suppressRef.current = false;
+        fetchAICmds(3);
+      }
+    });
+
     editor.onKeyUp(e => {
+      // Alt+] / Alt+[ browse the current suggestions
+      if (e.altKey || e.keyCode === monacoEditor.KeyCode.Alt) return;
       if (e.keyCode === monacoEditor.KeyCode.Escape) {
         suppressRef.current = true;
         suggestionsRef.current = [];
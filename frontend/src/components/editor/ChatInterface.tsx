@@ -33,6 +33,31 @@ interface ChatInterfaceProps {
   isStreamingCode?: boolean;
 }
 
+interface DocumentEdit {
+  start: number;
+  end: number;
+  text: string;
+}
+
+// Single edit turning `prev` into `next` (common prefix and suffix are kept)
+const diffEdit = (prev: string, next: string): DocumentEdit | null => {
+  if (prev === next) return null;
+  let start = 0;
+  const maxPrefix = Math.min(prev.length, next.length);
+  while (start < maxPrefix && prev[start] === next[start]) start++;
+  let suffix = 0;
+  const maxSuffix = maxPrefix - start;
+  while (
+    suffix < maxSuffix &&
+    prev[prev.length - 1 - suffix] === next[next.length - 1 - suffix]
+  ) suffix++;
+  return {
+    start,
+    end: prev.length - suffix,
+    text: next.slice(start, next.length - suffix),
+  };
+};
+
 const bounce = keyframes`
   0%, 100% { transform: translateY(0); }
   50% { transform: translateY(-5px); }
@@ -44,6 +69,10 @@ const ChatInterface: React.FC<ChatInterfaceProps> = ({ editorContent, onSuggestC
   const [isLoading, setIsLoading] = useState(false);
   const [isOpen, setIsOpen] = useState(true);
   const messagesEndRef = useRef<HTMLDivElement>(null);
+  // The server keeps the document and history per conversation; we only
+  // send edits since the last synced version and the new message
+  const conversationIdRef = useRef<string>(crypto.randomUUID());
+  const syncedRef = useRef<{ version: number; document: string } | null>(null);
   const { showErrorToast } = useCustomToast();
   const { colorMode } = useColorMode();
   
@@ -83,20 +112,48 @@ const ChatInterface: React.FC<ChatInterfaceProps> = ({ editorContent, onSuggestC
 
     const API_URL = import.meta.env.VITE_API_URL || "http://localhost:8000";
     try {
-      const response = await fetch(`${API_URL}/api/v1/chat/stream`, {
-        method: "POST",
-        headers: {
-          "Content-Type": "application/json",
-          "Authorization": `Bearer ${localStorage.getItem("access_token")}`
-        },
-        body: JSON.stringify({
-          messages: [...messages, userMessage],
+      const send = (fullDocument: boolean, fullHistory: boolean) => {
+        const synced = syncedRef.current;
+        const body: Record<string, unknown> = {
+          conversation_id: conversationIdRef.current,
+          messages: fullHistory ? [...messages, userMessage] : [userMessage],
           context: {
-            code: editorContent,
             language: "verilog",
+            ...(fullDocument ? { code: editorContent } : {}),
           },
-        }),
-      });
+        };
+        if (!fullDocument && synced) {
+          const edit = diffEdit(synced.document, editorContent);
+          if (edit) {
+            body.edits = [edit];
+            body.base_version = synced.version;
+          }
+        }
+        return fetch(`${API_URL}/api/v1/chat/stream`, {
+          method: "POST",
+          headers: {
+            "Content-Type": "application/json",
+            "Authorization": `Bearer ${localStorage.getItem("access_token")}`
+          },
+          body: JSON.stringify(body),
+        });
+      };
+
+      // Offsets are code points on the server, so only send edits for
+      // documents without surrogate pairs
+      const isNew = syncedRef.current === null;
+      let response = await send(isNew || /[\uD800-\uDFFF]/.test(editorContent), isNew);
+      if (response.status === 409) {
+        // Our base version is stale, resend the document
+        response = await send(true, false);
+      } else if (response.status === 412) {
+        // The server forgot the conversation, resend everything
+        response = await send(true, true);
+      }
+      const version = response.headers.get("X-Conversation-Version");
+      if (response.ok && version !== null) {
+        syncedRef.current = { version: Number(version), document: editorContent };
+      }
 
       if (!response.ok) {
         throw new Error("Failed to fetch chat response");